@@ -0,0 +1,148 @@
+# Recent /chat answers by normalized message. Near-duplicate messages (speech
+# recognition punctuating, spacing or spelling the same request differently)
+# are found through a character n-gram index and scored by Dice similarity,
+# so a previous answer can be reused, or served when Gemini cannot answer
+# within a request's deadline. Messages that differ in a number, a negation or
+# a direction ("turn the LED on" / "off", "80 degrees" / "40 degrees") are
+# close in n-grams but ask for something else, so only messages with the same
+# such words are compared at all.
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+MAX_ENTRIES = 512
+
+# Character n-gram length and the similarity a cached message needs to count as the same request
+NGRAM = 3
+DEFAULT_THRESHOLD = 0.8
+
+# Words that change what a request asks for however similar the rest is; negations count as one
+NEGATIONS = {'not', 'no', 'never', 'dont', 'doesnt', 'didnt', 'cant', 'cannot', 'wont', 'isnt', 'arent', 'shouldnt'}
+OPPOSITES = {'on', 'off', 'open', 'close', 'start', 'stop', 'up', 'down', 'left', 'right', 'enable', 'disable',
+             'increase', 'decrease', 'more', 'less', 'higher', 'lower', 'faster', 'slower', 'yes'}
+NUMBER_WORDS = {'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven',
+                'twelve', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety', 'hundred',
+                'half', 'double', 'twice'}
+
+
+def normalize(text):
+    """Lowercase, drop punctuation and collapse whitespace (Malayalam letters and signs are kept)"""
+    return ' '.join(re.sub(r'[^\w\sഀ-ൿ]', ' ', text.lower()).split())
+
+
+def ngrams(normalized):
+    """Set of character n-grams of a normalized message, padded so short words still have some"""
+    padded = f' {normalized} '
+    if len(padded) <= NGRAM:
+        return {padded}
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+def signature(normalized):
+    """Numbers, negations and on/off-style words of a normalized message, in order"""
+    words = []
+    # normalize() splits "don't" into "don t"
+    for token in re.sub(r'\Bn t\b', 'nt', normalized).split():
+        digits = re.findall(r'\d+', token)
+        if digits:
+            words.extend(digits)
+        elif token in NEGATIONS:
+            words.append('not')
+        elif token in OPPOSITES or token in NUMBER_WORDS:
+            words.append(token)
+    return tuple(words)
+
+
+class _Entry:
+    def __init__(self, answer, grams, words):
+        self.answer = answer
+        self.grams = grams
+        self.words = words
+        self.stored_at = time.monotonic()
+
+
+class AnswerCache:
+    """LRU map of (variant, normalized message) -> answer dict, with an n-gram index for fuzzy lookups"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._index = {}    # (variant, n-gram) -> normalized messages containing it
+        self._lock = threading.Lock()
+
+    def get(self, variant, message):
+        key = (variant, normalize(message))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.answer
+
+    def match(self, variant, message, threshold=DEFAULT_THRESHOLD, max_age=None):
+        """Return (answer, score, matched message) for the most similar cached message
+
+        Only messages with the same signature() are candidates. answer is None when
+        the best score is below `threshold` or the entry is older than `max_age`
+        seconds; score and matched message are still reported.
+        """
+        text = normalize(message)
+        grams = ngrams(text)
+        words = signature(text)
+        with self._lock:
+            exact = self._entries.get((variant, text))
+            if exact is not None:
+                best, score = text, 1.0
+            else:
+                # Messages sharing at least one n-gram, by how many they share
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._index.get((variant, gram), ()))
+                best, score = None, 0.0
+                for candidate, common in shared.items():
+                    entry = self._entries[(variant, candidate)]
+                    if entry.words != words:
+                        continue
+                    candidate_score = 2 * common / (len(grams) + len(entry.grams))
+                    if candidate_score > score:
+                        best, score = candidate, candidate_score
+            if best is None or score < threshold:
+                return None, score, best
+            key = (variant, best)
+            entry = self._entries[key]
+            if max_age is not None and time.monotonic() - entry.stored_at > max_age:
+                return None, score, best
+            self._entries.move_to_end(key)
+            return entry.answer, score, best
+
+    def put(self, variant, message, answer):
+        text = normalize(message)
+        key = (variant, text)
+        with self._lock:
+            if key in self._entries:
+                self._unindex(key)
+            entry = self._entries[key] = _Entry(answer, ngrams(text), signature(text))
+            self._entries.move_to_end(key)
+            for gram in entry.grams:
+                self._index.setdefault((variant, gram), set()).add(text)
+            while len(self._entries) > self.max_entries:
+                self._unindex(next(iter(self._entries)))
+
+    def _unindex(self, key):
+        variant, text = key
+        for gram in self._entries.pop(key).grams:
+            messages = self._index.get((variant, gram))
+            if messages is not None:
+                messages.discard(text)
+                if not messages:
+                    del self._index[(variant, gram)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
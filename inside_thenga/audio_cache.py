@@ -0,0 +1,79 @@
+# Synthesized speech by sentence. Thenga's replies repeat a lot of stock
+# sentences (jokes, "LED turned on", status lines), so /tts keeps each
+# sentence's MP3 frames under (voice, normalized sentence) and only
+# synthesizes the sentences of a reply it has not spoken before.
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import metrics
+import mp3
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def normalize(sentence):
+    """NFC and collapsed whitespace; case and punctuation stay, since they change how a sentence is spoken"""
+    return ' '.join(unicodedata.normalize('NFC', sentence).split())
+
+
+class SentenceAudioCache:
+    """LRU map of (voice, normalized sentence) -> (MP3 frames, seconds), bounded in bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Seconds of audio served to /tts clients, by where it came from
+        self.served_seconds = {'cache': 0.0, 'synthesized': 0.0}
+
+    def get(self, voice, sentence):
+        """(MP3 frames, seconds) for the sentence, or None"""
+        key = (voice, normalize(sentence))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache('tts_sentence', entry is not None)
+        return entry
+
+    def put(self, voice, sentence, audio):
+        """Store a synthesized sentence; returns its (MP3 frames, seconds)"""
+        frames = mp3.audio_frames(audio)
+        entry = (frames, mp3.duration(frames))
+        key = (voice, normalize(sentence))
+        if len(frames) > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = entry
+            self._bytes += len(frames)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return entry
+
+    def account(self, source, seconds):
+        """Count audio served from the cache or freshly synthesized"""
+        with self._lock:
+            self.served_seconds[source] += seconds
+        metrics.TTS_AUDIO_SECONDS.inc(seconds, source=source)
+
+    def snapshot(self):
+        with self._lock:
+            served = sum(self.served_seconds.values())
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'served_seconds': {source: round(seconds, 2) for source, seconds in self.served_seconds.items()},
+                'cached_fraction': round(self.served_seconds['cache'] / served, 3) if served else None
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,187 @@
+# In-memory index of the audio directory: name, size, ctime, content hash and
+# duration of every clip. /audio/list, /audio/files and the ESP32 handlers'
+# "is the notification clip there?" checks read it instead of listing and
+# stat'ing the directory on every request. It is rebuilt lazily after the
+# directory changes: on Linux inotify says when (no extra package, through
+# libc), elsewhere the directory's mtime is compared at most once every
+# CHECK_INTERVAL seconds. A rebuild only re-reads files whose mtime or size
+# changed. The server re-indexes files it writes itself with refresh().
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import os
+import threading
+import time
+import wave
+from collections import namedtuple
+
+import logs
+import mp3
+
+log = logs.get_logger('audio_index')
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+# Seconds between directory mtime checks when inotify is not available
+CHECK_INTERVAL = 1.0
+
+# IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_INOTIFY_MASK = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200 | 0x400 | 0x800
+
+AudioFile = namedtuple('AudioFile', 'name path size ctime mtime_ns hash duration')
+
+
+def describe(path, name):
+    """Index entry for one file: stat, SHA-256 (first 16 hex digits) and playing time"""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if name.lower().endswith('.wav'):
+        try:
+            with wave.open(io.BytesIO(data)) as clip:
+                seconds = clip.getnframes() / clip.getframerate()
+        except (wave.Error, EOFError):
+            seconds = None
+    else:
+        seconds = mp3.duration(data) if data else 0.0
+    return AudioFile(name, path, stat.st_size, stat.st_ctime, stat.st_mtime_ns,
+                     hashlib.sha256(data).hexdigest()[:16], round(seconds, 3) if seconds is not None else None)
+
+
+def _inotify_watch(directory):
+    """File descriptor of an inotify watch on directory, or None where inotify is unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), _INOTIFY_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class AudioIndex:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._files = {}
+        self._dir_mtime = None
+        self._checked = 0.0
+        self._stale = threading.Event()
+        self._stale.set()
+        self._lock = threading.Lock()
+        self._watch_fd = None
+        self._watching = None
+        self.rebuilds = 0
+
+    def configure(self, directory):
+        self.directory = directory
+        self._stale.set()
+
+    def _watch(self):
+        """Start an inotify watch on the directory (once per directory)"""
+        if self._watching == self.directory or not os.path.isdir(self.directory):
+            return
+        directory = self.directory
+        fd = _inotify_watch(directory)
+        self._watching = directory
+        if fd is None:
+            log.info('inotify unavailable, watching the audio directory mtime', extra={'fields': {'audio_dir': directory}})
+            return
+        previous, self._watch_fd = self._watch_fd, fd
+        if previous is not None:
+            os.close(previous)
+
+        def read_events():
+            # Any event marks the index stale; the next read rebuilds it
+            while True:
+                try:
+                    if not os.read(fd, 4096):
+                        break
+                except OSError:
+                    break
+                self._stale.set()
+
+        threading.Thread(target=read_events, name='thenga-audio-watch', daemon=True).start()
+
+    def _changed(self, throttle=True):
+        if self._stale.is_set():
+            return True
+        if self._watch_fd is not None and self._watching == self.directory:
+            return False
+        if throttle:
+            now = time.monotonic()
+            if now - self._checked < CHECK_INTERVAL:
+                return False
+            self._checked = now
+        try:
+            return os.stat(self.directory).st_mtime_ns != self._dir_mtime
+        except OSError:
+            return self._dir_mtime is not None
+
+    def _current(self):
+        """The index, rebuilt first if the directory changed"""
+        if not self._changed():
+            return self._files
+        with self._lock:
+            if not self._changed(throttle=False):
+                return self._files
+            self._stale.clear()
+            self._watch()
+            self._files = self._scan(self._files)
+            self.rebuilds += 1
+        return self._files
+
+    def _scan(self, previous):
+        files = {}
+        try:
+            self._dir_mtime = os.stat(self.directory).st_mtime_ns
+            names = os.listdir(self.directory)
+        except OSError:
+            self._dir_mtime = None
+            return files
+        for name in names:
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                known = previous.get(name)
+                if known is not None and (known.mtime_ns, known.size) == (stat.st_mtime_ns, stat.st_size):
+                    files[name] = known
+                else:
+                    files[name] = describe(path, name)
+            except OSError:
+                continue
+        return files
+
+    def get(self, name):
+        """AudioFile for a clip in the directory, or None"""
+        return self._current().get(name)
+
+    def files(self):
+        return sorted(self._current().values(), key=lambda entry: entry.name)
+
+    def refresh(self, name):
+        """Re-index one file after the server wrote or removed it"""
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            files = dict(self._files)
+            try:
+                files[name] = describe(path, name)
+            except OSError:
+                files.pop(name, None)
+            self._files = files
+        return files.get(name)
+
+    def snapshot(self):
+        files = self.files()
+        return {
+            'files': len(files),
+            'bytes': sum(entry.size for entry in files),
+            'seconds': round(sum(entry.duration or 0 for entry in files), 2),
+            'watch': 'inotify' if self._watch_fd is not None else 'mtime',
+            'rebuilds': self.rebuilds
+        }
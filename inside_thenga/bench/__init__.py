@@ -0,0 +1,2 @@
+# Performance benchmarks for the Thenga server.
+# Run from the inside_thenga directory, e.g. `python -m bench.codec`.
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ESP32 Wire Format Benchmark
+Compare payload size and parse cost of the JSON event bodies sent by
+esp32_client.ino with the compact binary encoding in esp32_codec.py
+"""
+
+import argparse
+import json
+import timeit
+
+import esp32_codec
+
+# The JSON bodies the firmware sends today (see esp32_client.ino)
+SAMPLE_EVENTS = {
+    'pickup': {
+        'event_type': 'device_pickup',
+        'device_id': 'ESP32_MPU6050',
+        'timestamp': 123456,
+        'sensor': 'MPU6050'
+    },
+    'gyro': {
+        'event_type': 'gyro_threshold',
+        'device_id': 'ESP32_MPU6050',
+        'timestamp': 123456,
+        'sensor': 'MPU6050',
+        'gyro_x': 251.37,
+        'gyro_y': -12.5,
+        'gyro_z': 3.25,
+        'threshold': 250.0
+    },
+    'placement': {
+        'event_type': 'device_placed_down',
+        'device_id': 'ESP32_MPU6050',
+        'timestamp': 123456,
+        'sensor': 'MPU6050',
+        'motor_started': True
+    },
+    'button': {
+        'button_id': 'button1',
+        'state': 'clicked',
+        'timestamp': 123456
+    }
+}
+
+
+def measure(number):
+    """Return per-event size and parse cost for both encodings"""
+    results = []
+    for event, body in SAMPLE_EVENTS.items():
+        json_payload = json.dumps(body).encode('utf-8')
+        binary_payload = esp32_codec.encode_event(event, body)
+
+        json_seconds = timeit.timeit(lambda: json.loads(json_payload), number=number)
+        binary_seconds = timeit.timeit(lambda: esp32_codec.decode_event(binary_payload), number=number)
+
+        results.append({
+            'event': event,
+            'json_bytes': len(json_payload),
+            'binary_bytes': len(binary_payload),
+            'json_parse_us': json_seconds / number * 1e6,
+            'binary_parse_us': binary_seconds / number * 1e6
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs binary ESP32 event bodies')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='parses per measurement')
+    parser.add_argument('--json', action='store_true', help='print machine-readable JSON')
+    args = parser.parse_args()
+
+    results = measure(args.number)
+
+    if args.json:
+        print(json.dumps({'schema_version': esp32_codec.SCHEMA_VERSION, 'results': results}, indent=2))
+        return
+
+    print(f"ESP32 wire format benchmark (schema v{esp32_codec.SCHEMA_VERSION}, {args.number} parses each)")
+    print(f"{'event':<10} {'json B':>7} {'bin B':>6} {'size':>6} {'json us':>8} {'bin us':>7} {'speedup':>8}")
+    for r in results:
+        print(f"{r['event']:<10} {r['json_bytes']:>7} {r['binary_bytes']:>6} "
+              f"{r['binary_bytes'] / r['json_bytes']:>6.0%} {r['json_parse_us']:>8.2f} "
+              f"{r['binary_parse_us']:>7.2f} {r['json_parse_us'] / r['binary_parse_us']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
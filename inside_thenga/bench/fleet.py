@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulated ESP32 Fleet
+Replays the event pattern of esp32_client.ino from N virtual devices:
+a burst of gyro threshold events as the coconut is lifted, the pickup event,
+the 5 s motor delay and 3 s motor run, then the placement event, followed by
+the 10 s pickup cooldown. Every device also sends the testConnection
+{"command": "get_status"} ping on boot and periodically.
+
+Each step of --devices runs for --duration seconds against the same server
+(hermetic stubs by default, or --server-url). The report covers latency and
+error rate per event type, how often audio was played, and the server's
+playback queue depth scraped from /metrics, so you can see where N breaks.
+
+Example:
+    python -m bench.fleet --devices 1,5,10,25 --duration 60 --output fleet.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+import aiohttp
+
+import esp32_codec
+from bench.report import run_metadata, summarize
+from bench.server import ServerProcess
+from bench.stubs import StubServers, add_profile_arguments, fake_mp3, profiles_from_args
+
+# Firmware timings (esp32_client.ino)
+LOOP_INTERVAL = 0.5             # delay(500) at the end of loop()
+MOTOR_DELAY_AFTER_PICKUP = 5.0  # motorDelayAfterPickup
+MOTOR_RUN_DURATION = 3.0        # motorRunDuration
+MOTOR_START_FLASHES = 4.0       # 5 x (100 + 700) ms LED flashes block inside startMotor()
+PICKUP_COOLDOWN = 10.0          # pickupCooldown
+GYRO_PICKUP_THRESHOLD = 250.0   # gyroPickupThreshold
+
+EVENT_ROUTES = {
+    'status': '/esp32',
+    'gyro': '/esp32/gyro',
+    'pickup': '/esp32/pickup',
+    'placement': '/esp32/placement',
+}
+
+# Notification clips the handlers play, seeded into the server's audio directory
+NOTIFICATION_CLIPS = {
+    '1.mp3': 'ഹായ്, എന്നെ എടുത്തോ?',
+    '2.mp3': 'ശ്രദ്ധിക്കൂ, ഞാൻ ഇപ്പോൾ കറങ്ങാൻ പോകുന്നു',
+    '3.mp3': 'ഇത് ഒരു ബട്ടൺ ശബ്ദമാണ്',
+    '4.mp3': 'എന്നെ താഴെ വെച്ചതിന് നന്ദി',
+}
+
+_QUEUE_DEPTH = re.compile(r'^thenga_audio_playback_queue_depth (\S+)$', re.MULTILINE)
+
+
+class FleetRecorder:
+    """Latency, errors and audio outcomes per event type"""
+
+    def __init__(self):
+        self.latencies = {event: [] for event in EVENT_ROUTES}
+        self.errors = {event: 0 for event in EVENT_ROUTES}
+        self.error_reasons = {}
+        self.audio_played = {event: 0 for event in EVENT_ROUTES}
+
+    def record(self, event, seconds, ok, audio_played=False, reason=None):
+        if ok:
+            self.latencies[event].append(seconds)
+            if audio_played:
+                self.audio_played[event] += 1
+        else:
+            self.errors[event] += 1
+            key = f'{event}:{reason}'
+            self.error_reasons[key] = self.error_reasons.get(key, 0) + 1
+
+    def summary(self, elapsed):
+        events = {}
+        for event in EVENT_ROUTES:
+            result = summarize(self.latencies[event], self.errors[event], elapsed)
+            result['audio_played'] = self.audio_played[event]
+            events[event] = result
+        overall = summarize([s for values in self.latencies.values() for s in values],
+                            sum(self.errors.values()), elapsed)
+        return {'events': events, 'overall': overall, 'error_reasons': self.error_reasons}
+
+
+class VirtualDevice:
+    """One coconut running the firmware's loop against the server"""
+
+    def __init__(self, index, base_url, session, recorder, rng, transport='http', encoding='binary',
+                 idle_mean=15.0, ping_interval=30.0, gyro_burst=3, jitter=0.1):
+        self.device_id = f'SIM_{index:04d}'
+        self.base_url = base_url
+        self.session = session
+        self.recorder = recorder
+        self.random = rng
+        self.transport = transport
+        self.encoding = encoding
+        self.idle_mean = idle_mean
+        self.ping_interval = ping_interval
+        self.gyro_burst = gyro_burst
+        self.jitter = jitter
+        self.seq = 0
+        self.boot = time.monotonic()
+        self.ws = None
+        self.pending = {}
+
+    def _jittered(self, seconds):
+        return max(0.0, seconds * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def _body(self, event):
+        body = {
+            'device_id': self.device_id,
+            'timestamp': int((time.monotonic() - self.boot) * 1000),
+            'sensor': 'MPU6050'
+        }
+        if event == 'gyro':
+            body.update(event_type='gyro_threshold', threshold=GYRO_PICKUP_THRESHOLD,
+                        gyro_x=GYRO_PICKUP_THRESHOLD + self.random.uniform(1, 120),
+                        gyro_y=self.random.uniform(-40, 40), gyro_z=self.random.uniform(-40, 40))
+        elif event == 'pickup':
+            body['event_type'] = 'device_pickup'
+        elif event == 'placement':
+            body.update(event_type='device_placed_down', motor_started=True, stable_duration=0)
+        elif event == 'status':
+            body = {'command': 'get_status'}
+        return body
+
+    async def send(self, event):
+        """Send one event over the configured transport and record the outcome"""
+        self.seq = seq = (self.seq + 1) & 0xFFFF
+        body = self._body(event)
+        # testConnection() always uses a plain HTTP JSON POST
+        use_ws = self.transport == 'ws' and event != 'status' and self.ws is not None
+        start = time.perf_counter()
+        try:
+            if use_ws:
+                future = asyncio.get_running_loop().create_future()
+                self.pending[seq] = future
+                await self.ws.send_bytes(esp32_codec.encode_event(event, body, seq))
+                ack = await asyncio.wait_for(future, 60)
+                ok, audio, reason = ack['status'] == 200, ack['audio_played'], ack['status']
+            elif self.encoding == 'binary' and event != 'status':
+                payload = esp32_codec.encode_event(event, body, seq)
+                async with self.session.post(self.base_url + EVENT_ROUTES[event], data=payload,
+                                             headers={'Content-Type': esp32_codec.CONTENT_TYPE}) as response:
+                    raw = await response.read()
+                    ok, reason = response.status == 200, response.status
+                    audio = ok and esp32_codec.decode_ack(raw)['audio_played']
+            else:
+                async with self.session.post(self.base_url + EVENT_ROUTES[event], json=body) as response:
+                    result = await response.json(content_type=None)
+                    ok, reason = response.status == 200, response.status
+                    audio = ok and bool(result.get('audio_played'))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            ok, audio, reason = False, False, type(e).__name__
+        finally:
+            self.pending.pop(seq, None)
+        self.recorder.record(event, time.perf_counter() - start, ok, audio, reason)
+
+    async def _read_ws(self):
+        async for message in self.ws:
+            if message.type == aiohttp.WSMsgType.BINARY:
+                ack = esp32_codec.decode_ack(message.data)
+                future = self.pending.get(ack['seq'])
+                if future is not None and not future.done():
+                    future.set_result(ack)
+            elif message.type == aiohttp.WSMsgType.TEXT:
+                frame = json.loads(message.data)
+                if frame.get('t') == 'ping':
+                    await self.ws.send_str(json.dumps({'t': 'pong', 'ts': frame.get('ts')}, separators=(',', ':')))
+
+    async def _pinger(self, stop_at):
+        while time.monotonic() < stop_at:
+            await self.send('status')
+            await asyncio.sleep(self._jittered(self.ping_interval))
+
+    async def run(self, stop_at):
+        # Devices power on at different moments
+        await asyncio.sleep(self.random.uniform(0, min(self.idle_mean, LOOP_INTERVAL * 10)))
+        reader = None
+        if self.transport == 'ws':
+            self.ws = await self.session.ws_connect(self.base_url.replace('http', 'ws', 1) + '/esp32/ws')
+            await self.ws.send_str(json.dumps({'t': 'hello', 'device_id': self.device_id}))
+            reader = asyncio.create_task(self._read_ws())
+        pinger = asyncio.create_task(self._pinger(stop_at))
+        try:
+            while time.monotonic() < stop_at:
+                # Sitting on the table until somebody picks it up
+                await asyncio.sleep(self.random.expovariate(1 / self.idle_mean) if self.idle_mean else 0)
+                if time.monotonic() >= stop_at:
+                    break
+
+                # Lifting: a few loop ticks above the gyro threshold, then the pickup event
+                for _ in range(self.gyro_burst):
+                    await self.send('gyro')
+                    await asyncio.sleep(self._jittered(LOOP_INTERVAL))
+                picked_up = time.monotonic()
+                await self.send('pickup')
+
+                # Motor starts 5 s after pickup, runs for 3 s, then the coconut settles
+                remaining = MOTOR_DELAY_AFTER_PICKUP - (time.monotonic() - picked_up)
+                await asyncio.sleep(self._jittered(max(0.0, remaining) + MOTOR_START_FLASHES + MOTOR_RUN_DURATION))
+                await self.send('placement')
+
+                remaining = PICKUP_COOLDOWN - (time.monotonic() - picked_up)
+                await asyncio.sleep(max(0.0, remaining))
+        finally:
+            pinger.cancel()
+            if self.ws is not None:
+                await self.ws.close()
+            if reader is not None:
+                reader.cancel()
+
+
+async def sample_queue_depth(session, base_url, stop_at, interval=0.5):
+    """Scrape the playback queue depth gauge from /metrics until stop_at"""
+    samples = []
+    while time.monotonic() < stop_at:
+        try:
+            async with session.get(base_url + '/metrics') as response:
+                match = _QUEUE_DEPTH.search(await response.text())
+                if match:
+                    samples.append(float(match.group(1)))
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(interval)
+    return {
+        'samples': len(samples),
+        'max': max(samples) if samples else None,
+        'mean': round(sum(samples) / len(samples), 2) if samples else None,
+        'final': samples[-1] if samples else None
+    }
+
+
+async def run_step(base_url, devices, duration, args, seed):
+    recorder = FleetRecorder()
+    stop_at = time.monotonic() + duration
+    # HTTPClient opens a fresh connection per request (http.end()), so no keep-alive
+    connector = aiohttp.TCPConnector(limit=0, force_close=args.transport == 'http')
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        fleet = [
+            VirtualDevice(index, base_url, session, recorder, random.Random(seed + index),
+                          transport=args.transport, encoding=args.encoding, idle_mean=args.idle,
+                          ping_interval=args.ping_interval, gyro_burst=args.gyro_burst, jitter=args.jitter)
+            for index in range(devices)
+        ]
+        async with aiohttp.ClientSession(timeout=timeout) as scraper:
+            sampler = asyncio.create_task(sample_queue_depth(scraper, base_url, stop_at))
+            start = time.perf_counter()
+            results = await asyncio.gather(*(device.run(stop_at) for device in fleet), return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            queue_depth = await sampler
+
+    result = {'devices': devices, 'duration': round(elapsed, 2)}
+    result.update(recorder.summary(elapsed))
+    result['audio_queue_depth'] = queue_depth
+    crashed = [type(r).__name__ for r in results if isinstance(r, Exception)]
+    if crashed:
+        result['device_failures'] = len(crashed)
+    return result
+
+
+def seed_audio(audio_dir):
+    """Give the handlers real clips to play (silent MP3s of realistic length)"""
+    for name, text in NOTIFICATION_CLIPS.items():
+        with open(os.path.join(audio_dir, name), 'wb') as f:
+            f.write(fake_mp3(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of ESP32 coconuts against the Thenga server')
+    parser.add_argument('--devices', default='1,5,10,25', help='comma-separated fleet sizes to step through')
+    parser.add_argument('-d', '--duration', type=float, default=60.0, help='seconds per fleet size')
+    parser.add_argument('--transport', choices=['http', 'ws'], default='http', help='HTTP POSTs or the /esp32/ws channel')
+    parser.add_argument('--encoding', choices=['binary', 'json'], default='binary', help='event body encoding for HTTP')
+    parser.add_argument('--idle', type=float, default=15.0, help='mean seconds between pickups (exponential)')
+    parser.add_argument('--ping-interval', type=float, default=30.0, help='seconds between testConnection pings')
+    parser.add_argument('--gyro-burst', type=int, default=3, help='gyro threshold events per pickup')
+    parser.add_argument('--jitter', type=float, default=0.1, help='+/- fraction applied to firmware timings')
+    parser.add_argument('--server-url', help='drive an already running server instead of starting one')
+    parser.add_argument('--output', help='write results JSON to this file')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    steps = [int(n) for n in args.devices.split(',') if n.strip()]
+
+    stubs = None
+    server = None
+    try:
+        if args.server_url:
+            base_url = args.server_url.rstrip('/')
+        else:
+            stubs = StubServers(profiles_from_args(args), reply_chars=args.reply_chars).start()
+            server = ServerProcess(stubs.environment())
+            seed_audio(server.audio_dir)
+            server.start()
+            base_url = server.url
+            print(f"Stubs on {stubs.base_url}, server on {base_url} (log: {server.log_path})")
+
+        results = []
+        print(f"{'devices':>7} {'events':>7} {'rps':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7} {'audio q max':>11}")
+        for devices in steps:
+            result = asyncio.run(run_step(base_url, devices, args.duration, args, args.seed))
+            results.append(result)
+            overall = result['overall']
+            print(f"{devices:>7} {overall['requests']:>7} {overall['throughput_rps']:>7.2f} "
+                  f"{overall['latency_ms']['p50'] or 0:>9.1f} {overall['latency_ms']['p95'] or 0:>9.1f} "
+                  f"{overall['latency_ms']['p99'] or 0:>9.1f} {overall['error_rate']:>7.1%} "
+                  f"{result['audio_queue_depth']['max'] if result['audio_queue_depth']['max'] is not None else '-':>11}")
+
+        output = {
+            'meta': run_metadata(duration=args.duration, transport=args.transport, encoding=args.encoding,
+                                 idle=args.idle, ping_interval=args.ping_interval, gyro_burst=args.gyro_burst,
+                                 jitter=args.jitter, seed=args.seed, server_url=base_url),
+            'steps': results,
+            'upstreams': stubs.stats() if stubs else None
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(output, f, indent=2, ensure_ascii=False)
+            print(f"Results written to {args.output}")
+    finally:
+        if server:
+            server.stop()
+        if stubs:
+            stubs.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Latency summaries and run-to-run comparison shared by the bench tools
+import json
+import math
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles (ms) for one endpoint"""
+    values = sorted(latencies)
+    total = len(values) + errors
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': ms(percentile(values, 0.50)),
+            'p95': ms(percentile(values, 0.95)),
+            'p99': ms(percentile(values, 0.99)),
+            'mean': ms(sum(values) / len(values)) if values else None,
+            'max': ms(values[-1]) if values else None
+        }
+    }
+
+
+def run_metadata(**config):
+    """Identify the code and settings a result file came from"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'unix_time': time.time(),
+        'config': config
+    }
+
+
+def compare(current, baseline_path):
+    """Print p50/p95/p99 and throughput changes against a previous result file"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    print(f"\nComparison with {baseline_path} (commit {baseline.get('meta', {}).get('commit')})")
+    print(f"{'endpoint':<18} {'p50':>16} {'p95':>16} {'p99':>16} {'rps':>16}")
+    for name, result in current['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old:
+            print(f"{name:<18} (not in baseline)")
+            continue
+
+        def delta(new_value, old_value):
+            if new_value is None or not old_value:
+                return f"{'n/a':>16}"
+            return f"{new_value:>8.1f} ({(new_value - old_value) / old_value:+.0%})".rjust(16)
+
+        print(f"{name:<18} "
+              f"{delta(result['latency_ms']['p50'], old['latency_ms']['p50'])} "
+              f"{delta(result['latency_ms']['p95'], old['latency_ms']['p95'])} "
+              f"{delta(result['latency_ms']['p99'], old['latency_ms']['p99'])} "
+              f"{delta(result['throughput_rps'], old['throughput_rps'])}")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hermetic Latency/Throughput Benchmark
+Starts local stand-ins for Gemini, Translate and edge-tts (bench/stubs.py),
+runs main.py against them and drives /chat, /tts and the /esp32/* routes at
+a fixed concurrency. Writes throughput and p50/p95/p99 per endpoint as JSON
+so results can be compared between commits.
+
+Example:
+    python -m bench.run --concurrency 8 --duration 15 --output bench-HEAD.json
+    python -m bench.run --compare bench-HEAD.json
+    python -m bench.run --endpoints chat,chat_direct --output pipelines.json
+    python -m bench.run --upstream-mode replay --cassette cassettes/chat --replay-latency zero
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import requests
+
+import esp32_codec
+from bench.codec import SAMPLE_EVENTS
+from bench.report import compare, run_metadata, summarize
+from bench.server import ServerProcess
+from bench.stubs import StubServers, add_profile_arguments, profiles_from_args
+
+CHAT_MESSAGES = [
+    "നമസ്കാരം എങ്ങനെയുണ്ട്?",
+    "LED ഓൺ ചെയ്യൂ",
+    "led on cheyyu",
+    "temperature ethra degree aanu?",
+    "Hello how are you?",
+    "Check ESP32 status",
+]
+
+TTS_TEXTS = [
+    "ഞാൻ ഒരു തേങ്ങയാണ്. LED ഓൺ ആയി.",
+    "നമസ്കാരം! ഞാൻ തേങ്ങ, നിങ്ങളുടെ ESP32 ഉപകരണങ്ങളുടെ രാജാവ്. എന്ത് സഹായമാണ് വേണ്ടത്?",
+    "The LED is on now.",
+]
+
+
+def _json(path, bodies):
+    cycle = itertools.cycle(bodies)
+    return lambda: ('POST', path, {'json': next(cycle)})
+
+
+def _binary(path, event):
+    payload = esp32_codec.encode_event(event, SAMPLE_EVENTS[event])
+    return lambda: ('POST', path, {'data': payload, 'headers': {'Content-Type': esp32_codec.CONTENT_TYPE}})
+
+
+ENDPOINTS = {
+    'chat': _json('/chat', [{'message': m, 'pipeline': 'translate'} for m in CHAT_MESSAGES]),
+    'chat_direct': _json('/chat', [{'message': m, 'pipeline': 'direct'} for m in CHAT_MESSAGES]),
+    'chat_structured': _json('/chat', [{'message': m, 'pipeline': 'translate', 'output': 'structured'} for m in CHAT_MESSAGES]),
+    'tts': _json('/tts', [{'text': t} for t in TTS_TEXTS]),
+    'esp32_status': _json('/esp32', [{'command': 'get_status'}]),
+    'esp32_gyro': _json('/esp32/gyro', [SAMPLE_EVENTS['gyro']]),
+    'esp32_gyro_binary': _binary('/esp32/gyro', 'gyro'),
+    'esp32_placement': _json('/esp32/placement', [SAMPLE_EVENTS['placement']]),
+    'esp32_pickup': _json('/esp32/pickup', [SAMPLE_EVENTS['pickup']]),
+}
+
+
+def drive(base_url, request_factory, concurrency, duration, max_requests=None, timeout=60):
+    """Hammer one endpoint from `concurrency` threads; returns (latencies, errors, elapsed)"""
+    latencies = []
+    errors = [0]
+    issued = itertools.count()
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            if max_requests is not None and next(issued) >= max_requests:
+                break
+            method, path, kwargs = request_factory()
+            began = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, timeout=timeout, **kwargs)
+                ok = 200 <= response.status_code < 300
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - began
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hermetic latency/throughput benchmark for the Thenga server')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='concurrent clients per endpoint')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='seconds to drive each endpoint')
+    parser.add_argument('-n', '--requests', type=int, default=None, help='stop each endpoint after N requests')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated subset of: ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per endpoint first')
+    parser.add_argument('--server-url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--upstream-mode', choices=['stubs', 'record', 'replay'], default='stubs',
+                        help='stub upstreams, record the real ones to --cassette, or replay --cassette offline')
+    parser.add_argument('--cassette', help='cassette directory for --upstream-mode record/replay')
+    parser.add_argument('--replay-latency', choices=['original', 'zero'], default='original',
+                        help='replay with the recorded upstream latency or none')
+    parser.add_argument('--output', help='write results JSON to this file')
+    parser.add_argument('--compare', help='compare against a previous results JSON file')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    if args.upstream_mode != 'stubs' and not args.cassette:
+        parser.error('--cassette is required with --upstream-mode record/replay')
+
+    names = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}")
+
+    stubs = None
+    server = None
+    try:
+        if args.server_url:
+            base_url = args.server_url.rstrip('/')
+        elif args.upstream_mode == 'stubs':
+            stubs = StubServers(profiles_from_args(args), reply_chars=args.reply_chars).start()
+            server = ServerProcess(stubs.environment()).start()
+            base_url = server.url
+            print(f"Stubs on {stubs.base_url}, server on {base_url} (log: {server.log_path})")
+        else:
+            # Recording talks to the real services (GEMINI_API_KEY must be set); replay needs no network
+            server = ServerProcess({
+                'THENGA_UPSTREAM_MODE': args.upstream_mode,
+                'THENGA_CASSETTE': os.path.abspath(args.cassette),
+                'THENGA_REPLAY_LATENCY': args.replay_latency
+            }).start()
+            base_url = server.url
+            print(f"Server on {base_url} in {args.upstream_mode} mode with {args.cassette} (log: {server.log_path})")
+
+        results = {}
+        for name in names:
+            if args.warmup:
+                drive(base_url, ENDPOINTS[name], 1, args.duration, max_requests=args.warmup)
+            latencies, errors, elapsed = drive(base_url, ENDPOINTS[name], args.concurrency,
+                                               args.duration, args.requests)
+            results[name] = summarize(latencies, errors, elapsed)
+            r = results[name]
+            print(f"{name:<18} {r['requests']:>6} req  {r['throughput_rps']:>7.2f} rps  "
+                  f"p50 {r['latency_ms']['p50']} ms  p95 {r['latency_ms']['p95']} ms  "
+                  f"p99 {r['latency_ms']['p99']} ms  errors {r['errors']}")
+
+        # The server's own A/B report of the /chat pipelines (translate vs direct)
+        pipelines = None
+        if any(name.startswith('chat') for name in names):
+            pipelines = requests.get(base_url + '/chat/pipelines', timeout=10).json()
+            if 'direct_saves_ms' in pipelines:
+                saves = pipelines['direct_saves_ms']
+                print(f"direct pipeline saves p50 {saves['p50']} ms  p95 {saves['p95']} ms  mean {saves['mean']} ms per /chat turn")
+
+        output = {
+            'meta': run_metadata(concurrency=args.concurrency, duration=args.duration,
+                                 requests=args.requests, seed=args.seed, server_url=base_url,
+                                 upstream_mode=args.upstream_mode, cassette=args.cassette,
+                                 replay_latency=args.replay_latency),
+            'endpoints': results,
+            'upstreams': stubs.stats() if stubs else None,
+            'pipelines': pipelines
+        }
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(output, f, indent=2, ensure_ascii=False)
+            print(f"Results written to {args.output}")
+        else:
+            print(json.dumps(output, indent=2, ensure_ascii=False))
+
+        if args.compare:
+            compare(output, args.compare)
+    finally:
+        if server:
+            server.stop()
+        if stubs:
+            stubs.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Start main.py in a subprocess wired to the stub upstreams
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    """The Thenga server running as `python main.py` against the given upstream environment"""
+
+    def __init__(self, upstream_env, port=None, extra_env=None, log_path=None):
+        self.port = port or free_port()
+        self.audio_dir = tempfile.mkdtemp(prefix='thenga-bench-audio-')
+        self.log_path = log_path or os.path.join(tempfile.gettempdir(), f'thenga-bench-server-{self.port}.log')
+        self.env = dict(os.environ)
+        self.env.update({
+            'GEMINI_API_KEY': self.env.get('GEMINI_API_KEY', 'bench-key'),
+            'THENGA_HOST': '127.0.0.1',
+            'THENGA_PORT': str(self.port),
+            'THENGA_DEBUG': '0',
+            'THENGA_LOG_LEVEL': 'WARNING',
+            'THENGA_AUDIO_DIR': self.audio_dir,
+            # The bench cycles a handful of messages and texts; measure the pipeline, not answer or audio reuse
+            'THENGA_ANSWER_REUSE_SECONDS': self.env.get('THENGA_ANSWER_REUSE_SECONDS', '0'),
+            'THENGA_TTS_CACHE_MB': self.env.get('THENGA_TTS_CACHE_MB', '0'),
+            # Nor the client-side Gemini quota: at the free-tier 15 RPM the bench would measure queueing
+            'THENGA_GEMINI_RPM': self.env.get('THENGA_GEMINI_RPM', '100000'),
+            'THENGA_GEMINI_TPM': self.env.get('THENGA_GEMINI_TPM', '1000000000'),
+            'SDL_AUDIODRIVER': self.env.get('SDL_AUDIODRIVER', 'dummy')
+        })
+        self.env.update(upstream_env)
+        self.env.update(extra_env or {})
+        self.process = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self, timeout=30, poll_interval=0.2):
+        log = open(self.log_path, 'w')
+        self.process = subprocess.Popen([sys.executable, 'main.py'], cwd=SERVER_DIR, env=self.env,
+                                        stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {self.process.returncode}, see {self.log_path}')
+            try:
+                requests.get(self.url + '/languages', timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(poll_interval)
+        self.stop()
+        raise RuntimeError(f'Server did not start within {timeout}s, see {self.log_path}')
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
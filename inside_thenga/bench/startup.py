@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup Cost Report
+Breaks down what it costs to bring the server up: the modules importing
+main.py pulls in (python -X importtime), create_app() and the background
+audio/TTS warm-up, and the time from process start to the first served
+request and the first /tts and /chat, in the default and headless modes.
+
+Example:
+    python -m bench.startup --runs 3 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench.report import run_metadata
+from bench.server import SERVER_DIR, ServerProcess
+from bench.stubs import StubServers, UpstreamProfile
+
+MODES = {'default': '0', 'headless': '1'}
+
+PHASES_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.create_app(warm_up=False)
+t2 = time.perf_counter()
+main.warm_up_subsystems()
+t3 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'create_app_ms': (t2 - t1) * 1000, 'warm_up_ms': (t3 - t2) * 1000}))
+"""
+
+
+def _environment(headless, audio_dir):
+    env = dict(os.environ)
+    env.update({
+        'GEMINI_API_KEY': env.get('GEMINI_API_KEY', 'bench-key'),
+        'THENGA_HEADLESS': MODES['headless' if headless else 'default'],
+        'THENGA_AUDIO_DIR': audio_dir,
+        'THENGA_LOG_LEVEL': 'WARNING',
+        'SDL_AUDIODRIVER': env.get('SDL_AUDIODRIVER', 'dummy')
+    })
+    return env
+
+
+def import_breakdown(audio_dir, top=10):
+    """Cumulative import time (ms) of main.py and of each module it imports directly"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=SERVER_DIR,
+                            env=_environment(False, audio_dir), capture_output=True, text=True, timeout=60)
+    children = []
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name_field = line[len('import time:'):].split('|')
+        depth = (len(name_field) - len(name_field.lstrip()) - 1) // 2
+        name = name_field.strip()
+        if depth == 0:
+            if name == 'main':
+                total = int(cumulative) / 1000
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, int(cumulative) / 1000))
+    children.sort(key=lambda item: item[1], reverse=True)
+    return {'main_ms': total, 'modules_ms': {name: round(ms, 1) for name, ms in children[:top]}}
+
+
+def phases(headless, audio_dir):
+    result = subprocess.run([sys.executable, '-c', PHASES_SCRIPT], cwd=SERVER_DIR,
+                            env=_environment(headless, audio_dir), capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def time_to_first_requests(stubs, headless):
+    """Process start to first response, then the first (cold) and second (warm) /tts and /chat"""
+    server = ServerProcess(stubs.environment(), extra_env={'THENGA_HEADLESS': MODES['headless' if headless else 'default']})
+    started = time.perf_counter()
+    server.start(poll_interval=0.005)
+    timings = {'first_response_ms': (time.perf_counter() - started) * 1000}
+    try:
+        for attempt in ('first', 'second'):
+            for name, path, body in (('tts', '/tts', {'text': 'ഞാൻ ഒരു തേങ്ങയാണ്'}),
+                                     ('chat', '/chat', {'message': 'led on cheyyu'})):
+                began = time.perf_counter()
+                requests.post(server.url + path, json=body, timeout=30).raise_for_status()
+                timings[f'{attempt}_{name}_ms'] = (time.perf_counter() - began) * 1000
+    finally:
+        server.stop()
+    return timings
+
+
+def median_of(runs):
+    return {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import time and time-to-first-request of the Thenga server')
+    parser.add_argument('--runs', type=int, default=3, help='repetitions per measurement (median is reported)')
+    parser.add_argument('--output', help='write results JSON to this file')
+    args = parser.parse_args()
+
+    audio_dir = tempfile.mkdtemp(prefix='thenga-startup-audio-')
+
+    # Fast, fixed upstreams so only the server's own startup cost varies
+    stubs = StubServers({name: UpstreamProfile(0.0) for name in ('gemini', 'translate', 'edge_tts')}).start()
+    try:
+        report = {'imports': import_breakdown(audio_dir), 'modes': {}}
+        for mode in MODES:
+            headless = mode == 'headless'
+            report['modes'][mode] = {
+                'phases': median_of([phases(headless, audio_dir) for _ in range(args.runs)]),
+                'requests': median_of([time_to_first_requests(stubs, headless) for _ in range(args.runs)])
+            }
+    finally:
+        stubs.stop()
+
+    imports = report['imports']
+    print(f"import main: {imports['main_ms']:.1f} ms")
+    for name, ms in imports['modules_ms'].items():
+        print(f"   {name:<20} {ms:>8.1f} ms")
+    for mode, result in report['modes'].items():
+        print(f"\n{mode}:")
+        for key, value in list(result['phases'].items()) + list(result['requests'].items()):
+            print(f"   {key:<20} {value:>8.1f} ms")
+
+    output = {'meta': run_metadata(runs=args.runs), **report}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local Upstream Stand-ins
+aiohttp stub servers for the Gemini generateContent API, the Google
+Translate translate_a/single endpoint and the edge-tts synthesis WebSocket,
+each with configurable injected latency and error rate.
+
+Run standalone with `python -m bench.stubs --port 8900`, or start them
+in-process with StubServers(...).start() (see bench/run.py).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import uuid
+
+from aiohttp import web, WSMsgType
+
+GEMINI_PATH = '/v1beta/models/{model}:generateContent'
+TRANSLATE_PATH = '/translate_a/single'
+EDGE_TTS_PATH = '/consumer/speech/synthesize/readaloud/edge/v1'
+
+# One silent MPEG-2 Layer III frame: 24 kHz, 48 kbps, mono (the edge-tts output format)
+MP3_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+MP3_FRAME_SECONDS = 576 / 24000
+
+# Roughly how long a neural voice takes to speak one character
+SPEECH_SECONDS_PER_CHAR = 0.07
+
+# Bytes of audio per edge-tts binary message
+EDGE_TTS_CHUNK_FRAMES = 32
+
+STOCK_REPLY = ("Ah, another request for the mighty coconut! The LED is on now. "
+               "Without me your ESP32 would just sit there, sulking in its shell. ")
+
+
+class UpstreamProfile:
+    """Injected behaviour for one stub upstream"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def delay(self):
+        self.requests += 1
+        seconds = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def should_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            'latency': self.latency,
+            'jitter': self.jitter,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'injected_errors': self.errors
+        }
+
+
+def fake_malayalam(text):
+    """Malayalam-script text of about the same word count, so language detection and voice choice behave"""
+    words = max(1, len(text.split()))
+    return ' '.join(['തേങ്ങ'] * words)
+
+
+def fake_mp3(text):
+    frames = max(1, int(len(text) * SPEECH_SECONDS_PER_CHAR / MP3_FRAME_SECONDS))
+    return MP3_FRAME * frames
+
+
+def _edge_message(headers, body=''):
+    return ''.join(f'{name}:{value}\r\n' for name, value in headers.items()) + '\r\n' + body
+
+
+def _edge_audio(request_id, audio):
+    # Big-endian header length, then headers (ending in CRLF), then the MP3 bytes
+    header = f'X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n'.encode('ascii')
+    return len(header).to_bytes(2, 'big') + header + audio
+
+
+def make_app(profiles, reply_chars=len(STOCK_REPLY)):
+    """Build the aiohttp app serving all three stand-ins"""
+    gemini, translate, edge = profiles['gemini'], profiles['translate'], profiles['edge_tts']
+
+    async def gemini_generate(request):
+        await gemini.delay()
+        if gemini.should_fail():
+            return web.json_response({'error': {'code': 503, 'message': 'Injected failure', 'status': 'UNAVAILABLE'}}, status=503)
+        body = await request.json()
+        texts = [part.get('text', '') for content in body.get('contents', []) for part in content.get('parts', [])]
+        prompt_chars = sum(len(part) for part in texts)
+        text = (STOCK_REPLY * (reply_chars // len(STOCK_REPLY) + 1))[:reply_chars]
+        # Prompts asking for Malayalam script (the direct /chat pipeline) get a Malayalam reply
+        malayalam = any('മലയാളം' in part for part in texts)
+        if body.get('generationConfig', {}).get('responseMimeType') == 'application/json':
+            # JSON mode (structured /chat output): one short sentence and an LED action when asked for
+            speech = STOCK_REPLY.split('. ')[0] + '.'
+            asks_led = bool(texts) and 'led' in texts[-1].lower()
+            text = json.dumps({'speech': fake_malayalam(speech) if malayalam else speech,
+                               'action': 'led' if asks_led else 'none',
+                               'params': {'state': True} if asks_led else {}}, ensure_ascii=False)
+        elif malayalam:
+            text = fake_malayalam(text)
+        return web.json_response({
+            'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP'}],
+            'usageMetadata': {'promptTokenCount': prompt_chars // 4, 'candidatesTokenCount': len(text) // 4}
+        })
+
+    async def translate_single(request):
+        await translate.delay()
+        if translate.should_fail():
+            return web.Response(status=500, text='Injected failure')
+        text = request.query.get('q', '')
+        target = request.query.get('tl', 'en')
+        source = request.query.get('sl', 'auto')
+        translated = fake_malayalam(text) if target == 'ml' else f'{text} (translated)'
+        return web.json_response([[[translated, text, None, None, 10]], None, source])
+
+    async def edge_tts_synthesize(request):
+        if edge.should_fail():
+            await edge.delay()
+            return web.Response(status=503, text='Injected failure')
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        ssml = ''
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            if 'Path:ssml' in message.data:
+                ssml = message.data
+                break
+
+        # Time to first byte is the injected latency, like a slow synthesis start
+        await edge.delay()
+        request_id = uuid.uuid4().hex
+        spoken = re.sub(r'<[^>]+>', '', ssml.split('\r\n\r\n', 1)[-1])
+        audio = fake_mp3(spoken.strip())
+
+        await ws.send_str(_edge_message({'X-RequestId': request_id, 'Content-Type': 'application/json; charset=utf-8', 'Path': 'turn.start'}, '{}'))
+        chunk = len(MP3_FRAME) * EDGE_TTS_CHUNK_FRAMES
+        for offset in range(0, len(audio), chunk):
+            await ws.send_bytes(_edge_audio(request_id, audio[offset:offset + chunk]))
+        await ws.send_str(_edge_message({'X-RequestId': request_id, 'Content-Type': 'application/json; charset=utf-8', 'Path': 'turn.end'}, '{}'))
+        await ws.close()
+        return ws
+
+    async def stats(request):
+        return web.json_response({name: profile.stats() for name, profile in profiles.items()})
+
+    app = web.Application()
+    app.router.add_post(GEMINI_PATH, gemini_generate)
+    app.router.add_get(TRANSLATE_PATH, translate_single)
+    app.router.add_get(EDGE_TTS_PATH, edge_tts_synthesize)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+class StubServers:
+    """Runs the stub app on its own event loop thread"""
+
+    def __init__(self, profiles, host='127.0.0.1', port=0, reply_chars=len(STOCK_REPLY)):
+        self.profiles = profiles
+        self.host = host
+        self.port = port
+        self.reply_chars = reply_chars
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._started = threading.Event()
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(make_app(self.profiles, self.reply_chars), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._started.wait(10)
+        return self
+
+    def stop(self):
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def environment(self):
+        """Environment variables that point main.py at these stubs"""
+        return {
+            'GEMINI_API_URL': self.base_url + GEMINI_PATH.format(model='gemini-1.5-flash-latest'),
+            'TRANSLATE_API_URL': self.base_url + TRANSLATE_PATH,
+            'EDGE_TTS_WSS_URL': f'ws://{self.host}:{self.port}{EDGE_TTS_PATH}?TrustedClientToken=stub'
+        }
+
+    def stats(self):
+        return {name: profile.stats() for name, profile in self.profiles.items()}
+
+
+def add_profile_arguments(parser):
+    """--<upstream>-latency/-jitter/-error-rate options shared by the bench tools"""
+    defaults = {'gemini': 0.8, 'translate': 0.15, 'edge_tts': 0.4}
+    for name, latency in defaults.items():
+        flag = name.replace('_', '-')
+        parser.add_argument(f'--{flag}-latency', type=float, default=latency, help=f'{name} latency in seconds')
+        parser.add_argument(f'--{flag}-jitter', type=float, default=latency / 4, help=f'{name} +/- jitter in seconds')
+        parser.add_argument(f'--{flag}-error-rate', type=float, default=0.0, help=f'{name} injected error rate (0-1)')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for latency and error injection')
+    parser.add_argument('--reply-chars', type=int, default=len(STOCK_REPLY), help='length of the stub Gemini reply')
+
+
+def profiles_from_args(args):
+    return {
+        name: UpstreamProfile(
+            getattr(args, f'{name}_latency'),
+            getattr(args, f'{name}_jitter'),
+            getattr(args, f'{name}_error_rate'),
+            seed=args.seed + index
+        )
+        for index, name in enumerate(('gemini', 'translate', 'edge_tts'))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run local stand-ins for Gemini, Translate and edge-tts')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    stubs = StubServers(profiles_from_args(args), args.host, args.port, args.reply_chars).start()
+    print(f"Stub upstreams listening on {stubs.base_url}")
+    print("Point the server at them with:")
+    for name, value in stubs.environment().items():
+        print(f"   export {name}='{value}'")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stubs.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Circuit breakers for the upstream services. After a run of consecutive
+# failures a breaker opens and calls fail immediately instead of waiting on an
+# unhealthy backend; once the reset interval has passed a single probe call is
+# let through, and its outcome closes the breaker again or re-opens it.
+import threading
+import time
+
+import requests
+
+import metrics
+
+UPSTREAMS = ('gemini', 'translate', 'edge_tts', 'gtts')
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 30.0
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose breaker is open; behaves like an unreachable upstream"""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now; an open breaker lets one probe through after the reset interval"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        metrics.CIRCUIT_REJECTIONS.inc(upstream=self.name)
+        return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(f'{self.name} circuit is open after {self.failures} consecutive failures')
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                metrics.CIRCUIT_OPEN.dec(upstream=self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    metrics.CIRCUIT_OPEN.inc(upstream=self.name)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """Give up a call without an outcome, letting another probe through if this one was it"""
+        with self._lock:
+            self._probing = False
+
+    def info(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'open_for_s': round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None
+            }
+
+
+breakers = {name: CircuitBreaker(name) for name in UPSTREAMS}
+
+
+def configure(failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS):
+    for circuit in breakers.values():
+        circuit.failure_threshold = failure_threshold
+        circuit.reset_seconds = reset_seconds
+
+
+def get(name):
+    return breakers[name]
+
+
+def snapshot():
+    return {name: circuit.info() for name, circuit in breakers.items()}
@@ -0,0 +1,182 @@
+# Packed notification clips. Instead of one loose MP3 per ESP32 event in the
+# audio directory (each opened, stat'ed and read on every play or download),
+# the clips can be packed into one archive file with a JSON index next to it.
+# The server memory-maps the archive at startup and hands clips to the mixer
+# and to HTTP responses as slices of the mapping, without copying them.
+#
+# Rebuild it from the loose files, synthesizing the notification clips in
+# main.py's message tables that do not exist yet:
+#     python -m clip_archive [--audio-dir DIR] [--output PATH] [--no-synthesize]
+import argparse
+import io
+import json
+import mmap
+import os
+import threading
+from collections import namedtuple
+
+import audio_index
+
+FORMAT = 1
+
+Clip = namedtuple('Clip', 'name offset length hash duration message')
+
+
+def index_path(path):
+    return f'{path}.json'
+
+
+def _clip(name, entry):
+    """Clip from an index entry, raising ValueError if the entry is malformed"""
+    if not isinstance(entry, dict) or set(entry) != set(Clip._fields[1:]):
+        raise ValueError(f'Clip {name} has a malformed index entry')
+    if not all(type(entry[field]) is int and entry[field] >= 0 for field in ('offset', 'length')):
+        raise ValueError(f'Clip {name} has an invalid offset or length')
+    if not isinstance(entry['hash'], str) or not isinstance(entry['message'], (str, type(None))) \
+            or not isinstance(entry['duration'], (int, float, type(None))):
+        raise ValueError(f'Clip {name} has an invalid hash, duration or message')
+    return Clip(name, **entry)
+
+
+class ClipReader(io.RawIOBase):
+    """Read-only file over a clip's bytes (a memoryview), for players that want a file object"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class ClipArchive:
+    def __init__(self):
+        self.path = None
+        self.created = None
+        self._view = memoryview(b'')
+        self._clips = {}
+        self._lock = threading.Lock()
+        self.served = {'play': 0, 'http': 0}
+
+    def open(self, path):
+        """Map an archive and load its index (raises OSError/ValueError if either is unusable)"""
+        with open(index_path(path), encoding='utf-8') as f:
+            index = json.load(f)
+        if not isinstance(index, dict):
+            raise ValueError('Clip archive index is not a JSON object')
+        if index.get('format') != FORMAT:
+            raise ValueError(f"Unsupported clip archive format {index.get('format')!r}")
+        if type(index.get('size')) is not int or not isinstance(index.get('clips'), dict):
+            raise ValueError('Clip archive index has no size or clip table')
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            # Written before its index, so a size mismatch means the pair is from different builds
+            if size != index['size']:
+                raise ValueError(f"Clip archive is {size} bytes, its index expects {index['size']}")
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else memoryview(b'')
+        clips = {name: _clip(name, entry) for name, entry in index['clips'].items()}
+        for clip in clips.values():
+            if clip.offset + clip.length > size:
+                raise ValueError(f'Clip {clip.name} lies outside the archive')
+        # The previous mapping stays valid for clips still being played or sent
+        self.path, self.created, self._view, self._clips = path, stat.st_ctime, view, clips
+        return len(clips)
+
+    def get(self, name):
+        """Clip entry by file name, or None"""
+        return self._clips.get(name)
+
+    def clips(self):
+        return sorted(self._clips.values(), key=lambda clip: clip.name)
+
+    def data(self, clip, use='http'):
+        """The clip's bytes as a slice of the mapped archive (no copy)"""
+        with self._lock:
+            self.served[use] += 1
+        return self._view[clip.offset:clip.offset + clip.length]
+
+    def snapshot(self):
+        with self._lock:
+            served = dict(self.served)
+        return {
+            'path': self.path,
+            'clips': len(self._clips),
+            'bytes': len(self._view),
+            'served': served
+        }
+
+
+def build(path, clips):
+    """Write an archive and its index from (AudioFile, message or None) pairs, replacing any old one"""
+    entries = {}
+    partial = f'{path}.tmp'
+    with open(partial, 'wb') as out:
+        for entry, message in clips:
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            entries[entry.name] = {'offset': out.tell(), 'length': len(data), 'hash': entry.hash,
+                                   'duration': entry.duration, 'message': message}
+            out.write(data)
+        size = out.tell()
+    os.replace(partial, path)
+    with open(f'{index_path(path)}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'format': FORMAT, 'size': size, 'clips': entries}, f, ensure_ascii=False, indent=1)
+    os.replace(f'{index_path(path)}.tmp', index_path(path))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack the audio directory and notification clips into a clip archive')
+    parser.add_argument('--audio-dir', help='loose clips to pack (default: THENGA_AUDIO_DIR)')
+    parser.add_argument('--output', help='archive path (default: THENGA_CLIP_ARCHIVE, or clips.pack in the audio directory)')
+    parser.add_argument('--no-synthesize', action='store_true', help='only pack clips that exist, do not call edge-tts')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.audio_dir:
+        os.environ['THENGA_AUDIO_DIR'] = args.audio_dir
+    # The message tables and notification synthesis live with the event handlers
+    import main as server
+    server.load_config(headless=True)
+    os.makedirs(server.AUDIO_DIR, exist_ok=True)
+    output = args.output or server.CLIP_ARCHIVE or os.path.join(server.AUDIO_DIR, 'clips.pack')
+
+    messages = server.notification_messages()
+    missing = [name for name in messages if server.audio_files.get(name) is None]
+    if missing and not args.no_synthesize:
+        for name in missing:
+            if server.generate_notification_audio(messages[name], name):
+                print(f'synthesized {name}')
+            else:
+                print(f'could not synthesize {name}')
+
+    files = audio_index.AudioIndex(server.AUDIO_DIR).files()
+    entries = build(output, [(entry, messages.get(entry.name)) for entry in files])
+    size = sum(entry['length'] for entry in entries.values())
+    print(f'packed {len(entries)} clips ({size} bytes) into {output}')
+    unpacked = sorted(set(messages) - set(entries))
+    if unpacked:
+        print(f"notification clips not packed: {', '.join(unpacked)}")
+
+
+if __name__ == '__main__':
+    main()
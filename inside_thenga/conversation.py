@@ -0,0 +1,201 @@
+# Multi-turn memory for /chat. Each session keeps its turns as sent to Gemini; a prompt
+# carries as many recent turns as fit a token budget, and turns that slide out
+# of that window are folded into a rolling summary. The summary is updated
+# incrementally in the background (only newly evicted turns are added), so a
+# request never waits for summarization.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Gemini averages about 4 characters per token for English text
+CHARS_PER_TOKEN = 4
+
+DEFAULT_BUDGET_TOKENS = 1500
+DEFAULT_SUMMARY_TOKENS = 200
+MAX_SESSIONS = 256
+# Room left for the incoming message when deciding which turns to summarize
+MESSAGE_RESERVE_TOKENS = 100
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and Thenga, a coconut robot that controls ESP32 devices.
+Keep facts the user shared, device states, requests still open and anything Thenga promised. Drop greetings and jokes.
+Reply with the updated summary only, in at most {words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}"""
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def format_turns(turns):
+    return '\n'.join(f"{'User' if role == 'user' else 'Thenga'}: {text}" for role, text in turns)
+
+
+def extractive_summary(summary, turns, max_tokens):
+    """Summary without a model call: keep the start of each turn, newest last, within the budget"""
+    lines = [summary] if summary else []
+    lines += [f"{'User' if role == 'user' else 'Thenga'}: {text.split('. ')[0][:160]}" for role, text in turns]
+    text = '\n'.join(lines)
+    limit = max_tokens * CHARS_PER_TOKEN
+    return text[-limit:] if len(text) > limit else text
+
+
+class Session:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.turns = []             # (role, text) of turns not yet in the summary
+        self.summary = ''
+        self.summarized_upto = 0    # number of earlier turns folded into the summary
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+
+class ConversationMemory:
+    """Per-session turns, token-budgeted prompt building and a rolling summary"""
+
+    def __init__(self, persona, summarize=None, budget_tokens=DEFAULT_BUDGET_TOKENS,
+                 summary_tokens=DEFAULT_SUMMARY_TOKENS, max_sessions=MAX_SESSIONS):
+        self.persona = persona
+        # summarize(prompt) -> text or None; without it summaries are extractive
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def build(self, session_id, message, persona=None):
+        """Gemini `contents` for this turn plus a token report
+
+        Recent turns are added newest first while persona + summary + turns +
+        message stay within the budget. persona overrides the memory's own
+        (e.g. with extra instructions for one pipeline mode).
+        """
+        persona = persona or self.persona
+        session = self.session(session_id)
+        with session.lock:
+            summary = session.summary
+            turns = list(session.turns)
+            summarized_upto = session.summarized_upto
+
+        preamble = persona
+        if summary:
+            preamble += f"\n\nSummary of the conversation so far:\n{summary}"
+        fixed_tokens = estimate_tokens(preamble) + estimate_tokens(message)
+        remaining = self.budget_tokens - fixed_tokens
+
+        selected = []
+        history_tokens = 0
+        for role, text in reversed(turns):
+            cost = estimate_tokens(text)
+            if cost > remaining:
+                break
+            selected.append((role, text))
+            remaining -= cost
+            history_tokens += cost
+        selected.reverse()
+
+        # Turns outside the window whose summary is still being written are not sent
+        dropped = len(turns) - len(selected)
+        contents = []
+        for role, text in [('user', preamble)] + selected + [('user', message)]:
+            gemini_role = 'user' if role == 'user' else 'model'
+            if contents and contents[-1]['role'] == gemini_role:
+                contents[-1]['parts'].append({'text': text})
+            else:
+                contents.append({'role': gemini_role, 'parts': [{'text': text}]})
+
+        report = {
+            'session_id': session_id,
+            'budget_tokens': self.budget_tokens,
+            'estimated_prompt_tokens': self.budget_tokens - remaining,
+            'persona_tokens': estimate_tokens(persona),
+            'summary_tokens': estimate_tokens(summary),
+            'history_tokens': history_tokens,
+            'message_tokens': estimate_tokens(message),
+            'turns_sent': len(selected),
+            'turns_total': summarized_upto + len(turns),
+            'turns_summarized': summarized_upto,
+            'turns_dropped': dropped
+        }
+        return contents, report
+
+    def append(self, session_id, user_text, reply_text):
+        """Record a completed exchange and fold evicted turns into the summary in the background"""
+        session = self.session(session_id)
+        with session.lock:
+            session.turns.append(('user', user_text))
+            session.turns.append(('model', reply_text))
+            start_summary = self._needs_summary(session)
+            if start_summary:
+                session.summarizing = True
+        if start_summary:
+            threading.Thread(target=self._update_summary, args=(session,), name='thenga-summary', daemon=True).start()
+
+    def _window_start(self, session):
+        """Absolute index of the oldest turn a typical prompt still has room for"""
+        available = self.budget_tokens - estimate_tokens(self.persona)
+        # Small budgets still keep half of what the persona leaves for verbatim turns
+        remaining = max(available - self.summary_tokens - MESSAGE_RESERVE_TOKENS, available // 2)
+        index = session.summarized_upto + len(session.turns)
+        for role, text in reversed(session.turns):
+            remaining -= estimate_tokens(text)
+            if remaining < 0:
+                break
+            index -= 1
+        return index
+
+    def _needs_summary(self, session):
+        return not session.summarizing and self._window_start(session) > session.summarized_upto
+
+    def _update_summary(self, session):
+        """Fold turns that left the window into the summary until it has caught up"""
+        while True:
+            with session.lock:
+                upto = self._window_start(session)
+                new_turns = session.turns[:upto - session.summarized_upto]
+                summary = session.summary
+
+            started = time.perf_counter()
+            text = None
+            if self.summarize is not None:
+                prompt = SUMMARY_PROMPT.format(words=int(self.summary_tokens * 0.75), summary=summary or '(none)',
+                                               turns=format_turns(new_turns))
+                try:
+                    text = self.summarize(prompt)
+                except Exception:
+                    text = None
+            if not text:
+                text = extractive_summary(summary, new_turns, self.summary_tokens)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, pipeline='chat', stage='summarize')
+
+            with session.lock:
+                session.summary = text.strip()
+                # Summarized turns are outside the window and no longer needed
+                del session.turns[:upto - session.summarized_upto]
+                session.summarized_upto = upto
+                session.summarizing = self._window_start(session) > session.summarized_upto
+                if not session.summarizing:
+                    return
@@ -0,0 +1,62 @@
+# Per-request time budget split across pipeline stages. Every stage has a
+# share of the budget reserved for it; a stage may use whatever is left minus
+# the shares of the stages after it, so slack from a fast stage flows on to
+# the later ones. Stages that no longer fit are degraded instead of run.
+import time
+
+# A stage with less time than this is skipped rather than started
+MIN_STAGE_SECONDS = 0.25
+# Longest budget a request may ask for with deadline_ms
+MAX_REQUEST_MS = 60000
+
+
+def requested_ms(value, default_ms):
+    """A request's deadline_ms, or default_ms when it gives none
+
+    Raises ValueError unless the value is a number above 0 and at most MAX_REQUEST_MS
+    (NaN and infinity included, which would disable every stage timeout).
+    """
+    if not value:
+        return default_ms
+    try:
+        budget_ms = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('deadline_ms must be a number') from None
+    if not 0 < budget_ms <= MAX_REQUEST_MS:
+        raise ValueError(f'deadline_ms must be above 0 and at most {MAX_REQUEST_MS}')
+    return budget_ms
+
+
+class Deadline:
+    """Overall deadline for one request with per-stage reservations and a degradation log"""
+
+    def __init__(self, budget_seconds, shares):
+        self.budget = budget_seconds
+        self.started = time.monotonic()
+        self.expires = self.started + budget_seconds
+        self.shares = dict(shares)  # stage -> fraction of the budget, in pipeline order
+        self.degraded = []
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def timeout(self, stage):
+        """Seconds `stage` may take without eating into the stages after it"""
+        stages = list(self.shares)
+        reserved = sum(self.shares[name] for name in stages[stages.index(stage) + 1:]) * self.budget
+        return max(0.0, self.remaining() - reserved)
+
+    def fits(self, stage, minimum=MIN_STAGE_SECONDS):
+        return self.timeout(stage) >= minimum
+
+    def degrade(self, degradation):
+        if degradation not in self.degraded:
+            self.degraded.append(degradation)
+
+    def to_dict(self):
+        return {
+            'budget_ms': round(self.budget * 1000),
+            'elapsed_ms': round((time.monotonic() - self.started) * 1000, 2),
+            'remaining_ms': round(self.remaining() * 1000, 2),
+            'degraded': list(self.degraded)
+        }
@@ -1,5 +1,7 @@
 #include <WiFi.h>
 #include <HTTPClient.h>
+#include <WebSocketsClient.h>
+#include "thenga_wire.h"
 #include <ArduinoJson.h>
 #include <MPU6050.h>
 #include <Wire.h>
@@ -11,6 +13,15 @@ const char* password = "thengaaa";
 // Flask server URL
 const char* serverURL = "http://192.168.226.51:5000";  // Replace with your computer's IP
 
+// Persistent WebSocket channel (HTTP POSTs above are used only as a fallback)
+const char* serverHost = "192.168.226.51";  // Same host as serverURL
+const uint16_t serverPort = 5000;
+const char* wsPath = "/esp32/ws";
+const char* deviceId = "ESP32_MPU6050";
+WebSocketsClient webSocket;
+bool wsConnected = false;
+unsigned long wsSeq = 0;
+
 // Pin definitions
 const int ledPin = 2;  // Built-in LED on most ESP32 boards
 // Use default I2C pins for ESP32
@@ -98,6 +109,9 @@ void setup() {
   // Test connection to Flask server
   testConnection();
   
+  // Open the persistent WebSocket channel
+  connectWebSocket();
+  
   Serial.println("ESP32 ready! Device will detect placement and control motor using MPU6050.");
   Serial.println("Available serial commands: test, status, chat:message, help");
 }
@@ -188,6 +202,9 @@ void loop() {
     connectToWiFi();
   }
   
+  // Service the WebSocket (handles pings, commands and acks without blocking)
+  webSocket.loop();
+  
   // Read MPU6050 data
   int16_t ax, ay, az;
   int16_t gx, gy, gz;
@@ -321,92 +338,170 @@ void handleMotorControl() {
   }
 }
 
-void sendPickupEvent() {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(String(serverURL) + "/esp32/pickup");
-    http.addHeader("Content-Type", "application/json");
-    
-    // Create pickup event JSON
-    DynamicJsonDocument doc(512);
-    doc["event_type"] = "device_pickup";
-    doc["device_id"] = "ESP32_MPU6050";
-    doc["timestamp"] = millis();
-    doc["sensor"] = "MPU6050";
-    
-    String jsonPayload;
-    serializeJson(doc, jsonPayload);
-    
-    Serial.println("Sending pickup event: " + jsonPayload);
-    
-    int httpResponseCode = http.POST(jsonPayload);
-    
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.println("Pickup event response (" + String(httpResponseCode) + "): " + response);
-      
-      // Parse response to check if audio was played
-      DynamicJsonDocument responseDoc(1024);
-      deserializeJson(responseDoc, response);
-      
-      if (responseDoc["audio_played"]) {
-        Serial.println("✓ Audio notification played on server!");
+void connectWebSocket() {
+  webSocket.begin(serverHost, serverPort, wsPath);
+  webSocket.onEvent(webSocketEvent);
+  webSocket.setReconnectInterval(5000);
+}
+
+void webSocketEvent(WStype_t type, uint8_t* payload, size_t length) {
+  switch (type) {
+    case WStype_CONNECTED: {
+      wsConnected = true;
+      Serial.println("✓ WebSocket connected to server");
+      StaticJsonDocument<96> hello;
+      hello["t"] = "hello";
+      hello["device_id"] = deviceId;
+      String frame;
+      serializeJson(hello, frame);
+      webSocket.sendTXT(frame);
+      break;
+    }
+    case WStype_DISCONNECTED:
+      if (wsConnected) {
+        Serial.println("✗ WebSocket disconnected, falling back to HTTP");
       }
-      
-    } else {
-      Serial.println("✗ Failed to send pickup event. Error: " + String(httpResponseCode));
+      wsConnected = false;
+      break;
+    case WStype_TEXT:
+      handleServerFrame(payload, length);
+      break;
+    case WStype_BIN:
+      if (length == sizeof(ThengaAck)) {
+        ThengaAck ack;
+        memcpy(&ack, payload, sizeof(ack));
+        handleAck(ack);
+      }
+      break;
+    default:
+      break;
+  }
+}
+
+void handleServerFrame(uint8_t* payload, size_t length) {
+  StaticJsonDocument<256> frame;
+  if (deserializeJson(frame, payload, length)) {
+    return;
+  }
+  
+  const char* frameType = frame["t"] | "";
+  
+  if (strcmp(frameType, "ping") == 0) {
+    // Echo the server timestamp so it can measure round-trip latency
+    StaticJsonDocument<64> pong;
+    pong["t"] = "pong";
+    pong["ts"] = frame["ts"];
+    String reply;
+    serializeJson(pong, reply);
+    webSocket.sendTXT(reply);
+    
+  } else if (strcmp(frameType, "ack") == 0) {
+    if (frame["audio_played"]) {
+      Serial.println("✓ Audio notification played on server!");
     }
     
-    http.end();
-  } else {
-    Serial.println("✗ WiFi not connected!");
+  } else if (strcmp(frameType, "cmd") == 0) {
+    handleServerCommand(frame);
   }
 }
 
-void sendGyroEvent(float gx, float gy, float gz) {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(String(serverURL) + "/esp32/gyro");
-    http.addHeader("Content-Type", "application/json");
-    
-    // Create gyro event JSON
-    DynamicJsonDocument doc(512);
-    doc["event_type"] = "gyro_threshold";
-    doc["device_id"] = "ESP32_MPU6050";
-    doc["timestamp"] = millis();
-    doc["sensor"] = "MPU6050";
-    doc["gyro_x"] = gx;
-    doc["gyro_y"] = gy;
-    doc["gyro_z"] = gz;
-    doc["threshold"] = gyroPickupThreshold;
-    
-    String jsonPayload;
-    serializeJson(doc, jsonPayload);
-    
-    Serial.println("Sending gyro event: " + jsonPayload);
-    
-    int httpResponseCode = http.POST(jsonPayload);
-    
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.println("Gyro event response (" + String(httpResponseCode) + "): " + response);
-      
-      // Parse response to check if audio was played
-      DynamicJsonDocument responseDoc(1024);
-      deserializeJson(responseDoc, response);
-      
-      if (responseDoc["audio_played"]) {
-        Serial.println("✓ Audio notification played on server!");
-      }
-      
+void handleServerCommand(JsonDocument& frame) {
+  const char* cmd = frame["cmd"] | "";
+  const char* result = "ok";
+  Serial.printf("Server command: %s\n", cmd);
+  
+  if (strcmp(cmd, "motor_start") == 0) {
+    startMotor();
+  } else if (strcmp(cmd, "motor_stop") == 0) {
+    stopMotor();
+  } else if (strcmp(cmd, "set_threshold") == 0) {
+    float newThreshold = frame["value"] | 0.0;
+    if (newThreshold > 5.0 && newThreshold < 300.0) {
+      gyroPickupThreshold = newThreshold;
     } else {
-      Serial.println("✗ Failed to send gyro event. Error: " + String(httpResponseCode));
+      result = "invalid threshold";
     }
-    
-    http.end();
+  } else if (strcmp(cmd, "set_motor_delay") == 0) {
+    unsigned long newDelay = (frame["seconds"] | 0) * 1000UL;
+    if (newDelay >= 1000 && newDelay <= 30000) {
+      motorDelayAfterPickup = newDelay;
+    } else {
+      result = "invalid delay";
+    }
+  } else if (strcmp(cmd, "led") == 0) {
+    digitalWrite(ledPin, frame["state"] ? HIGH : LOW);
   } else {
+    result = "unknown command";
+  }
+  
+  StaticJsonDocument<96> ack;
+  ack["t"] = "cmd_ack";
+  ack["id"] = frame["id"];
+  ack["result"] = result;
+  String reply;
+  serializeJson(ack, reply);
+  webSocket.sendTXT(reply);
+}
+
+// Send a binary event (see thenga_wire.h) over the WebSocket, or POST it to
+// the matching /esp32/* route when the socket is down. Returns true on success.
+bool sendBinaryEvent(const char* route, const uint8_t* event, size_t length) {
+  if (wsConnected && webSocket.sendBIN(event, length)) {
+    return true;
+  }
+  
+  if (WiFi.status() != WL_CONNECTED) {
     Serial.println("✗ WiFi not connected!");
+    return false;
   }
+  
+  HTTPClient http;
+  http.begin(String(serverURL) + route);
+  http.addHeader("Content-Type", THENGA_WIRE_CONTENT_TYPE);
+  
+  int httpResponseCode = http.POST((uint8_t*)event, length);
+  
+  if (httpResponseCode > 0) {
+    ThengaAck ack;
+    WiFiClient* stream = http.getStreamPtr();
+    if (stream->readBytes((uint8_t*)&ack, sizeof(ack)) == sizeof(ack)) {
+      handleAck(ack);
+    } else {
+      Serial.printf("%s response (%d) without binary ack\n", route, httpResponseCode);
+    }
+  } else {
+    Serial.printf("✗ Failed to send %s event. Error: %d\n", route, httpResponseCode);
+  }
+  
+  http.end();
+  return httpResponseCode > 0;
+}
+
+void handleAck(const ThengaAck& ack) {
+  if (ack.status != 200) {
+    Serial.printf("✗ Server rejected event %u (seq %u): status %u\n", ack.event_type, ack.seq, ack.status);
+  } else if (ack.audio_played) {
+    Serial.println("✓ Audio notification played on server!");
+  }
+}
+
+void sendPickupEvent() {
+  ThengaPickupEvent event;
+  thengaFillHeader(event.header, THENGA_EVT_PICKUP, ++wsSeq, millis(), deviceId);
+  
+  Serial.println("Sending pickup event");
+  sendBinaryEvent("/esp32/pickup", (const uint8_t*)&event, sizeof(event));
+}
+
+void sendGyroEvent(float gx, float gy, float gz) {
+  ThengaGyroEvent event;
+  thengaFillHeader(event.header, THENGA_EVT_GYRO, ++wsSeq, millis(), deviceId);
+  event.gyro_x = gx;
+  event.gyro_y = gy;
+  event.gyro_z = gz;
+  event.threshold = gyroPickupThreshold;
+  
+  sendBinaryEvent("/esp32/gyro", (const uint8_t*)&event, sizeof(event));
 }
 
 void testConnection() {
@@ -436,47 +531,13 @@ void testConnection() {
 }
 
 void sendPlacementEvent() {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(String(serverURL) + "/esp32/placement");
-    http.addHeader("Content-Type", "application/json");
-    
-    // Create placement event JSON
-    DynamicJsonDocument doc(512);
-    doc["event_type"] = "device_placed_down";
-    doc["device_id"] = "ESP32_MPU6050";
-    doc["timestamp"] = millis();
-    doc["sensor"] = "MPU6050";
-    doc["motor_started"] = true;
-    
-    
-    String jsonPayload;
-    serializeJson(doc, jsonPayload);
-    
-    Serial.println("Sending placement event: " + jsonPayload);
-    
-    int httpResponseCode = http.POST(jsonPayload);
-    
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.println("Placement event response (" + String(httpResponseCode) + "): " + response);
-      
-      // Parse response to check if audio was played
-      DynamicJsonDocument responseDoc(1024);
-      deserializeJson(responseDoc, response);
-      
-      if (responseDoc["audio_played"]) {
-        Serial.println("✓ Audio notification played on server!");
-      }
-      
-    } else {
-      Serial.println("✗ Failed to send placement event. Error: " + String(httpResponseCode));
-    }
-    
-    http.end();
-  } else {
-    Serial.println("✗ WiFi not connected!");
-  }
+  ThengaPlacementEvent event;
+  thengaFillHeader(event.header, THENGA_EVT_PLACEMENT, ++wsSeq, millis(), deviceId);
+  event.motor_started = 1;
+  event.stable_duration_ms = 0;
+  
+  Serial.println("Sending placement event");
+  sendBinaryEvent("/esp32/placement", (const uint8_t*)&event, sizeof(event));
 }
 
 void handleSerialCommand(String command) {
@@ -485,6 +546,9 @@ void handleSerialCommand(String command) {
   if (command == "test") {
     testConnection();
     
+  } else if (command == "ws") {
+    Serial.printf("WebSocket: %s (ws://%s:%d%s)\n", wsConnected ? "connected" : "disconnected", serverHost, serverPort, wsPath);
+    
   } else if (command == "wifi") {
     Serial.println("WiFi Status:");
     printWiFiStatus();
@@ -576,6 +640,7 @@ void handleSerialCommand(String command) {
     Serial.println("Available commands:");
     Serial.println("  test              - Test server connection");
     Serial.println("  wifi              - Show WiFi status");
+    Serial.println("  ws                - Show WebSocket channel status");
     Serial.println("  reconnect         - Reconnect to WiFi");
     Serial.println("  scan              - Scan for WiFi networks");
     Serial.println("  pickup_test       - Simulate pickup event");
@@ -0,0 +1,90 @@
+// Compact fixed-layout binary encoding for ESP32 -> server events.
+// Mirrors inside_thenga/esp32_codec.py - bump THENGA_WIRE_VERSION and
+// SCHEMA_VERSION together whenever a struct below changes.
+// All fields are little-endian (native on the ESP32).
+#pragma once
+
+#include <stdint.h>
+#include <string.h>
+
+#define THENGA_WIRE_VERSION 1
+#define THENGA_WIRE_CONTENT_TYPE "application/x-thenga-event"
+#define THENGA_DEVICE_ID_SIZE 16
+
+enum ThengaEventType : uint8_t {
+  THENGA_EVT_PICKUP = 1,
+  THENGA_EVT_PLACEMENT = 2,
+  THENGA_EVT_GYRO = 3,
+  THENGA_EVT_BUTTON = 4,
+  THENGA_EVT_STATUS = 5
+};
+
+enum ThengaSensor : uint8_t {
+  THENGA_SENSOR_UNKNOWN = 0,
+  THENGA_SENSOR_MPU6050 = 1
+};
+
+enum ThengaStatusCommand : uint8_t {
+  THENGA_STATUS_PING = 0,
+  THENGA_STATUS_GET_STATUS = 1
+};
+
+// 26 bytes, shared by every event
+struct __attribute__((packed)) ThengaEventHeader {
+  uint8_t version;
+  uint8_t event_type;
+  uint8_t sensor;
+  uint8_t flags;          // reserved, send 0
+  uint16_t seq;
+  uint32_t timestamp_ms;
+  char device_id[THENGA_DEVICE_ID_SIZE];  // NUL-padded ASCII
+};
+
+struct __attribute__((packed)) ThengaPickupEvent {
+  ThengaEventHeader header;
+};
+
+struct __attribute__((packed)) ThengaPlacementEvent {
+  ThengaEventHeader header;
+  uint8_t motor_started;
+  uint32_t stable_duration_ms;
+};
+
+struct __attribute__((packed)) ThengaGyroEvent {
+  ThengaEventHeader header;
+  float gyro_x;
+  float gyro_y;
+  float gyro_z;
+  float threshold;
+};
+
+struct __attribute__((packed)) ThengaButtonEvent {
+  ThengaEventHeader header;
+  uint8_t button_id;      // 0 default, 1 button1, 2 button2
+  uint8_t state;          // 0 pressed, 1 released, 2 clicked
+};
+
+struct __attribute__((packed)) ThengaStatusEvent {
+  ThengaEventHeader header;
+  uint8_t command;
+};
+
+// 7 bytes, returned for every binary event
+struct __attribute__((packed)) ThengaAck {
+  uint8_t version;
+  uint8_t event_type;
+  uint16_t seq;
+  uint16_t status;        // HTTP-style status code
+  uint8_t audio_played;
+};
+
+static inline void thengaFillHeader(ThengaEventHeader& header, uint8_t eventType, uint16_t seq,
+                                    uint32_t timestampMs, const char* deviceId) {
+  memset(&header, 0, sizeof(header));
+  header.version = THENGA_WIRE_VERSION;
+  header.event_type = eventType;
+  header.sensor = THENGA_SENSOR_MPU6050;
+  header.seq = seq;
+  header.timestamp_ms = timestampMs;
+  strncpy(header.device_id, deviceId, THENGA_DEVICE_ID_SIZE);
+}
@@ -0,0 +1,154 @@
+# Compact fixed-layout binary encoding for ESP32 events.
+# The layout mirrors esp32_client/thenga_wire.h - bump SCHEMA_VERSION in both
+# files together whenever a struct changes.
+import struct
+
+SCHEMA_VERSION = 1
+
+# Content type selecting the binary encoding on the /esp32/* routes
+CONTENT_TYPE = 'application/x-thenga-event'
+
+# Event type codes (ThengaEventType in thenga_wire.h)
+EVENT_CODES = {
+    'pickup': 1,
+    'placement': 2,
+    'gyro': 3,
+    'button': 4,
+    'status': 5,
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+# The event_type strings the JSON bodies use for each event
+JSON_EVENT_TYPES = {
+    'pickup': 'device_pickup',
+    'placement': 'device_placed_down',
+    'gyro': 'gyro_threshold',
+    'button': 'button_event',
+    'status': 'status',
+}
+
+SENSORS = {0: 'unknown', 1: 'MPU6050'}
+SENSOR_CODES = {name: code for code, name in SENSORS.items()}
+
+BUTTON_IDS = {0: 'default', 1: 'button1', 2: 'button2'}
+BUTTON_ID_CODES = {name: code for code, name in BUTTON_IDS.items()}
+
+BUTTON_STATES = {0: 'pressed', 1: 'released', 2: 'clicked'}
+BUTTON_STATE_CODES = {name: code for code, name in BUTTON_STATES.items()}
+
+STATUS_COMMANDS = {0: 'ping', 1: 'get_status'}
+STATUS_COMMAND_CODES = {name: code for code, name in STATUS_COMMANDS.items()}
+
+DEVICE_ID_SIZE = 16
+
+# version, event_type, sensor, flags, seq, timestamp_ms, device_id
+HEADER = struct.Struct('<BBBBHI%ds' % DEVICE_ID_SIZE)
+
+# Event bodies that follow the header
+BODIES = {
+    'pickup': struct.Struct('<'),
+    'placement': struct.Struct('<BI'),     # motor_started, stable_duration_ms
+    'gyro': struct.Struct('<ffff'),        # gyro_x, gyro_y, gyro_z, threshold
+    'button': struct.Struct('<BB'),        # button_id, state
+    'status': struct.Struct('<B'),         # command
+}
+
+# version, event_type, seq, http-style status code, audio_played
+ACK = struct.Struct('<BBHHB')
+
+
+class WireFormatError(ValueError):
+    """Raised when a binary event cannot be decoded"""
+
+
+def encode_event(event, data, seq=0):
+    """Encode an event dict (same keys as the JSON bodies) into bytes"""
+    if event not in EVENT_CODES:
+        raise WireFormatError(f"Unknown event '{event}'")
+
+    device_id = str(data.get('device_id', 'ESP32')).encode('ascii', 'replace')[:DEVICE_ID_SIZE]
+    header = HEADER.pack(
+        SCHEMA_VERSION,
+        EVENT_CODES[event],
+        SENSOR_CODES.get(data.get('sensor', 'MPU6050'), 0),
+        0,
+        seq & 0xFFFF,
+        int(data.get('timestamp', 0)) & 0xFFFFFFFF,
+        device_id
+    )
+
+    if event == 'placement':
+        body = BODIES[event].pack(bool(data.get('motor_started', False)), int(data.get('stable_duration', 0)))
+    elif event == 'gyro':
+        body = BODIES[event].pack(
+            float(data.get('gyro_x', 0.0)),
+            float(data.get('gyro_y', 0.0)),
+            float(data.get('gyro_z', 0.0)),
+            float(data.get('threshold', 30.0))
+        )
+    elif event == 'button':
+        body = BODIES[event].pack(
+            BUTTON_ID_CODES.get(data.get('button_id', 'default'), 0),
+            BUTTON_STATE_CODES.get(data.get('state', 'pressed'), 0)
+        )
+    elif event == 'status':
+        body = BODIES[event].pack(STATUS_COMMAND_CODES.get(data.get('command', 'get_status'), 1))
+    else:
+        body = b''
+
+    return header + body
+
+
+def decode_event(raw):
+    """Decode a binary event into (event, data) where data matches the JSON body keys"""
+    if len(raw) < HEADER.size:
+        raise WireFormatError(f"Event too short: {len(raw)} bytes, header needs {HEADER.size}")
+
+    version, event_code, sensor, flags, seq, timestamp, device_id = HEADER.unpack_from(raw)
+    if version != SCHEMA_VERSION:
+        raise WireFormatError(f"Unsupported schema version {version}, expected {SCHEMA_VERSION}")
+    if event_code not in EVENT_NAMES:
+        raise WireFormatError(f"Unknown event code {event_code}")
+
+    event = EVENT_NAMES[event_code]
+    body = BODIES[event]
+    if len(raw) != HEADER.size + body.size:
+        raise WireFormatError(f"'{event}' event must be {HEADER.size + body.size} bytes, got {len(raw)}")
+
+    data = {
+        'event_type': JSON_EVENT_TYPES[event],
+        'device_id': device_id.rstrip(b'\x00').decode('ascii', 'replace'),
+        'timestamp': timestamp,
+        'sensor': SENSORS.get(sensor, 'unknown'),
+        'seq': seq
+    }
+    values = body.unpack_from(raw, HEADER.size)
+
+    if event == 'placement':
+        data['motor_started'] = bool(values[0])
+        data['stable_duration'] = values[1]
+    elif event == 'gyro':
+        data['gyro_x'], data['gyro_y'], data['gyro_z'], data['threshold'] = values
+    elif event == 'button':
+        data['button_id'] = BUTTON_IDS.get(values[0], 'default')
+        data['state'] = BUTTON_STATES.get(values[1], 'pressed')
+    elif event == 'status':
+        data['command'] = STATUS_COMMANDS.get(values[0], 'get_status')
+
+    return event, data
+
+
+def encode_ack(event, seq, status, audio_played):
+    """Encode the short binary acknowledgement sent back for a binary event"""
+    return ACK.pack(SCHEMA_VERSION, EVENT_CODES.get(event, 0), seq & 0xFFFF, status, bool(audio_played))
+
+
+def decode_ack(raw):
+    version, event_code, seq, status, audio_played = ACK.unpack(raw)
+    return {
+        'version': version,
+        'event': EVENT_NAMES.get(event_code, 'unknown'),
+        'seq': seq,
+        'status': status,
+        'audio_played': bool(audio_played)
+    }
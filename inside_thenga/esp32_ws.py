@@ -0,0 +1,186 @@
+# Persistent WebSocket channel between the Flask server and ESP32 devices
+import json
+import threading
+import time
+from datetime import datetime
+
+# Upstream frame types (device -> server) that map onto the /esp32/* event routes
+EVENT_FRAMES = ('pickup', 'placement', 'gyro', 'button', 'status')
+
+# Downstream commands the firmware knows how to execute
+DEVICE_COMMANDS = {
+    'motor_start': [],
+    'motor_stop': [],
+    'set_threshold': ['value'],
+    'set_motor_delay': ['seconds'],
+    'led': ['state'],
+}
+
+# Fields of the 'cmd' frame itself, which command params must not override
+RESERVED_FIELDS = ('t', 'id', 'cmd')
+
+# How often the server pings each device to measure round-trip latency
+PING_INTERVAL = 5.0
+
+# Weight of the newest sample in the smoothed round-trip latency
+LATENCY_EWMA_ALPHA = 0.2
+
+
+def encode_frame(frame_type, **fields):
+    """Encode a compact JSON frame: {"t": <type>, ...}"""
+    frame = {'t': frame_type}
+    frame.update(fields)
+    return json.dumps(frame, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_frame(raw):
+    """Decode a frame received from a device, returning (type, fields)"""
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    frame = json.loads(raw)
+    if not isinstance(frame, dict) or 't' not in frame:
+        raise ValueError("Frame must be a JSON object with a 't' field")
+    frame_type = frame.pop('t')
+    if not isinstance(frame_type, str):
+        raise ValueError("Frame field 't' must be a string")
+    return frame_type, frame
+
+
+def validate_command(command, params):
+    """Check a downstream command against DEVICE_COMMANDS, returning an error string or None"""
+    if not isinstance(command, str) or command not in DEVICE_COMMANDS:
+        return f"Unknown command '{command}'. Supported: {', '.join(DEVICE_COMMANDS)}"
+    reserved = [name for name in RESERVED_FIELDS if name in params]
+    if reserved:
+        return f"Command params cannot set the frame's own fields: {', '.join(reserved)}"
+    missing = [name for name in DEVICE_COMMANDS[command] if name not in params]
+    if missing:
+        return f"Command '{command}' requires: {', '.join(missing)}"
+    return None
+
+
+class DeviceConnection:
+    """One open WebSocket to a device, with send locking and latency tracking"""
+
+    def __init__(self, device_id, ws):
+        self.device_id = device_id
+        self.ws = ws
+        self.connected_at = datetime.now().isoformat()
+        self.frames_in = 0
+        self.frames_out = 0
+        self.last_rtt_ms = None
+        self.avg_rtt_ms = None
+        self.max_rtt_ms = None
+        self.rtt_samples = 0
+        self.last_ping = 0.0
+        self._send_lock = threading.Lock()
+        self._next_command_id = 0
+
+    def send(self, frame_type, **fields):
+        """Send a frame; safe to call from any request thread"""
+        payload = encode_frame(frame_type, **fields)
+        with self._send_lock:
+            self.ws.send(payload)
+            self.frames_out += 1
+
+    def send_bytes(self, payload):
+        """Send a binary frame (see esp32_codec)"""
+        with self._send_lock:
+            self.ws.send(payload)
+            self.frames_out += 1
+
+    def send_command(self, command, params):
+        """Push a command frame to the device and return its command id
+
+        Only the command's own params from DEVICE_COMMANDS go into the frame.
+        """
+        params = {name: params[name] for name in DEVICE_COMMANDS.get(command, []) if name in params}
+        with self._send_lock:
+            self._next_command_id += 1
+            command_id = self._next_command_id
+        self.send('cmd', id=command_id, cmd=command, **params)
+        return command_id
+
+    def ping_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now - self.last_ping >= PING_INTERVAL
+
+    def ping(self):
+        """Send a ping carrying the server's monotonic clock in milliseconds"""
+        self.last_ping = time.monotonic()
+        self.send('ping', ts=int(self.last_ping * 1000))
+
+    def record_pong(self, ts):
+        """Update round-trip latency from an echoed ping timestamp"""
+        rtt_ms = time.monotonic() * 1000 - float(ts)
+        if rtt_ms < 0:
+            return None
+        self.last_rtt_ms = rtt_ms
+        self.rtt_samples += 1
+        if self.avg_rtt_ms is None:
+            self.avg_rtt_ms = rtt_ms
+        else:
+            self.avg_rtt_ms += LATENCY_EWMA_ALPHA * (rtt_ms - self.avg_rtt_ms)
+        if self.max_rtt_ms is None or rtt_ms > self.max_rtt_ms:
+            self.max_rtt_ms = rtt_ms
+        return rtt_ms
+
+    def info(self):
+        def rounded(value):
+            return round(value, 2) if value is not None else None
+
+        return {
+            'device_id': self.device_id,
+            'connected_at': self.connected_at,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'latency_ms': {
+                'last': rounded(self.last_rtt_ms),
+                'avg': rounded(self.avg_rtt_ms),
+                'max': rounded(self.max_rtt_ms),
+                'samples': self.rtt_samples
+            }
+        }
+
+
+class DeviceRegistry:
+    """Tracks connected devices so request handlers can push commands to them"""
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def register(self, connection):
+        with self._lock:
+            previous = self._devices.get(connection.device_id)
+            self._devices[connection.device_id] = connection
+        return previous
+
+    def unregister(self, connection):
+        with self._lock:
+            if self._devices.get(connection.device_id) is connection:
+                del self._devices[connection.device_id]
+
+    def get(self, device_id):
+        with self._lock:
+            return self._devices.get(device_id)
+
+    def connected_ids(self):
+        with self._lock:
+            return list(self._devices)
+
+    def send_command(self, device_id, command, params=None):
+        """Push a command to one device; returns the command id or None if not connected"""
+        connection = self.get(device_id)
+        if connection is None:
+            return None
+        return connection.send_command(command, params or {})
+
+    def snapshot(self):
+        with self._lock:
+            connections = list(self._devices.values())
+        return [connection.info() for connection in connections]
+
+
+# Shared registry used by the /esp32/ws route and the command endpoint
+registry = DeviceRegistry()
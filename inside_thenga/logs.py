@@ -0,0 +1,143 @@
+# Structured, asynchronous logging for the Thenga server.
+# Request threads only enqueue records; a background QueueListener thread
+# serializes them to JSON and writes them to stdout.
+#
+# Environment:
+#   THENGA_LOG_LEVEL           DEBUG/INFO/WARNING/ERROR (default INFO)
+#   THENGA_LOG_PAYLOADS        1 to log full user text, replies and translations (default off)
+#   THENGA_LOG_SAMPLE_<KEY>    keep 1 in N records tagged with sample=<key> (gyro defaults to 20)
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+LOGGER_NAME = 'thenga'
+
+# 1-in-N sampling for high-frequency events, overridable per key from the environment
+DEFAULT_SAMPLE_EVERY = {
+    'gyro': 20,
+}
+
+LOG_PAYLOADS = False
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg plus any structured fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str, separators=(',', ':'))
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps structured fields instead of pre-formatting the whole line"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """Keep only 1 in N records tagged with extra={'sample': key}"""
+
+    def __init__(self, sample_every):
+        super().__init__()
+        self.sample_every = sample_every
+        self._seen = {}
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None:
+            return True
+        every = self.sample_every.get(key, 1)
+        if every <= 1:
+            return True
+        # Racy increments only skew which record is kept, never the rate much
+        count = self._seen.get(key, 0) + 1
+        self._seen[key] = count
+        if count % every != 1:
+            return False
+        record.fields = dict(getattr(record, 'fields', None) or {}, sampled_1_in=every)
+        return True
+
+
+def _sample_config():
+    sample_every = dict(DEFAULT_SAMPLE_EVERY)
+    for name, value in os.environ.items():
+        if name.startswith('THENGA_LOG_SAMPLE_'):
+            try:
+                sample_every[name[len('THENGA_LOG_SAMPLE_'):].lower()] = max(1, int(value))
+            except ValueError:
+                pass
+    return sample_every
+
+
+def setup_logging(level=None, stream=None):
+    """Route the 'thenga' logger through a queue to a background writer thread (idempotent)"""
+    global _listener, LOG_PAYLOADS
+    with _setup_lock:
+        logger = logging.getLogger(LOGGER_NAME)
+        if _listener is not None:
+            return logger
+
+        # Read here rather than at import so settings from .env apply
+        LOG_PAYLOADS = os.getenv('THENGA_LOG_PAYLOADS', '0').lower() in ('1', 'true', 'yes')
+        level = level or os.getenv('THENGA_LOG_LEVEL', 'INFO').upper()
+        logger.setLevel(level)
+        logger.propagate = False
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = StructuredQueueHandler(log_queue)
+        # Sampling runs before enqueueing so dropped records cost nothing downstream
+        queue_handler.addFilter(SampleFilter(_sample_config()))
+        logger.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return logger
+
+
+def get_logger(name=None):
+    """Logger under 'thenga'; records are written once setup_logging() has run"""
+    return logging.getLogger(f'{LOGGER_NAME}.{name}' if name else LOGGER_NAME)
+
+
+def payload(text, preview=0):
+    """Full text when payload logging is enabled, otherwise only its length (and an optional preview)"""
+    if text is None:
+        return None
+    text = str(text)
+    if LOG_PAYLOADS:
+        return text
+    if preview:
+        return f'{text[:preview]}... <{len(text)} chars>' if len(text) > preview else text
+    return f'<{len(text)} chars>'
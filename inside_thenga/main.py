@@ -1,32 +1,131 @@
 # Flask chatbot server with Gemini API and text-to-speech
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Blueprint, Flask, request, jsonify, send_file, render_template, Response, g
 import requests
 import os
 import tempfile
+import mimetypes
 import json
-from gtts import gTTS
 from datetime import datetime
-from dotenv import load_dotenv
 import urllib.parse
 import re
+import math
 import asyncio
-import edge_tts
-import pygame
 import threading
 import time
+import itertools
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask_sock import Sock, ConnectionClosed
+import esp32_ws
+import esp32_codec
+import conversation
+import answer_cache
+import audio_cache
+import audio_index
+import clip_archive
+import deadline
+import metrics
+import mp3
+import speech_text
+import upstream
+import breaker
+import quota
+import singleflight
+import speculation
+import tracing
+import transcode
+import logs
 
-# Load environment variables from .env file
-load_dotenv()
+# Importing this module only defines the routes. Settings, logging, the audio
+# directory and the audio/TTS stacks are set up by create_app(), and pygame,
+# edge-tts and gTTS are imported on first use (or by a background warm-up).
+log = logs.get_logger('server')
 
-app = Flask(__name__)
+bp = Blueprint('thenga', __name__)
+sock = Sock()
 
-# Get Gemini API key from environment variables
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set. Please check your .env file.")
+DEFAULT_GEMINI_API_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent'
+DEFAULT_TRANSLATE_API_URL = 'https://translate.googleapis.com/translate_a/single'
+DEFAULT_AUDIO_DIR = os.path.join(os.path.dirname(__file__), 'audio_files')
 
-# Updated Gemini API URL - use the correct model endpoint
-GEMINI_API_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent'
+# Filled in by load_config()
+GEMINI_API_KEY = None
+GEMINI_API_URL = DEFAULT_GEMINI_API_URL
+TRANSLATE_API_URL = DEFAULT_TRANSLATE_API_URL
+AUDIO_DIR = DEFAULT_AUDIO_DIR
+HEADLESS = False
+CHAT_PIPELINE = 'translate'
+CHAT_OUTPUT = 'text'
+STRUCTURED_MAX_TOKENS = 256
+CHAT_DEADLINE_MS = 8000
+TTS_DEADLINE_MS = 10000
+GEMINI_MAX_WAIT = 5.0
+TTS_SENTENCE_WORKERS = 3
+TTS_CACHE_MB = 32
+SPOKEN_MAX_CHARS = 600
+ANSWER_MATCH_THRESHOLD = answer_cache.DEFAULT_THRESHOLD
+ANSWER_REUSE_SECONDS = 300.0
+FFMPEG = 'ffmpeg'
+CLIP_ARCHIVE = ''
+
+def load_config(headless=None):
+    """Read settings from the environment (call after .env has been loaded)"""
+    global GEMINI_API_KEY, GEMINI_API_URL, TRANSLATE_API_URL, AUDIO_DIR, HEADLESS, CHAT_PIPELINE
+    global CHAT_OUTPUT, STRUCTURED_MAX_TOKENS, CHAT_DEADLINE_MS, TTS_DEADLINE_MS, GEMINI_MAX_WAIT
+    global ANSWER_MATCH_THRESHOLD, ANSWER_REUSE_SECONDS, TTS_SENTENCE_WORKERS, TTS_CACHE_MB, SPOKEN_MAX_CHARS
+    global FFMPEG, CLIP_ARCHIVE
+    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    if not GEMINI_API_KEY:
+        log.warning('GEMINI_API_KEY is not set; /chat will return errors. Please check your .env file.')
+    # Upstream URLs can be overridden (e.g. to point at the bench/stubs.py stand-ins)
+    GEMINI_API_URL = os.getenv('GEMINI_API_URL', DEFAULT_GEMINI_API_URL)
+    TRANSLATE_API_URL = os.getenv('TRANSLATE_API_URL', DEFAULT_TRANSLATE_API_URL)
+    AUDIO_DIR = os.getenv('THENGA_AUDIO_DIR', DEFAULT_AUDIO_DIR)
+    audio_files.configure(AUDIO_DIR)
+    # Packed notification clips, memory-mapped at startup (build with `python -m clip_archive`)
+    CLIP_ARCHIVE = os.getenv('THENGA_CLIP_ARCHIVE', '')
+    # Headless servers (CI, containers, benchmarks) never touch pygame
+    if headless is None:
+        headless = os.getenv('THENGA_HEADLESS', '0').lower() in ('1', 'true', 'yes')
+    HEADLESS = headless
+    # Token budget for persona + summary + recent turns + message, and for the rolling summary
+    memory.budget_tokens = int(os.getenv('THENGA_CONTEXT_TOKENS', conversation.DEFAULT_BUDGET_TOKENS))
+    memory.summary_tokens = int(os.getenv('THENGA_SUMMARY_TOKENS', conversation.DEFAULT_SUMMARY_TOKENS))
+    # Default /chat pipeline when a request does not pick one; 'ab' alternates between them
+    CHAT_PIPELINE = os.getenv('THENGA_CHAT_PIPELINE', 'translate').lower()
+    if CHAT_PIPELINE not in CHAT_PIPELINES + ('ab',):
+        raise ValueError(f"THENGA_CHAT_PIPELINE must be one of {', '.join(CHAT_PIPELINES)}, ab; got '{CHAT_PIPELINE}'")
+    # Free-text Gemini replies, or JSON with short speech plus a device action (capped output tokens)
+    CHAT_OUTPUT = os.getenv('THENGA_CHAT_OUTPUT', 'text').lower()
+    if CHAT_OUTPUT not in CHAT_OUTPUTS:
+        raise ValueError(f"THENGA_CHAT_OUTPUT must be one of {', '.join(CHAT_OUTPUTS)}, got '{CHAT_OUTPUT}'")
+    STRUCTURED_MAX_TOKENS = int(os.getenv('THENGA_STRUCTURED_MAX_TOKENS', STRUCTURED_MAX_TOKENS))
+    # Overall time budgets; requests can ask for their own with deadline_ms
+    CHAT_DEADLINE_MS = float(os.getenv('THENGA_CHAT_DEADLINE_MS', CHAT_DEADLINE_MS))
+    TTS_DEADLINE_MS = float(os.getenv('THENGA_TTS_DEADLINE_MS', TTS_DEADLINE_MS))
+    # Sentences of a long /tts text that are synthesized at the same time
+    TTS_SENTENCE_WORKERS = max(1, int(os.getenv('THENGA_TTS_SENTENCE_WORKERS', TTS_SENTENCE_WORKERS)))
+    # Memory for synthesized sentences that later replies can reuse
+    TTS_CACHE_MB = float(os.getenv('THENGA_TTS_CACHE_MB', TTS_CACHE_MB))
+    sentence_audio.max_bytes = int(TTS_CACHE_MB * 1024 * 1024)
+    # Longest /chat reply that is spoken (cut at a sentence end; the full reply is still displayed)
+    SPOKEN_MAX_CHARS = int(os.getenv('THENGA_SPOKEN_MAX_CHARS', SPOKEN_MAX_CHARS))
+    # ffmpeg for Opus/low-bitrate audio (optional: without it audio is served as MP3), and the Opus bitrate
+    FFMPEG = os.getenv('THENGA_FFMPEG', FFMPEG)
+    transcoder.configure(FFMPEG, int(os.getenv('THENGA_OPUS_BITRATE', transcode.DEFAULT_OPUS_BITRATE)))
+    # Consecutive failures that open an upstream's circuit, and how long it stays open before a probe
+    breaker.configure(int(os.getenv('THENGA_BREAKER_FAILURES', breaker.DEFAULT_FAILURE_THRESHOLD)),
+                      float(os.getenv('THENGA_BREAKER_RESET_SECONDS', breaker.DEFAULT_RESET_SECONDS)))
+    # Gemini quotas (per minute), how many calls may queue for them and for how long
+    gemini_quota.rpm = int(os.getenv('THENGA_GEMINI_RPM', quota.DEFAULT_RPM))
+    gemini_quota.tpm = int(os.getenv('THENGA_GEMINI_TPM', quota.DEFAULT_TPM))
+    gemini_quota.max_queue = int(os.getenv('THENGA_GEMINI_QUEUE', quota.DEFAULT_MAX_QUEUE))
+    GEMINI_MAX_WAIT = float(os.getenv('THENGA_GEMINI_MAX_WAIT_MS', GEMINI_MAX_WAIT * 1000)) / 1000
+    # Similarity (0-1) at which an earlier message counts as the same request, and how long
+    # its answer is reused instead of asking Gemini again (0 = only as a fallback)
+    ANSWER_MATCH_THRESHOLD = float(os.getenv('THENGA_ANSWER_MATCH_THRESHOLD', ANSWER_MATCH_THRESHOLD))
+    ANSWER_REUSE_SECONDS = float(os.getenv('THENGA_ANSWER_REUSE_SECONDS', ANSWER_REUSE_SECONDS))
 
 # Store conversation history
 conversation_history = []
@@ -62,31 +161,54 @@ def detect_language(text):
     
     return 'en'
 
-def translate_text_simple(text, target_language='en', source_language='ml'):
+def translate_text_simple(text, target_language='en', source_language='ml', timeout=10):
     """Simple translation using Google Translate web API"""
+    # Identical translations in flight at the same moment share one call
+    key = (' '.join(text.split()), source_language, target_language)
+    try:
+        translated_text, shared = translate_flight.do(
+            key, lambda: fetch_translation(text, target_language, source_language, timeout), timeout)
+    except TimeoutError as e:
+        tracing.record_upstream_error('translate', e)
+        return text, source_language
+    if shared:
+        tracing.record_coalesced('translate', translated_text is not None)
+    if translated_text is None:
+        return text, source_language  # Return original text if translation fails
+    return translated_text, source_language
+
+def fetch_translation(text, target_language, source_language, timeout):
+    """One Google Translate call; returns the translated text, or None if translation fails"""
     try:
         # URL encode the text
         encoded_text = urllib.parse.quote(text)
         
         # Google Translate URL
-        url = f"https://translate.googleapis.com/translate_a/single?client=gtx&sl={source_language}&tl={target_language}&dt=t&q={encoded_text}"
+        url = f"{TRANSLATE_API_URL}?client=gtx&sl={source_language}&tl={target_language}&dt=t&q={encoded_text}"
         
-        response = requests.get(url, timeout=10)
+        response = upstream.get('translate', url, timeout=timeout)
+        tracing.record_upstream('translate', response)
         
         if response.status_code == 200:
             result = response.json()
             # Extract the translated text from the response
             if result and len(result) > 0 and len(result[0]) > 0:
                 translated_text = result[0][0][0]
-                return translated_text, source_language
+                metrics.record_upstream('translate', 'ok')
+                return translated_text
+            metrics.record_upstream('translate', 'error', 'empty_result')
+        else:
+            metrics.record_upstream('translate', 'error', str(response.status_code))
         
-        return text, source_language  # Return original if translation fails
+        return None
         
     except Exception as e:
-        print(f"Translation error: {e}")
-        return text, source_language  # Return original text if translation fails
+        metrics.record_upstream('translate', 'error', type(e).__name__)
+        tracing.record_upstream_error('translate', e)
+        log.warning('Translation failed', extra={'fields': {'error': type(e).__name__}})
+        return None
 
-def translate_text(text, target_language='en', source_language='auto'):
+def translate_text(text, target_language='en', source_language='auto', timeout=10):
     """Translate text using simple Google Translate API with enhanced language detection"""
     try:
         # For auto-detection, use the enhanced detect_language function
@@ -105,54 +227,480 @@ def translate_text(text, target_language='en', source_language='auto'):
         if source_language == target_language:
             return text, source_language
             
-        return translate_text_simple(text, target_language, source_language)
+        return translate_text_simple(text, target_language, source_language, timeout)
         
     except Exception as e:
-        print(f"Translation error: {e}")
+        log.warning('Translation failed', extra={'fields': {'error': type(e).__name__}})
         return text, source_language  # Return original text if translation fails
 
-def ask_gemini(message, language='en'):
-    """Send message to Gemini API - always expect English input and get English response"""
-    headers = {'Content-Type': 'application/json'}
-    params = {'key': GEMINI_API_KEY}
-    
-    # Always use English context for consistent processing
-    context = """You are Thenga, a self-aware coconut robot with a playful and cocky personality. You know you are a coconut, and you occasionally make witty, coconut-themed remarks about yourself. You are confident in your abilities to control ESP32 devices and perform hardware tasks such as turning LEDs on or off, reading sensors, checking device status, and other related actions. When giving instructions, you keep your language clear, simple, and concise, but you add a touch of charm and self-assured humor. You subtly remind users that without you, their hardware is just sitting idle."""
+# Always use English context for consistent processing
+THENGA_PERSONA = """You are Thenga, a self-aware coconut robot with a playful and cocky personality. You know you are a coconut, and you occasionally make witty, coconut-themed remarks about yourself. You are confident in your abilities to control ESP32 devices and perform hardware tasks such as turning LEDs on or off, reading sensors, checking device status, and other related actions. When giving instructions, you keep your language clear, simple, and concise, but you add a touch of charm and self-assured humor. You subtly remind users that without you, their hardware is just sitting idle."""
+
+# Added to the persona in the direct pipeline, where Gemini answers in Malayalam itself
+DIRECT_MALAYALAM_INSTRUCTION = """Always reply in Malayalam (മലയാളം) script, whether the user writes in Malayalam, Manglish (Malayalam typed in English letters) or English. Keep English technical terms such as LED, ESP32, sensor and device names in English."""
+
+# /chat pipelines: translate = ml→en, Gemini in English, en→ml (three calls);
+# direct = one Gemini call that reads the user's own text and replies in Malayalam
+CHAT_PIPELINES = ('translate', 'direct')
+PIPELINE_PERSONAS = {'translate': THENGA_PERSONA, 'direct': f"{THENGA_PERSONA}\n\n{DIRECT_MALAYALAM_INSTRUCTION}"}
+
+# /chat outputs: text = Gemini's free-text reply; structured = a JSON object whose short
+# speech is translated and spoken, and whose device action is sent to the ESP32 directly
+CHAT_OUTPUTS = ('text', 'structured')
+DEFAULT_DEVICE_ID = 'ESP32_MPU6050'
+
+STRUCTURED_INSTRUCTION = """Reply with a JSON object. "speech" is what you say out loud: one or two short sentences. "action" is the device command the user asked for, or "none": led (params.state true/false), motor_start, motor_stop, set_threshold (params.value, gyro degrees per second), set_motor_delay (params.seconds). Only set an action when the user clearly asks for it."""
+
+# Gemini responseSchema for structured replies, built from the commands the firmware knows
+STRUCTURED_REPLY_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'speech': {'type': 'STRING'},
+        'action': {'type': 'STRING', 'enum': ['none'] + list(esp32_ws.DEVICE_COMMANDS)},
+        'params': {
+            'type': 'OBJECT',
+            'properties': {
+                'state': {'type': 'BOOLEAN'},
+                'value': {'type': 'NUMBER'},
+                'seconds': {'type': 'INTEGER'}
+            }
+        }
+    },
+    'required': ['speech', 'action']
+}
+
+def structured_generation_config():
+    return {
+        'responseMimeType': 'application/json',
+        'responseSchema': STRUCTURED_REPLY_SCHEMA,
+        'maxOutputTokens': STRUCTURED_MAX_TOKENS
+    }
+
+def parse_structured_reply(text):
+    """(speech, action, params) from a structured Gemini reply; unparseable replies are all speech"""
+    try:
+        reply = json.loads(text)
+    except ValueError:
+        # Output cut off at maxOutputTokens: keep whatever speech made it, drop the action
+        match = re.search(r'"speech"\s*:\s*"((?:[^"\\]|\\.)*)', text)
+        if match:
+            try:
+                return json.loads(f'"{match.group(1)}"').strip(), None, {}
+            except ValueError:
+                return match.group(1).strip(), None, {}
+        return text, None, {}
+    if not isinstance(reply, dict):
+        return text, None, {}
+    action = reply.get('action')
+    params = reply.get('params') if isinstance(reply.get('params'), dict) else {}
+    return str(reply.get('speech', '')).strip(), None if action in (None, '', 'none') else action, params
+
+def dispatch_device_action(device_id, action, params):
+    """Send a Gemini-chosen command to a WebSocket-connected device; returns what happened"""
+    params = {name: params[name] for name in esp32_ws.DEVICE_COMMANDS.get(action, []) if name in params}
+    result = {'device_id': device_id, 'command': action, 'params': params}
+    error = esp32_ws.validate_command(action, params)
+    if error:
+        result.update(status='invalid', error=error)
+        return result
+    command_id = esp32_ws.registry.send_command(device_id, action, params)
+    if command_id is None:
+        result.update(status='not_connected', error=f'Device {device_id} is not connected over WebSocket')
+    else:
+        result.update(status='sent', command_id=command_id)
+    return result
+
+# Admission control against Gemini's per-minute request and token quotas (limits set by load_config)
+gemini_quota = quota.QuotaScheduler()
+# Identical Gemini and Translate calls in flight at the same time are made once
+gemini_flight = singleflight.Group('gemini')
+translate_flight = singleflight.Group('translate')
+# Reply tokens assumed when reserving quota for a call without maxOutputTokens
+GEMINI_REPLY_TOKENS_ESTIMATE = 256
+# Seconds to hold calls back after a 429 that does not say how long
+GEMINI_DEFAULT_RETRY_AFTER = 10.0
+
+def gemini_retry_after(response):
+    """Seconds Gemini asks us to wait, from Retry-After or the error's RetryInfo retryDelay"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        pass
+    try:
+        for detail in response.json().get('error', {}).get('details', []):
+            if 'retryDelay' in detail:
+                return float(str(detail['retryDelay']).rstrip('s'))
+    except (ValueError, AttributeError):
+        pass
+    return GEMINI_DEFAULT_RETRY_AFTER
+
+def ask_gemini(message, language='en', contents=None, usage=None, generation_config=None, timeout=10,
+               priority='interactive', max_wait=None):
+    """Send message to Gemini API - always expect English input and get English response
+
+    contents overrides the single-turn prompt (e.g. a multi-turn prompt from
+    conversation.ConversationMemory); usage, if a dict, receives Gemini's token counts;
+    generation_config is sent as Gemini's generationConfig (e.g. a JSON response schema).
+    The call first waits (up to max_wait, default THENGA_GEMINI_MAX_WAIT_MS) for quota;
+    raises quota.QuotaExceeded when it is not admitted or Gemini answers 429.
+    """
+    if not GEMINI_API_KEY:
+        return "Error: GEMINI_API_KEY environment variable is not set. Please check your .env file."
     
-    full_message = f"{context}\n\nUser: {message}"
+    if contents is None:
+        # Single-turn prompt: persona plus the message
+        contents = [{"parts": [{"text": f"{THENGA_PERSONA}\n\nUser: {message}"}]}]
     
     data = {
-        "contents": [{"parts": [{"text": full_message}]}]
+        "contents": contents
     }
+    if generation_config:
+        data["generationConfig"] = generation_config
     
+    # Identical requests in flight at the same moment share one call (and one quota reservation)
+    key = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    wait_limit = timeout + (GEMINI_MAX_WAIT if max_wait is None else max_wait)
     try:
-        response = requests.post(GEMINI_API_URL, headers=headers, params=params, json=data, timeout=10)
+        (reply, reply_usage), shared = gemini_flight.do(key, lambda: post_gemini(data, timeout, priority, max_wait), wait_limit)
+    except TimeoutError as e:
+        tracing.record_upstream_error('gemini', e)
+        return f"Error connecting to Gemini API: {str(e)}"
+    if shared:
+        tracing.record_coalesced('gemini', not reply.startswith('Error'))
+    if usage is not None:
+        usage.update(reply_usage)
+    return reply
+
+def post_gemini(data, timeout=10, priority='interactive', max_wait=None):
+    """One generateContent call, admitted by the quota scheduler; returns (reply or "Error..." text, usageMetadata)"""
+    headers = {'Content-Type': 'application/json'}
+    params = {'key': GEMINI_API_KEY}
+    
+    # Reserve quota for the prompt plus the expected reply; time spent queueing comes off the timeout
+    estimated_tokens = sum(conversation.estimate_tokens(part.get('text', '')) for content in data['contents'] for part in content['parts'])
+    estimated_tokens += data.get('generationConfig', {}).get('maxOutputTokens', GEMINI_REPLY_TOKENS_ESTIMATE)
+    queued_at = time.perf_counter()
+    reservation = gemini_quota.acquire(estimated_tokens, priority, GEMINI_MAX_WAIT if max_wait is None else max_wait)
+    timeout = max(deadline.MIN_STAGE_SECONDS, timeout - (time.perf_counter() - queued_at))
+    
+    usage = {}
+    try:
+        response = upstream.post('gemini', GEMINI_API_URL, headers=headers, params=params, json=data, timeout=timeout)
+        tracing.record_upstream('gemini', response)
+        if response.status_code == 200:
+            metrics.record_upstream('gemini', 'ok')
+        else:
+            metrics.record_upstream('gemini', 'error', str(response.status_code))
         
         # Enhanced error handling with detailed response information
         if response.status_code == 200:
             result = response.json()
+            usage = result.get('usageMetadata', {})
+            if usage.get('totalTokenCount'):
+                reservation.settle(usage['totalTokenCount'])
             if 'candidates' in result and len(result['candidates']) > 0:
-                return result['candidates'][0]['content']['parts'][0]['text']
+                return result['candidates'][0]['content']['parts'][0]['text'], usage
             else:
-                return "Error: No response generated by Gemini API"
+                return "Error: No response generated by Gemini API", usage
+        elif response.status_code == 429:
+            # Quota exhausted upstream: hold every call back rather than sending more doomed ones
+            retry_after = gemini_retry_after(response)
+            gemini_quota.block(retry_after)
+            raise quota.QuotaExceeded('Gemini rate limit reached', retry_after)
         elif response.status_code == 400:
             error_detail = response.json() if response.content else "Bad request"
-            return f"Error 400: Invalid request - {error_detail}"
+            return f"Error 400: Invalid request - {error_detail}", usage
         elif response.status_code == 403:
-            return "Error 403: API key invalid or quota exceeded. Please check your Gemini API key."
+            return "Error 403: API key invalid or quota exceeded. Please check your Gemini API key.", usage
         elif response.status_code == 404:
-            return f"Error 404: API endpoint not found. Please check the model name. URL used: {GEMINI_API_URL}"
+            return f"Error 404: API endpoint not found. Please check the model name. URL used: {GEMINI_API_URL}", usage
         else:
             error_detail = response.text if response.content else "Unknown error"
-            return f"Error: API returned status {response.status_code} - {error_detail}"
+            return f"Error: API returned status {response.status_code} - {error_detail}", usage
             
     except requests.exceptions.RequestException as e:
-        return f"Error connecting to Gemini API: {str(e)}"
+        metrics.record_upstream('gemini', 'error', type(e).__name__)
+        tracing.record_upstream_error('gemini', e)
+        return f"Error connecting to Gemini API: {str(e)}", usage
+    except quota.QuotaExceeded:
+        raise
+    except Exception as e:
+        return f"Error processing response: {str(e)}", usage
+
+def summarize_with_gemini(prompt):
+    """Summarizer for the rolling conversation summary; None lets it fall back to an extractive one"""
+    try:
+        reply = ask_gemini(prompt, contents=[{"role": "user", "parts": [{"text": prompt}]}], priority='background')
+    except quota.QuotaExceeded:
+        return None
+    return None if reply.startswith('Error') else reply
+
+# Per-session multi-turn context for /chat (budgets are set by load_config)
+memory = conversation.ConversationMemory(THENGA_PERSONA, summarize=summarize_with_gemini)
+
+# Seconds from starting edge-tts to its first audio. gTTS is started as a hedge when
+# edge-tts has been silent for longer than this percentile of recent requests.
+TTS_HEDGE_PERCENTILE = 0.95
+TTS_HEDGE_DEFAULT_SECONDS = 1.5  # until there are enough samples to learn from
+TTS_HEDGE_MIN_SAMPLES = 20
+edge_first_audio = deque(maxlen=200)
+# gTTS has its own threads so a hedge that lost never holds up asyncio.run()
+gtts_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='thenga-gtts')
+
+def tts_hedge_delay():
+    samples = sorted(edge_first_audio)
+    if len(samples) < TTS_HEDGE_MIN_SAMPLES:
+        return TTS_HEDGE_DEFAULT_SECONDS
+    return _percentile(samples, TTS_HEDGE_PERCENTILE)
+
+async def synthesize_hedged(text, voice, lang_code, budget):
+    """Synthesize with edge-tts, starting gTTS alongside it if edge-tts fails or sends no
+    audio within the hedge delay; the first engine to finish wins
+
+    Returns (path, engine, hedged). Raises TimeoutError when the budget runs out first,
+    and RuntimeError with each engine's error when both fail.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    hedge_at = started + tts_hedge_delay()
+    first_audio = asyncio.Event()
+    settled = threading.Event()
+    paths = {}
+    tasks = {}
+    errors = {}
+    winner = None
+    hedged = False
+
+    def new_path(engine):
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+        temp_file.close()
+        paths[engine] = temp_file.name
+        return temp_file.name
+
+    def on_first_audio():
+        edge_first_audio.append(time.perf_counter() - started)
+        first_audio.set()
+
+    async def run_edge(path):
+        try:
+            with metrics.stage('tts', 'edge_tts'):
+                await upstream.edge_tts_save(text, voice, path, on_first_audio)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.record_upstream('edge_tts', 'error', type(e).__name__)
+            raise
+        metrics.record_upstream('edge_tts', 'ok')
+
+    def run_gtts(path):
+        try:
+            with metrics.stage('tts', 'gtts'):
+                upstream.gtts_save(text, lang_code, path)
+        except Exception as e:
+            metrics.record_upstream('gtts', 'error', type(e).__name__)
+            raise
+        finally:
+            # Nobody is waiting for this file any more
+            if settled.is_set() and os.path.exists(path):
+                os.unlink(path)
+        metrics.record_upstream('gtts', 'ok')
+
+    tasks[asyncio.ensure_future(run_edge(new_path('edge_tts')))] = 'edge_tts'
+    try:
+        while tasks:
+            wait = budget.remaining()
+            if 'gtts' not in paths and not first_audio.is_set():
+                wait = min(wait, max(0.0, hedge_at - time.perf_counter()))
+            done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                engine = tasks.pop(task)
+                if task.exception() is None:
+                    winner = engine
+                    if hedged:
+                        metrics.TTS_HEDGES.inc(winner=engine)
+                    return paths[engine], engine, hedged
+                errors[engine] = task.exception()
+            if budget.remaining() <= 0:
+                raise TimeoutError('TTS deadline exceeded')
+            # edge-tts failed, or is still silent past the hedge delay: start gTTS
+            if 'gtts' not in paths and (errors or (not first_audio.is_set() and time.perf_counter() >= hedge_at)):
+                if not budget.fits('gtts'):
+                    raise TimeoutError('No time left for the gTTS fallback')
+                hedged = bool(tasks)
+                if errors:
+                    log.warning('Edge-TTS failed, falling back to gTTS', extra={'fields': {'error': str(errors['edge_tts'])}})
+                tasks[loop.run_in_executor(gtts_executor, run_gtts, new_path('gtts'))] = 'gtts'
+        raise RuntimeError(', '.join(f'{engine}: {error}' for engine, error in errors.items()))
+    finally:
+        settled.set()
+        running = set()
+        for task, engine in tasks.items():
+            task.cancel()
+            if engine == 'gtts':
+                running.add(engine)
+        for engine, path in paths.items():
+            if engine != winner and engine not in running and os.path.exists(path):
+                os.unlink(path)
+
+# Clips in AUDIO_DIR with their size, hash and duration (directory set by load_config)
+audio_files = audio_index.AudioIndex()
+# Packed clips from CLIP_ARCHIVE, opened by create_app()
+clip_store = clip_archive.ClipArchive()
+
+def archived_clip(name):
+    """The archive's copy of a clip in AUDIO_DIR, unless a loose file with other content replaced it"""
+    clip = clip_store.get(name)
+    if clip is None:
+        return None
+    loose = audio_files.get(name)
+    return clip if loose is None or loose.hash == clip.hash else None
+
+def have_clip(name):
+    return archived_clip(name) is not None or audio_files.get(name) is not None
+
+# edge-tts audio of sentences already spoken, by voice (size set by load_config)
+sentence_audio = audio_cache.SentenceAudioCache()
+# MP3/Opus negotiation for /tts and /audio/files (ffmpeg path set by load_config)
+transcoder = transcode.Transcoder()
+
+def synthesize_sentences(sentences, voice, lang_code, budget):
+    """MP3 frames for each sentence: from the sentence audio cache, or synthesized on a
+    background event loop, TTS_SENTENCE_WORKERS at a time
+
+    Returns one Future per sentence, in order, and an Event that stops sentences that
+    have not started yet (e.g. when the client has gone away).
+    """
+    futures = [Future() for _ in sentences]
+    cancelled = threading.Event()
+    missing = []
+    for index, sentence in enumerate(sentences):
+        cached = sentence_audio.get(voice, sentence)
+        if cached is None:
+            missing.append(index)
+        else:
+            sentence_audio.account('cache', cached[1])
+            futures[index].set_result(cached[0])
+
+    async def run_one(index, slots):
+        async with slots:
+            if cancelled.is_set():
+                futures[index].cancel()
+                return
+            try:
+                path, engine, _ = await synthesize_hedged(sentences[index], voice, lang_code, budget)
+                try:
+                    with open(path, 'rb') as f:
+                        audio = f.read()
+                finally:
+                    os.unlink(path)
+            except Exception as e:
+                futures[index].set_exception(e)
+                return
+            # Only edge-tts clips are kept: a gTTS fallback would change the voice of later replies
+            if engine == 'edge_tts':
+                frames, seconds = sentence_audio.put(voice, sentences[index], audio)
+            else:
+                frames = mp3.audio_frames(audio)
+                seconds = mp3.duration(frames)
+            sentence_audio.account('synthesized', seconds)
+            futures[index].set_result(frames)
+
+    async def run_all():
+        slots = asyncio.Semaphore(TTS_SENTENCE_WORKERS)
+        await asyncio.gather(*(run_one(index, slots) for index in missing))
+
+    if missing:
+        threading.Thread(target=asyncio.run, args=(run_all(),), name='thenga-tts-sentences', daemon=True).start()
+    return futures, cancelled, len(sentences) - len(missing)
+
+def stream_sentences(sentences, voice, lang_code, budget, audio_format='mp3', bitrate=None, etag=None):
+    """/tts response: the sentences' MP3 frames joined in order, each sent as soon as it and
+    the ones before it are ready (piped through ffmpeg for Opus or another bitrate)"""
+    futures, cancelled, cached = synthesize_sentences(sentences, voice, lang_code, budget)
+    # The first sentence decides the status code; after that, a failed sentence is left out
+    try:
+        first = futures[0].result(timeout=budget.remaining() + 1)
+    except (TimeoutError, FutureTimeout):
+        cancelled.set()
+        budget.degrade('skipped_tts')
+        metrics.DEGRADATIONS.inc(endpoint='tts', degradation='skipped_tts')
+        return jsonify({'error': 'TTS deadline exceeded', 'deadline': budget.to_dict()}), 504
     except Exception as e:
-        return f"Error processing response: {str(e)}"
+        cancelled.set()
+        log.error('TTS engines failed', extra={'fields': {'error': str(e)}})
+        return jsonify({'error': f'TTS failed: {str(e)}'}), 500
+
+    def generate():
+        try:
+            yield first
+            complete = True
+            for index, future in enumerate(futures[1:], start=1):
+                try:
+                    yield future.result(timeout=budget.remaining() + 1)
+                except Exception as e:
+                    complete = False
+                    metrics.DEGRADATIONS.inc(endpoint='tts', degradation='skipped_sentence')
+                    log.warning('TTS sentence failed', extra={'fields': {'sentence': index, 'error': type(e).__name__}})
+            if etag:
+                record_tts_delivery(etag, complete)
+        finally:
+            cancelled.set()
+
+    audio = generate()
+    if audio_format != 'mp3' or bitrate:
+        audio = transcoder.pipe(audio, audio_format, bitrate)
+    spec = transcode.FORMATS[audio_format]
+    response = Response(transcoder.metered(audio, 'tts', audio_format), mimetype=spec['mimetype'],
+                        headers={'Content-Disposition': f"attachment; filename=speech{spec['extension']}",
+                                 'Vary': 'Accept',
+                                 'X-TTS-Sentences': str(len(sentences)),
+                                 'X-TTS-Cached-Sentences': str(cached)})
+    if etag:
+        set_tts_cache_headers(response, etag)
+    return response
+
+def tts_etag(voice, text, audio_format, bitrate):
+    """Validator for a /tts response: weak, since synthesizing the same text again gives
+    audio that sounds the same but is not byte-identical"""
+    key = '\n'.join((voice, audio_format, str(bitrate or ''), text))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+
+# Validators of /tts responses that went out with a sentence missing. The headers (and the
+# ETag) are sent before the last sentence is known to have worked, so instead of a 304 the
+# next conditional request for one of these gets the audio again, replacing the client's
+# truncated copy. Kept per process: under several workers a retry may still get one 304.
+incomplete_tts = OrderedDict()
+INCOMPLETE_TTS_MAX = 1024
+incomplete_tts_lock = threading.Lock()
+
+def record_tts_delivery(etag, complete):
+    with incomplete_tts_lock:
+        if complete:
+            incomplete_tts.pop(etag, None)
+        else:
+            incomplete_tts[etag] = True
+            incomplete_tts.move_to_end(etag)
+            while len(incomplete_tts) > INCOMPLETE_TTS_MAX:
+                incomplete_tts.popitem(last=False)
+
+def tts_not_modified(etag):
+    """Whether the client's copy (If-None-Match) of this /tts audio is complete and current"""
+    if not request.if_none_match.contains_weak(etag):
+        return False
+    with incomplete_tts_lock:
+        return etag not in incomplete_tts
+
+def set_tts_cache_headers(response, etag):
+    # Clients keep the audio and revalidate; a match is answered with 304 before any synthesis.
+    # RFC 9110 only defines 304 for GET and HEAD. /tts is a POST (the text can be too long for
+    # a URL), so this is a deviation that only the bundled page relies on.
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # Text-to-speech endpoint - improved with edge-tts
-@app.route('/tts', methods=['POST'])
+@bp.route('/tts', methods=['POST'])
 def tts():
     try:
         if not request.json:
@@ -160,13 +708,29 @@ def tts():
             
         text = request.json.get('text', '')
         
-        if not text:
+        if not text.strip():
             return jsonify({'error': 'No text provided'}), 400
+        try:
+            budget_ms = deadline.requested_ms(request.json.get('deadline_ms'), TTS_DEADLINE_MS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # MP3 unless the client asks for Opus (Accept: audio/ogg or "format") or another "bitrate"
+        try:
+            audio_format, bitrate = transcoder.negotiate(
+                request.accept_mimetypes,
+                request.json.get('format') or request.args.get('format'),
+                request.json.get('bitrate') or request.args.get('bitrate'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        print(f"TTS Debug: Processing text: {text[:100]}...")
+        # TTS gives up when the budget runs out; gTTS (which has no timeout) only starts if its share is left
+        budget = deadline.Deadline(budget_ms / 1000, TTS_STAGE_SHARES)
+        
+        log.debug('TTS request', extra={'fields': {'text': logs.payload(text, preview=100), 'chars': len(text)}})
         
         # Detect language for appropriate voice selection
-        detected_lang = detect_language(text)
+        with metrics.stage('tts', 'detect'):
+            detected_lang = detect_language(text)
         
         # Select voice based on detected language - MALE VOICES
         if detected_lang == 'ml' or detected_lang == 'manglish':
@@ -178,61 +742,30 @@ def tts():
             voice = "en-IN-PrabhatNeural"  # Male Indian English voice
             lang_code = 'en'
         
-        print(f"TTS Debug: Using voice {voice} for language {detected_lang}")
+        log.debug('TTS voice selected', extra={'fields': {'voice': voice, 'language': detected_lang}})
         
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        temp_file.close()
-        
-        try:
-            # Use edge-tts for high-quality speech synthesis
-            async def generate_speech():
-                communicate = edge_tts.Communicate(text, voice)
-                await communicate.save(temp_file.name)
-            
-            # Run the async function
-            asyncio.run(generate_speech())
-            
-            print(f"TTS Debug: Successfully generated speech file: {temp_file.name}")
-            return send_file(temp_file.name, mimetype='audio/mpeg', as_attachment=True, download_name='speech.mp3')
-            
-        except Exception as edge_error:
-            print(f"Edge-TTS Error: {edge_error}")
-            
-            # Fallback to gTTS
-            try:
-                print("TTS Debug: Falling back to gTTS...")
-                
-                # Clean up the temp file first
-                if os.path.exists(temp_file.name):
-                    os.unlink(temp_file.name)
-                
-                # Create new temp file for gTTS
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-                temp_file.close()
-                
-                # Use appropriate language for gTTS
-                if detected_lang == 'ml' or detected_lang == 'manglish':
-                    tts_engine = gTTS(text=text, lang='ml', slow=False)
-                else:
-                    tts_engine = gTTS(text=text, lang='en', slow=False)
-                
-                tts_engine.save(temp_file.name)
-                print(f"TTS Debug: gTTS fallback successful: {temp_file.name}")
-                return send_file(temp_file.name, mimetype='audio/mpeg', as_attachment=True, download_name='speech_gtts.mp3')
-                
-            except Exception as gtts_error:
-                print(f"gTTS Fallback Error: {gtts_error}")
-                return jsonify({'error': f'TTS failed: Edge-TTS: {str(edge_error)}, gTTS: {str(gtts_error)}'}), 500
+        # Markdown and emoji are not spoken
+        text = speech_text.clean(text, lang_code)
+        if not text:
+            return jsonify({'error': 'Nothing to speak after removing markup'}), 400
+        
+        # One synthesis per sentence, several at once, streamed in order; sentences spoken
+        # before come from the sentence audio cache. edge-tts is hedged with gTTS when it
+        # is slow to start or fails.
+        etag = tts_etag(voice, text, audio_format, bitrate)
+        if tts_not_modified(etag):
+            return set_tts_cache_headers(Response(status=304), etag)
+        return stream_sentences(speech_text.split_sentences(text), voice, lang_code, budget, audio_format, bitrate, etag)
                 
     except Exception as e:
-        print(f"TTS General Error: {e}")
+        log.exception('TTS failed')
         return jsonify({'error': f'TTS failed: {str(e)}'}), 500
 
 # Add endpoint to get available voices
-@app.route('/voices', methods=['GET'])
+@bp.route('/voices', methods=['GET'])
 async def get_voices():
     try:
+        import edge_tts
         voices = await edge_tts.list_voices()
         # Filter for Malayalam and Indian English voices
         filtered_voices = []
@@ -249,7 +782,7 @@ async def get_voices():
         return jsonify({'error': f'Failed to get voices: {str(e)}'}), 500
 
 # Add endpoint to get supported languages
-@app.route('/languages', methods=['GET'])
+@bp.route('/languages', methods=['GET'])
 def get_languages():
     supported_languages = {
         'en': 'English',
@@ -261,7 +794,7 @@ def get_languages():
     return jsonify({'languages': supported_languages})
 
 # Add endpoint to get sample phrases
-@app.route('/sample_phrases', methods=['GET'])
+@bp.route('/sample_phrases', methods=['GET'])
 def get_sample_phrases():
     sample_phrases = {
         'en': [
@@ -282,13 +815,119 @@ def get_sample_phrases():
     return jsonify({'sample_phrases': sample_phrases})
 
 # Home page with chat interface
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('index.html')
 
-# Chatbot endpoint with new translation workflow
-@app.route('/chat', methods=['POST'])
+# Share of the /chat deadline reserved for each stage, in order (the rest is slack);
+# tts is the browser's /tts call that follows, which gets whatever is left
+CHAT_STAGE_SHARES = {
+    'translate': {'translate_in': 0.15, 'gemini': 0.5, 'translate_out': 0.15, 'tts': 0.2},
+    'direct': {'gemini': 0.7, 'tts': 0.2}
+}
+TTS_STAGE_SHARES = {'edge_tts': 0.6, 'gtts': 0.4}
+# Below this the client is told to skip TTS; even a short reply rarely synthesizes faster
+MIN_TTS_SECONDS = 1.0
+
+# Recent answers, reused for near-identical messages and served when Gemini cannot reply in time
+answers = answer_cache.AnswerCache()
+# Shorter messages ("yes", "why?") depend on the conversation, so their answers are never reused
+REUSE_MIN_CHARS = 12
+# Recent lookups for the match score report
+answer_matches = deque(maxlen=500)
+
+def stage_failed(entry):
+    """Whether any upstream call in a trace stage failed or timed out"""
+    return any(call.get('error') or call.get('status') != 200 for call in entry['upstream'])
+
+def lookup_answer(key, message, use, max_age=None):
+    """Closest cached answer to message under key, or None; use is 'reuse' (before Gemini) or 'fallback'
+
+    Returns (answer, match report); the report carries the similarity score for tuning
+    THENGA_ANSWER_MATCH_THRESHOLD.
+    """
+    start = time.perf_counter()
+    answer, score, matched = answers.match(key, message, ANSWER_MATCH_THRESHOLD, max_age)
+    report = {
+        'use': use,
+        'hit': answer is not None,
+        'score': round(score, 3),
+        'threshold': ANSWER_MATCH_THRESHOLD,
+        'matched_message': matched,
+        'lookup_ms': round((time.perf_counter() - start) * 1000, 3)
+    }
+    metrics.record_cache('chat_answer' if use == 'fallback' else 'chat_answer_reuse', answer is not None)
+    if matched is not None:
+        metrics.ANSWER_MATCH_SCORE.observe(score, use=use)
+    answer_matches.append(report)
+    return answer, report
+
+# Recent successful /chat turns per pipeline for the A/B latency report
+PIPELINE_WINDOW = 500
+pipeline_turns = {name: deque(maxlen=PIPELINE_WINDOW) for name in CHAT_PIPELINES}
+_ab_turn = itertools.count()
+
+def choose_pipeline(requested):
+    """Pipeline for one /chat turn: the request's choice, else THENGA_CHAT_PIPELINE; None if unknown"""
+    if requested:
+        return requested if requested in CHAT_PIPELINES else None
+    if CHAT_PIPELINE == 'ab':
+        return CHAT_PIPELINES[next(_ab_turn) % len(CHAT_PIPELINES)]
+    return CHAT_PIPELINE
+
+def chat_persona(pipeline, output):
+    persona = PIPELINE_PERSONAS[pipeline]
+    if output == 'structured':
+        persona = f"{persona}\n\n{STRUCTURED_INSTRUCTION}"
+    return persona
+
+# Work started from interim speech transcripts by /chat/prepare; /chat takes it over when the words match
+speculator = speculation.Speculator()
+
+def speculate_turn(turn, session_id):
+    """Translate a speculation's text and ask Gemini (background priority); None if any step failed"""
+    with tracing.start_trace('chat_prepare') as trace:
+        english_message = turn.text
+        if turn.pipeline == 'translate' and detect_language(turn.text) in ['ml', 'manglish']:
+            with trace.stage('translate_in') as entry:
+                english_message, _ = translate_text(turn.text, target_language='en', source_language='ml')
+            if stage_failed(entry):
+                return None
+        # Superseded by a longer prefix while translating: skip the Gemini call
+        if turn.cancelled.is_set():
+            return None
+        with trace.stage('context'):
+            contents, context_report = memory.build(session_id, english_message, persona=chat_persona(turn.pipeline, turn.output))
+        usage = {}
+        try:
+            with trace.stage('gemini'):
+                gemini_reply = ask_gemini(english_message, 'en', contents=contents, usage=usage,
+                                          generation_config=structured_generation_config() if turn.output == 'structured' else None,
+                                          priority='background')
+        except quota.QuotaExceeded:
+            return None
+        if gemini_reply.startswith('Error'):
+            return None
+        return {
+            'english_message': english_message,
+            'contents': contents,
+            'context': context_report,
+            'gemini_reply': gemini_reply,
+            'usage': usage,
+            'trace_id': trace.trace_id
+        }
+
+# Chatbot endpoint with new translation workflow (or direct Malayalam replies)
+@bp.route('/chat', methods=['POST'])
 def chat():
+    with tracing.start_trace('chat', request.headers.get(tracing.TRACE_HEADER)) as trace:
+        response, status = chat_with_trace(trace)
+        log.info('chat trace', extra={'fields': trace.to_dict()})
+    response.headers[tracing.TRACE_HEADER] = trace.trace_id
+    return response, status
+
+def chat_with_trace(trace):
+    """Run the /chat workflow in the selected pipeline, timing each stage into the request trace"""
     try:
         # Check if request has JSON data
         if not request.json:
@@ -298,18 +937,58 @@ def chat():
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
         
+        pipeline = choose_pipeline(request.json.get('pipeline'))
+        if pipeline is None:
+            return jsonify({'error': f"Unknown pipeline, use one of: {', '.join(CHAT_PIPELINES)}"}), 400
+        output = request.json.get('output') or CHAT_OUTPUT
+        if output not in CHAT_OUTPUTS:
+            return jsonify({'error': f"Unknown output, use one of: {', '.join(CHAT_OUTPUTS)}"}), 400
+        try:
+            budget_ms = deadline.requested_ms(request.json.get('deadline_ms'), CHAT_DEADLINE_MS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        session_id = str(request.json.get('session_id') or request.headers.get('X-Session-Id') or 'default')[:64]
+        
+        # A /chat/prepare speculation on these exact words may already have translated them and asked Gemini
+        speculated_turn = speculator.claim(session_id, user_message)
+        if speculated_turn is not None and not request.json.get('pipeline') and CHAT_PIPELINE == 'ab':
+            pipeline = speculated_turn.pipeline
+        
+        # Overall deadline for this turn, split across the stages; stages that no longer fit are degraded
+        budget = deadline.Deadline(budget_ms / 1000, CHAT_STAGE_SHARES[pipeline])
+        
+        speculated = None
+        if speculated_turn is not None:
+            if (speculated_turn.pipeline, speculated_turn.output) == (pipeline, output):
+                with trace.stage('speculation') as entry:
+                    speculated = speculated_turn.result(budget.timeout('gemini'))
+                    entry['speculative_trace_id'] = speculated['trace_id'] if speculated else None
+            speculator.settle(speculated_turn, speculated is not None)
+        
         # Step 1: Detect language of user input
-        detected_language = detect_language(user_message)
+        with trace.stage('detect'):
+            detected_language = detect_language(user_message)
         
-        print(f"Chat Debug: Original message='{user_message}', Detected language={detected_language}")
+        log.debug('Chat message received', extra={'fields': {'message': logs.payload(user_message), 'language': detected_language}})
         
-        # Step 2: Translate to English for Gemini processing
+        # Step 2: Translate to English for Gemini processing (the direct pipeline sends the original)
         english_message = user_message
-        if detected_language in ['ml', 'manglish']:
+        if speculated is not None:
+            english_message = speculated['english_message']
+        elif pipeline == 'translate' and detected_language in ['ml', 'manglish']:
             # Translate Malayalam/Manglish to English
             source_lang = 'ml' if detected_language == 'ml' else 'ml'  # Treat Manglish as Malayalam for translation
-            english_message, _ = translate_text(user_message, target_language='en', source_language=source_lang)
-            print(f"Translated to English: '{english_message}'")
+            translated = False
+            if budget.fits('translate_in'):
+                with trace.stage('translate_in') as entry:
+                    english_message, _ = translate_text(user_message, target_language='en', source_language=source_lang,
+                                                        timeout=budget.timeout('translate_in'))
+                translated = not stage_failed(entry)
+            if not translated:
+                # Gemini can still make sense of the original text
+                english_message = user_message
+                budget.degrade('untranslated_input')
+            log.debug('Translated to English', extra={'fields': {'text': logs.payload(english_message)}})
         
         # Store user message in history with original language
         conversation_history.append({
@@ -320,13 +999,136 @@ def chat():
             'translated_to_english': english_message if english_message != user_message else None
         })
         
-        # Step 3: Get response from Gemini in English
-        english_reply = ask_gemini(english_message, 'en')
-        print(f"Gemini English response: '{english_reply}'")
+        # Step 3: Build a multi-turn prompt for this session within the token budget
+        if speculated is not None:
+            contents, context_report = speculated['contents'], speculated['context']
+        else:
+            with trace.stage('context'):
+                contents, context_report = memory.build(session_id, english_message, persona=chat_persona(pipeline, output))
+        
+        # Step 4: Get response from Gemini (in English, or in Malayalam for the direct pipeline);
+        # a recent answer to a near-identical message is reused instead, and an earlier one
+        # stands in when Gemini is out of time or fails. Answers are kept per output, pipeline and
+        # session: the same words can mean something else in another conversation
+        usage = {}
+        cached = None
+        answer_match = None
+        answer_key = (output, pipeline, session_id)
+        if speculated is None and ANSWER_REUSE_SECONDS > 0 and len(answer_cache.normalize(english_message)) >= REUSE_MIN_CHARS:
+            with trace.stage('answer_cache'):
+                cached, answer_match = lookup_answer(answer_key, english_message, 'reuse', max_age=ANSWER_REUSE_SECONDS)
+        reused = cached is not None
+        if speculated is None and cached is None and not budget.fits('gemini'):
+            cached, answer_match = lookup_answer(answer_key, english_message, 'fallback')
+        quota_error = None
+        gemini_timed_out = False
+        if speculated is not None:
+            gemini_reply, usage = speculated['gemini_reply'], speculated['usage']
+        elif cached is None:
+            try:
+                with trace.stage('gemini') as entry:
+                    # Queue for quota for at most half of what is left for Gemini
+                    gemini_reply = ask_gemini(english_message, 'en', contents=contents, usage=usage,
+                                              generation_config=structured_generation_config() if output == 'structured' else None,
+                                              timeout=max(budget.timeout('gemini'), deadline.MIN_STAGE_SECONDS),
+                                              max_wait=min(GEMINI_MAX_WAIT, budget.timeout('gemini') / 2))
+            except quota.QuotaExceeded as e:
+                quota_error = e
+                gemini_reply = f'Error: {e}'
+            log.debug('Gemini reply', extra={'fields': {'text': logs.payload(gemini_reply)}})
+            if gemini_reply.startswith('Error'):
+                # Ran past its stage budget: the call timed out, or the turn's time is gone
+                gemini_timed_out = quota_error is None and (
+                    budget.remaining() <= 0 or any('Timeout' in (call.get('error') or '') for call in entry['upstream']))
+                if gemini_timed_out:
+                    budget.degrade('gemini_timeout')
+                cached, answer_match = lookup_answer(answer_key, english_message, 'fallback')
+        if cached is None and quota_error is not None:
+            # Nothing to fall back on: tell the client when to retry instead of speaking an error
+            response = jsonify({'error': 'Thenga is over its Gemini quota, please try again shortly',
+                                'retry_after': math.ceil(quota_error.retry_after), 'trace_id': trace.trace_id})
+            response.headers['Retry-After'] = str(math.ceil(quota_error.retry_after))
+            return response, 429
+        if cached is None and gemini_reply.startswith('Error'):
+            # Nothing to fall back on: report the failure rather than translate and speak the error text
+            for degradation in budget.degraded:
+                metrics.DEGRADATIONS.inc(endpoint='chat', degradation=degradation)
+            log.warning('Gemini failed without a fallback answer', extra={'fields': {'timed_out': gemini_timed_out, 'trace_id': trace.trace_id}})
+            return jsonify({'error': 'Gemini did not answer in time' if gemini_timed_out else 'Gemini request failed',
+                            'deadline': budget.to_dict(), 'trace_id': trace.trace_id}), 504 if gemini_timed_out else 502
+        if cached is not None:
+            if not reused:
+                budget.degrade('cached_answer')
+            gemini_reply = cached['english'] or cached['reply']
+        
+        # Structured replies: only the speech goes on to translation and TTS, the action goes to the device
+        device_action = None
+        action, params = None, {}
+        if output == 'structured' and cached is None:
+            gemini_reply, action, params = parse_structured_reply(gemini_reply)
+        if action:
+            device_id = request.json.get('device_id') or DEFAULT_DEVICE_ID
+            with trace.stage('device_action'):
+                device_action = dispatch_device_action(device_id, action, params)
+            log.info('Chat device action', extra={'fields': device_action})
+        if cached is None or reused:
+            memory.append(session_id, english_message, gemini_reply)
+        
+        context_report['prompt_tokens'] = usage.get('promptTokenCount')
+        context_report['reply_tokens'] = usage.get('candidatesTokenCount')
+        metrics.GEMINI_TOKENS.observe(context_report['prompt_tokens'] or context_report['estimated_prompt_tokens'], kind='prompt')
+        if context_report['reply_tokens']:
+            metrics.GEMINI_TOKENS.observe(context_report['reply_tokens'], kind='reply')
+        
+        # Step 5: Translate Gemini's English response to Malayalam (or return it in English when out of time)
+        translate_chars_saved = 0
+        if cached is not None:
+            english_reply, malayalam_reply = cached['english'], cached['reply']
+        elif pipeline == 'direct':
+            english_reply, malayalam_reply = None, gemini_reply
+        else:
+            english_reply = gemini_reply
+            # Only the plain text is translated: markdown, code and emoji are dropped first
+            with trace.stage('speech_text'):
+                plain_english = speech_text.clean(english_reply, 'en')
+            translate_chars_saved = len(english_reply) - len(plain_english)
+            metrics.SPEECH_CHARS_SAVED.inc(max(0, translate_chars_saved), hop='translate')
+            translated = False
+            if budget.fits('translate_out'):
+                with trace.stage('translate_out') as entry:
+                    malayalam_reply, _ = translate_text(plain_english, target_language='ml', source_language='en',
+                                                        timeout=budget.timeout('translate_out'))
+                translated = not stage_failed(entry)
+            if not translated:
+                malayalam_reply = plain_english
+                budget.degrade('untranslated_reply')
+            log.debug('Translated to Malayalam', extra={'fields': {'text': logs.payload(malayalam_reply)}})
+        # Replies that moved the device are not kept: a cached answer never acts again
+        if cached is None and not budget.degraded and not action:
+            answers.put(answer_key, english_message, {'english': english_reply, 'reply': malayalam_reply})
+        
+        # What the client should speak: the reply as plain sentences with units written out, capped
+        # at THENGA_SPOKEN_MAX_CHARS (the reply itself, e.g. the direct pipeline's markdown, is for display)
+        spoken = speech_text.cap(speech_text.clean(malayalam_reply, 'ml' if detect_language(malayalam_reply) == 'ml' else 'en'),
+                                 SPOKEN_MAX_CHARS)
+        tts_chars_saved = len(malayalam_reply) - len(spoken)
+        metrics.SPEECH_CHARS_SAVED.inc(max(0, tts_chars_saved), hop='tts')
+        speech_report = {
+            'reply_chars': len(malayalam_reply),
+            'spoken_chars': len(spoken),
+            'translate_chars_saved': translate_chars_saved,
+            'tts_chars_saved': tts_chars_saved
+        }
         
-        # Step 4: Translate Gemini's English response to Malayalam
-        malayalam_reply, _ = translate_text(english_reply, target_language='ml', source_language='en')
-        print(f"Translated to Malayalam: '{malayalam_reply}'")
+        # Tell the client whether there is still time to synthesize the reply
+        skip_tts = not budget.fits('tts', MIN_TTS_SECONDS)
+        if skip_tts:
+            budget.degrade('skipped_tts')
+        deadline_report = budget.to_dict()
+        deadline_report['skip_tts'] = skip_tts
+        deadline_report['tts_deadline_ms'] = 0 if skip_tts else round(budget.remaining() * 1000)
+        for degradation in budget.degraded:
+            metrics.DEGRADATIONS.inc(endpoint='chat', degradation=degradation)
         
         # Store bot response in history
         conversation_history.append({
@@ -337,368 +1139,714 @@ def chat():
             'original_english': english_reply
         })
         
+        trace_report = trace.finish().to_dict()
+        if cached is None:
+            metrics.CHAT_SECONDS.observe(trace.total_ms / 1000, pipeline=pipeline)
+            # Speculated turns did most of their work before the request; keep them out of the A/B report
+            if speculated is None:
+                pipeline_turns[pipeline].append((trace.total_ms, {stage['stage']: stage['duration_ms'] for stage in trace.stages}))
+        
         return jsonify({
             'reply': malayalam_reply,
+            'spoken': spoken,
             'detected_language': detected_language,
             'suggested_tts_language': 'ml',  # Always Malayalam TTS
+            'direct_processing': pipeline == 'direct',
+            'device_action': device_action,
+            'deadline': deadline_report,
             'translation_workflow': {
+                'pipeline': pipeline,
+                'output': output,
                 'original_message': user_message,
                 'detected_language': detected_language,
                 'english_for_gemini': english_message,
                 'gemini_english_response': english_reply,
-                'final_malayalam_response': malayalam_reply
+                'final_malayalam_response': malayalam_reply,
+                'context': context_report,
+                'answer_cache': answer_match,
+                'speech_text': speech_report,
+                'speculated': speculated is not None,
+                'trace': trace_report
             }
-        })
+        }), 200
     except Exception as e:
-        print(f"Chat error: {e}")
+        log.exception('Chat failed')
+        return jsonify({'error': str(e), 'trace_id': trace.trace_id}), 500
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted, non-empty list"""
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+# A/B latency report: recent /chat turns per pipeline and what the direct pipeline saves
+@bp.route('/chat/pipelines', methods=['GET'])
+def chat_pipeline_report():
+    report = {'default': CHAT_PIPELINE, 'window': PIPELINE_WINDOW, 'pipelines': {}}
+    for name, window in pipeline_turns.items():
+        turns = list(window)
+        totals = sorted(total for total, _ in turns)
+        stages = {}
+        for _, durations in turns:
+            for stage, ms in durations.items():
+                stages[stage] = stages.get(stage, 0) + ms
+        report['pipelines'][name] = {
+            'turns': len(turns),
+            'p50_ms': _percentile(totals, 0.50) if totals else None,
+            'p95_ms': _percentile(totals, 0.95) if totals else None,
+            'mean_ms': round(sum(totals) / len(totals), 2) if totals else None,
+            'stage_mean_ms': {stage: round(ms / len(turns), 2) for stage, ms in stages.items()}
+        }
+    translate, direct = report['pipelines']['translate'], report['pipelines']['direct']
+    if translate['turns'] and direct['turns']:
+        report['direct_saves_ms'] = {key: round(translate[f'{key}_ms'] - direct[f'{key}_ms'], 2) for key in ('p50', 'p95', 'mean')}
+    return jsonify(report)
+
+# Answer cache match scores: how close recent hits and near misses were, to tune the threshold
+@bp.route('/chat/answers', methods=['GET'])
+def chat_answer_report():
+    lookups = list(answer_matches)
+    report = {
+        'entries': len(answers),
+        'threshold': ANSWER_MATCH_THRESHOLD,
+        'reuse_seconds': ANSWER_REUSE_SECONDS,
+        'window': answer_matches.maxlen,
+        'lookups': {}
+    }
+    for use in ('reuse', 'fallback'):
+        matches = [match for match in lookups if match['use'] == use]
+        hits = sorted(match['score'] for match in matches if match['hit'])
+        # Best scores that missed the threshold, highest first: candidates for lowering it
+        near_misses = sorted((match['score'] for match in matches if not match['hit'] and match['matched_message']), reverse=True)
+        lookup_ms = sorted(match['lookup_ms'] for match in matches)
+        report['lookups'][use] = {
+            'count': len(matches),
+            'hits': len(hits),
+            'hit_ratio': round(len(hits) / len(matches), 3) if matches else None,
+            'hit_score_p50': _percentile(hits, 0.50) if hits else None,
+            'hit_score_min': hits[0] if hits else None,
+            'near_miss_scores': near_misses[:10],
+            'lookup_ms_p95': _percentile(lookup_ms, 0.95) if lookup_ms else None
+        }
+    return jsonify(report)
+
+# Speculative warm-up: interim speech transcripts start translation and Gemini before the final /chat
+@bp.route('/chat/prepare', methods=['POST'])
+def chat_prepare():
+    try:
+        if not request.json:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        transcript = request.json.get('message', '')
+        if not transcript:
+            return jsonify({'error': 'No message provided'}), 400
+        requested = request.json.get('pipeline')
+        if requested and requested not in CHAT_PIPELINES:
+            return jsonify({'error': f"Unknown pipeline, use one of: {', '.join(CHAT_PIPELINES)}"}), 400
+        # In A/B mode the speculation picks the pipeline and the final /chat follows it
+        pipeline = choose_pipeline(requested)
+        output = request.json.get('output') or CHAT_OUTPUT
+        if output not in CHAT_OUTPUTS:
+            return jsonify({'error': f"Unknown output, use one of: {', '.join(CHAT_OUTPUTS)}"}), 400
+        session_id = str(request.json.get('session_id') or request.headers.get('X-Session-Id') or 'default')[:64]
+        report = speculator.observe(session_id, transcript, pipeline, output,
+                                    lambda turn: speculate_turn(turn, session_id))
+        return jsonify(report), 202
+    except Exception as e:
+        log.exception('Chat prepare failed')
         return jsonify({'error': str(e)}), 500
 
+# How often speculation from interim transcripts was used by the final /chat
+@bp.route('/chat/speculation', methods=['GET'])
+def chat_speculation_report():
+    return jsonify(speculator.snapshot())
+
+# Notification messages for ESP32 events, synthesized into AUDIO_DIR on first use
+# (and packed into the clip archive by `python -m clip_archive`)
+BUTTON_MESSAGES = {
+    'button1_pressed': 'ബട്ടൺ ഒന്ന് അമർത്തി',  # Button 1 pressed
+    'button1_released': 'ബട്ടൺ ഒന്ന് വിട്ടു',    # Button 1 released
+    'button1_clicked': 'ബട്ടൺ ഒന്ന് ക്ലിക്ക് ചെയ്തു',  # Button 1 clicked
+    'button2_pressed': 'ബട്ടൺ രണ്ട് അമർത്തി',   # Button 2 pressed
+    'button2_released': 'ബട്ടൺ രണ്ട് വിട്ടു',     # Button 2 released
+    'button2_clicked': 'ബട്ടൺ രണ്ട് ക്ലിക്ക് ചെയ്തു',   # Button 2 clicked
+    'default_pressed': 'ബട്ടൺ അമർത്തി',         # Default button pressed
+    'default_released': 'ബട്ടൺ വിട്ടു',           # Default button released
+    'default_clicked': 'ബട്ടൺ ക്ലിക്ക് ചെയ്തു',    # Default button clicked
+}
+GYRO_MESSAGE = 'ഗൈറോസ്കോപ്പ് പരിധി കവിഞ്ഞു'  # Gyroscope threshold exceeded in Malayalam
+PLACEMENT_MESSAGE = 'ഉപകരണം താഴെ വെച്ചു, മോട്ടർ ആരംഭിച്ചു'  # Device placed down, motor started in Malayalam
+
+def notification_messages():
+    """Every generated notification clip: {file name: message}"""
+    clips = {f'{key}.mp3': message for key, message in BUTTON_MESSAGES.items()}
+    clips['gyro_threshold.mp3'] = GYRO_MESSAGE
+    clips['device_placement_default.mp3'] = PLACEMENT_MESSAGE
+    return clips
+
+def process_button_event(data):
+    """Handle an ESP32 button event (HTTP or WebSocket) and return (response, status)"""
+    button_id = data.get('button_id', 'default')
+    button_state = data.get('state', 'pressed')  # pressed, released, clicked
+    timestamp = data.get('timestamp', datetime.now().isoformat())
+
+    log.info('ESP32 button event', extra={'fields': {'button_id': button_id, 'state': button_state, 'device_time': timestamp}})
+
+    audio_messages = BUTTON_MESSAGES
+
+    # Generate audio key
+    audio_key = f"{button_id}_{button_state}"
+    if audio_key not in audio_messages:
+        audio_key = f"default_{button_state}"
+
+    message = audio_messages.get(audio_key, 'ബട്ടൺ ഇവന്റ്')  # Button event
+
+    # Generate audio file name
+    audio_filename = f"{audio_key}.mp3"
+    audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+
+    # Generate audio file if it doesn't exist
+    audio_cached = have_clip(audio_filename)
+    metrics.record_cache('notification_audio', audio_cached)
+    if not audio_cached:
+        log.info('Generating notification audio', extra={'fields': {'audio_key': audio_key}})
+        generated_path = generate_notification_audio(message, audio_filename)
+        if not generated_path:
+            return {'error': 'Failed to generate audio'}, 500
+
+    # Play the audio file
+    success = play_audio_file(audio_file_path)
+
+    # Store button event in history
+    button_event = {
+        'timestamp': timestamp,
+        'type': 'button_event',
+        'button_id': button_id,
+        'state': button_state,
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'message': message
+    }
+
+    conversation_history.append(button_event)
+
+    response_data = {
+        'status': 'success',
+        'message': f'Button {button_id} {button_state} event processed',
+        'audio_played': success,
+        'audio_message': message,
+        'timestamp': timestamp
+    }
+
+    # Add device control logic based on button
+    if button_id == 'button1':
+        if button_state == 'clicked':
+            # Button 1 clicked - toggle LED
+            response_data['device_action'] = 'LED toggled'
+            response_data['instructions'] = 'Turn LED on/off'
+    elif button_id == 'button2':
+        if button_state == 'clicked':
+            # Button 2 clicked - read sensors
+            response_data['device_action'] = 'Sensor reading requested'
+            response_data['instructions'] = 'Read temperature and humidity'
+
+    return response_data, 200
+
+def process_pickup_event(data):
+    """Handle an ESP32 pickup event (HTTP or WebSocket) and return (response, status)"""
+    event_type = data.get('event_type', 'unknown')
+    device_id = data.get('device_id', 'ESP32')
+    timestamp = data.get('timestamp', datetime.now().isoformat())
+    sensor = data.get('sensor', 'MPU6050')
+
+    log.info('ESP32 pickup event', extra={'fields': {'device_id': device_id, 'sensor': sensor, 'device_time': timestamp}})
+    # Play audio file 2 when device is picked up
+    audio_filename = '1.mp3'
+    audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+    success = play_audio_file(audio_file_path)
+    time.sleep(2)
+    audio_filename = '2.mp3'
+    audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+    success = play_audio_file(audio_file_path)
+
+    # Store pickup event in history
+    pickup_event = {
+        'timestamp': timestamp,
+        'type': 'pickup_event',
+        'device_id': device_id,
+        'sensor': sensor,
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'message': f'Played audio file: {audio_filename}'
+    }
+
+    conversation_history.append(pickup_event)
+
+    response_data = {
+        'status': 'success',
+        'message': f'Device pickup detected from {device_id}',
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'timestamp': timestamp,
+        'sensor_used': sensor
+    }
+
+    return response_data, 200
+
+def process_gyro_event(data):
+    """Handle an ESP32 gyro threshold event (HTTP or WebSocket) and return (response, status)"""
+    event_type = data.get('event_type', 'unknown')
+    device_id = data.get('device_id', 'ESP32')
+    timestamp = data.get('timestamp', datetime.now().isoformat())
+    sensor = data.get('sensor', 'MPU6050')
+    gyro_x = data.get('gyro_x', 0.0)
+    gyro_y = data.get('gyro_y', 0.0)
+    gyro_z = data.get('gyro_z', 0.0)
+    threshold = data.get('threshold', 30.0)
+
+    log.info('ESP32 gyro event', extra={'sample': 'gyro', 'fields': {'device_id': device_id, 'gyro': [gyro_x, gyro_y, gyro_z], 'threshold': threshold}})
+
+    # Define audio message for gyro threshold detection
+    gyro_message = GYRO_MESSAGE
+
+    # Generate audio file name
+    audio_filename = 'gyro_threshold.mp3'
+    audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+
+    # Generate audio file if it doesn't exist
+    audio_cached = have_clip(audio_filename)
+    metrics.record_cache('notification_audio', audio_cached)
+    if not audio_cached:
+        log.info('Generating notification audio', extra={'fields': {'audio_key': 'gyro_threshold'}})
+        generated_path = generate_notification_audio(gyro_message, audio_filename)
+        if not generated_path:
+            return {'error': 'Failed to generate audio'}, 500
+
+    # Play the audio file
+    success = play_audio_file(audio_file_path)
+
+    # Store gyro event in history
+    gyro_event = {
+        'timestamp': timestamp,
+        'type': 'gyro_event',
+        'device_id': device_id,
+        'sensor': sensor,
+        'gyro_x': gyro_x,
+        'gyro_y': gyro_y,
+        'gyro_z': gyro_z,
+        'threshold': threshold,
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'message': gyro_message
+    }
+
+    conversation_history.append(gyro_event)
+
+    response_data = {
+        'status': 'success',
+        'message': f'Gyro threshold exceeded on {device_id}',
+        'audio_played': success,
+        'audio_message': gyro_message,
+        'timestamp': timestamp,
+        'sensor_used': sensor,
+        'gyro_values': {
+            'x': gyro_x,
+            'y': gyro_y,
+            'z': gyro_z
+        },
+        'threshold': threshold
+    }
+
+    return response_data, 200
+
+def process_placement_event(data):
+    """Handle an ESP32 placement event (HTTP or WebSocket) and return (response, status)"""
+    event_type = data.get('event_type', 'unknown')
+    device_id = data.get('device_id', 'ESP32')
+    timestamp = data.get('timestamp', datetime.now().isoformat())
+    sensor = data.get('sensor', 'MPU6050')
+    motor_started = data.get('motor_started', False)
+    stable_duration = data.get('stable_duration', 0)
+
+    log.info('ESP32 placement event', extra={'fields': {'device_id': device_id, 'motor_started': motor_started, 'stable_duration_ms': stable_duration}})
+
+    # Play audio file 4 when device is placed down
+    audio_filename = '4.mp3'
+    audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+
+    # Check if audio file 4 exists
+    audio_cached = have_clip(audio_filename)
+    metrics.record_cache('notification_audio', audio_cached)
+    if not audio_cached:
+        log.warning('Placement audio missing, using generated default', extra={'fields': {'file': audio_filename, 'audio_dir': AUDIO_DIR}})
+        # Create a default placement message if file doesn't exist
+        audio_filename = 'device_placement_default.mp3'
+        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
+        if not have_clip(audio_filename) and not generate_notification_audio(PLACEMENT_MESSAGE, audio_filename):
+            return {'error': 'Failed to generate audio'}, 500
+
+    # Play the audio file
+    success = play_audio_file(audio_file_path)
+
+    # Store placement event in history
+    placement_event = {
+        'timestamp': timestamp,
+        'type': 'placement_event',
+        'device_id': device_id,
+        'sensor': sensor,
+        'motor_started': motor_started,
+        'stable_duration': stable_duration,
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'message': f'Played audio file: {audio_filename}'
+    }
+
+    conversation_history.append(placement_event)
+
+    response_data = {
+        'status': 'success',
+        'message': f'Device placement detected from {device_id}',
+        'audio_played': success,
+        'audio_file': audio_filename,
+        'timestamp': timestamp,
+        'sensor_used': sensor,
+        'motor_started': motor_started,
+        'stable_duration': stable_duration
+    }
+
+    return response_data, 200
+
+def process_status_event(data):
+    """Handle an ESP32 status/command check (the WebSocket form of POST /esp32)"""
+    command = data.get('command', '')
+    if not command:
+        return {'error': 'No command provided'}, 400
+    return {'status': 'success', 'message': f'Command received: {command}'}, 200
+
+# Event processors shared by the HTTP routes and the WebSocket channel
+ESP32_EVENT_PROCESSORS = {
+    'button': process_button_event,
+    'pickup': process_pickup_event,
+    'gyro': process_gyro_event,
+    'placement': process_placement_event,
+    'status': process_status_event,
+}
+
+def run_esp32_event(event, data):
+    """Run an event processor, timing it as a stage of the esp32 pipeline"""
+    with metrics.stage('esp32', event):
+        return ESP32_EVENT_PROCESSORS[event](data)
+
+def read_esp32_event(event):
+    """Read an /esp32/* request body as JSON or the compact binary encoding, returning (data, binary)"""
+    if request.mimetype == esp32_codec.CONTENT_TYPE:
+        decoded_event, data = esp32_codec.decode_event(request.get_data())
+        if decoded_event != event:
+            raise esp32_codec.WireFormatError(f"Expected a '{event}' event, got '{decoded_event}'")
+        return data, True
+    return request.get_json(silent=True), False
+
+def esp32_response(event, data, response_data, status, binary):
+    """Answer binary events with a short binary ack and JSON events with the full JSON body"""
+    if binary:
+        ack = esp32_codec.encode_ack(event, data.get('seq', 0), status, response_data.get('audio_played', False))
+        return Response(ack, status=status, mimetype=esp32_codec.CONTENT_TYPE)
+    return jsonify(response_data), status
+
 # ESP32 button press endpoint
-@app.route('/esp32/button', methods=['POST'])
+@bp.route('/esp32/button', methods=['POST'])
 def esp32_button():
     try:
-        # Check if request has JSON data
-        if not request.json:
+        # Accept JSON or the binary encoding (Content-Type: application/x-thenga-event)
+        data, binary = read_esp32_event('button')
+        if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        button_id = request.json.get('button_id', 'default')
-        button_state = request.json.get('state', 'pressed')  # pressed, released, clicked
-        timestamp = request.json.get('timestamp', datetime.now().isoformat())
-        
-        print(f"ESP32 Button Event: ID={button_id}, State={button_state}, Time={timestamp}")
-        
-        # Define audio messages for different button actions
-        audio_messages = {
-            'button1_pressed': 'ബട്ടൺ ഒന്ന് അമർത്തി',  # Button 1 pressed
-            'button1_released': 'ബട്ടൺ ഒന്ന് വിട്ടു',    # Button 1 released
-            'button1_clicked': 'ബട്ടൺ ഒന്ന് ക്ലിക്ക് ചെയ്തു',  # Button 1 clicked
-            'button2_pressed': 'ബട്ടൺ രണ്ട് അമർത്തി',   # Button 2 pressed
-            'button2_released': 'ബട്ടൺ രണ്ട് വിട്ടു',     # Button 2 released
-            'button2_clicked': 'ബട്ടൺ രണ്ട് ക്ലിക്ക് ചെയ്തു',   # Button 2 clicked
-            'default_pressed': 'ബട്ടൺ അമർത്തി',         # Default button pressed
-            'default_released': 'ബട്ടൺ വിട്ടു',           # Default button released
-            'default_clicked': 'ബട്ടൺ ക്ലിക്ക് ചെയ്തു',    # Default button clicked
-        }
-        
-        # Generate audio key
-        audio_key = f"{button_id}_{button_state}"
-        if audio_key not in audio_messages:
-            audio_key = f"default_{button_state}"
-        
-        message = audio_messages.get(audio_key, 'ബട്ടൺ ഇവന്റ്')  # Button event
-        
-        # Generate audio file name
-        audio_filename = f"{audio_key}.mp3"
-        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        
-        # Generate audio file if it doesn't exist
-        if not os.path.exists(audio_file_path):
-            print(f"Generating new audio file for: {audio_key}")
-            generated_path = generate_notification_audio(message, audio_filename)
-            if not generated_path:
-                return jsonify({'error': 'Failed to generate audio'}), 500
-        
-        # Play the audio file
-        success = play_audio_file(audio_file_path)
-        
-        # Store button event in history
-        button_event = {
-            'timestamp': timestamp,
-            'type': 'button_event',
-            'button_id': button_id,
-            'state': button_state,
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'message': message
-        }
-        
-        conversation_history.append(button_event)
-        
-        response_data = {
-            'status': 'success',
-            'message': f'Button {button_id} {button_state} event processed',
-            'audio_played': success,
-            'audio_message': message,
-            'timestamp': timestamp
-        }
-        
-        # Add device control logic based on button
-        if button_id == 'button1':
-            if button_state == 'clicked':
-                # Button 1 clicked - toggle LED
-                response_data['device_action'] = 'LED toggled'
-                response_data['instructions'] = 'Turn LED on/off'
-        elif button_id == 'button2':
-            if button_state == 'clicked':
-                # Button 2 clicked - read sensors
-                response_data['device_action'] = 'Sensor reading requested'
-                response_data['instructions'] = 'Read temperature and humidity'
-        
-        return jsonify(response_data)
-        
+
+        response_data, status = run_esp32_event('button', data)
+        return esp32_response('button', data, response_data, status, binary)
+
+    except esp32_codec.WireFormatError as e:
+        return jsonify({'error': f'Invalid binary event: {e}'}), 400
     except Exception as e:
-        print(f"ESP32 button error: {e}")
+        log.exception('ESP32 button event failed')
         return jsonify({'error': str(e)}), 500
 
 # ESP32 endpoint example: receive command and respond
-@app.route('/esp32', methods=['POST'])
+@bp.route('/esp32', methods=['POST'])
 def esp32():
     try:
         # Check if request has JSON data
         audio_filename = '3.mp3'
         audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        
+
         success = play_audio_file(audio_file_path)
-        
-        if not request.json:
+
+        data, binary = read_esp32_event('status')
+        if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        command = request.json.get('command', '')
-        if not command:
-            return jsonify({'error': 'No command provided'}), 400
-        return jsonify({'status': 'success', 'message': f'Command received: {command}'})
+
+        response_data, status = run_esp32_event('status', data)
+        return esp32_response('status', data, response_data, status, binary)
+    except esp32_codec.WireFormatError as e:
+        return jsonify({'error': f'Invalid binary event: {e}'}), 400
     except Exception as e:
-        print(f"ESP32 error: {e}")
+        log.exception('ESP32 command failed')
         return jsonify({'error': str(e)}), 500
 # ESP32 pickup detection endpoint
-@app.route('/esp32/pickup', methods=['POST'])
+@bp.route('/esp32/pickup', methods=['POST'])
 def esp32_pickup():
     try:
-        # Check if request has JSON data
-        if not request.json:
+        # Accept JSON or the binary encoding (Content-Type: application/x-thenga-event)
+        data, binary = read_esp32_event('pickup')
+        if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        event_type = request.json.get('event_type', 'unknown')
-        device_id = request.json.get('device_id', 'ESP32')
-        timestamp = request.json.get('timestamp', datetime.now().isoformat())
-        sensor = request.json.get('sensor', 'MPU6050')
-        
-        print(f"ESP32 Pickup Event: Device={device_id}, Sensor={sensor}, Time={timestamp}")
-        # Play audio file 2 when device is picked up
-        audio_filename = '1.mp3'
-        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        success = play_audio_file(audio_file_path)
-        time.sleep(2)
-        audio_filename = '2.mp3'
-        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        success = play_audio_file(audio_file_path)
-        
-        # Store pickup event in history
-        pickup_event = {
-            'timestamp': timestamp,
-            'type': 'pickup_event',
-            'device_id': device_id,
-            'sensor': sensor,
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'message': f'Played audio file: {audio_filename}'
-        }
-        
-        conversation_history.append(pickup_event)
-        
-        response_data = {
-            'status': 'success',
-            'message': f'Device pickup detected from {device_id}',
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'timestamp': timestamp,
-            'sensor_used': sensor
-        }
-            
-        return jsonify(response_data)
-        
+
+        response_data, status = run_esp32_event('pickup', data)
+        return esp32_response('pickup', data, response_data, status, binary)
+
+    except esp32_codec.WireFormatError as e:
+        return jsonify({'error': f'Invalid binary event: {e}'}), 400
     except Exception as e:
-        print(f"ESP32 pickup error: {e}")
+        log.exception('ESP32 pickup event failed')
         return jsonify({'error': str(e)}), 500
 
 # ESP32 gyro threshold detection endpoint
-@app.route('/esp32/gyro', methods=['POST'])
+@bp.route('/esp32/gyro', methods=['POST'])
 def esp32_gyro():
     try:
-        # Check if request has JSON data
-        if not request.json:
+        # Accept JSON or the binary encoding (Content-Type: application/x-thenga-event)
+        data, binary = read_esp32_event('gyro')
+        if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        event_type = request.json.get('event_type', 'unknown')
-        device_id = request.json.get('device_id', 'ESP32')
-        timestamp = request.json.get('timestamp', datetime.now().isoformat())
-        sensor = request.json.get('sensor', 'MPU6050')
-        gyro_x = request.json.get('gyro_x', 0.0)
-        gyro_y = request.json.get('gyro_y', 0.0)
-        gyro_z = request.json.get('gyro_z', 0.0)
-        threshold = request.json.get('threshold', 30.0)
-        
-        print(f"ESP32 Gyro Event: Device={device_id}, Gyro=({gyro_x:.2f}, {gyro_y:.2f}, {gyro_z:.2f}), Threshold={threshold}")
-        
-        # Define audio message for gyro threshold detection
-        gyro_message = 'ഗൈറോസ്കോപ്പ് പരിധി കവിഞ്ഞു'  # Gyroscope threshold exceeded in Malayalam
-        
-        # Generate audio file name
-        audio_filename = 'gyro_threshold.mp3'
-        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        
-        # Generate audio file if it doesn't exist
-        if not os.path.exists(audio_file_path):
-            print(f"Generating gyro threshold notification audio...")
-            generated_path = generate_notification_audio(gyro_message, audio_filename)
-            if not generated_path:
-                return jsonify({'error': 'Failed to generate audio'}), 500
-        
-        # Play the audio file
-        success = play_audio_file(audio_file_path)
-        
-        # Store gyro event in history
-        gyro_event = {
-            'timestamp': timestamp,
-            'type': 'gyro_event',
-            'device_id': device_id,
-            'sensor': sensor,
-            'gyro_x': gyro_x,
-            'gyro_y': gyro_y,
-            'gyro_z': gyro_z,
-            'threshold': threshold,
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'message': gyro_message
-        }
-        
-        conversation_history.append(gyro_event)
-        
-        response_data = {
-            'status': 'success',
-            'message': f'Gyro threshold exceeded on {device_id}',
-            'audio_played': success,
-            'audio_message': gyro_message,
-            'timestamp': timestamp,
-            'sensor_used': sensor,
-            'gyro_values': {
-                'x': gyro_x,
-                'y': gyro_y,
-                'z': gyro_z
-            },
-            'threshold': threshold
-        }
-        
-        return jsonify(response_data)
-        
+
+        response_data, status = run_esp32_event('gyro', data)
+        return esp32_response('gyro', data, response_data, status, binary)
+
+    except esp32_codec.WireFormatError as e:
+        return jsonify({'error': f'Invalid binary event: {e}'}), 400
     except Exception as e:
-        print(f"ESP32 gyro error: {e}")
+        log.exception('ESP32 gyro event failed')
         return jsonify({'error': str(e)}), 500
 
 # ESP32 device placement detection endpoint
-@app.route('/esp32/placement', methods=['POST'])
+@bp.route('/esp32/placement', methods=['POST'])
 def esp32_placement():
     try:
-        # Check if request has JSON data
-        if not request.json:
+        # Accept JSON or the binary encoding (Content-Type: application/x-thenga-event)
+        data, binary = read_esp32_event('placement')
+        if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        event_type = request.json.get('event_type', 'unknown')
-        device_id = request.json.get('device_id', 'ESP32')
-        timestamp = request.json.get('timestamp', datetime.now().isoformat())
-        sensor = request.json.get('sensor', 'MPU6050')
-        motor_started = request.json.get('motor_started', False)
-        stable_duration = request.json.get('stable_duration', 0)
-        
-        print(f"ESP32 Placement Event: Device={device_id}, Motor Started={motor_started}, Stable Duration={stable_duration}ms")
-        
-        # Play audio file 4 when device is placed down
-        audio_filename = '4.mp3'
-        audio_file_path = os.path.join(AUDIO_DIR, audio_filename)
-        
-        # Check if audio file 4 exists
-        if not os.path.exists(audio_file_path):
-            print(f"Audio file {audio_filename} not found in {AUDIO_DIR}")
-            # Create a default placement message if file doesn't exist
-            placement_message = 'ഉപകരണം താഴെ വെച്ചു, മോട്ടർ ആരംഭിച്ചു'  # Device placed down, motor started in Malayalam
-            generated_path = generate_notification_audio(placement_message, 'device_placement_default.mp3')
-            if generated_path:
-                audio_file_path = generated_path
-                audio_filename = 'device_placement_default.mp3'
+
+        response_data, status = run_esp32_event('placement', data)
+        return esp32_response('placement', data, response_data, status, binary)
+
+    except esp32_codec.WireFormatError as e:
+        return jsonify({'error': f'Invalid binary event: {e}'}), 400
+    except Exception as e:
+        log.exception('ESP32 placement event failed')
+        return jsonify({'error': str(e)}), 500
+
+# Persistent WebSocket channel for ESP32 devices.
+# Devices send {"t": "hello", "device_id": ...} first, then event frames
+# ({"t": "pickup" | "placement" | "gyro" | "button" | "status", "seq": N, ...})
+# which are acknowledged with {"t": "ack", "seq": N, ...}. The server pushes
+# {"t": "cmd", ...} commands and {"t": "ping", "ts": ...} latency probes.
+# Binary frames carry esp32_codec events and are answered with a binary ack.
+@sock.route('/esp32/ws', bp=bp)
+def esp32_ws_channel(ws):
+    connection = None
+    try:
+        try:
+            frame_type, fields = esp32_ws.decode_frame(ws.receive(timeout=esp32_ws.PING_INTERVAL * 2))
+        except ValueError as e:
+            ws.send(esp32_ws.encode_frame('error', error=f'Invalid frame: {e}'))
+            return
+        if frame_type != 'hello':
+            ws.send(esp32_ws.encode_frame('error', error="First frame must be 'hello'"))
+            return
+
+        connection = esp32_ws.DeviceConnection(fields.get('device_id', 'ESP32'), ws)
+        esp32_ws.registry.register(connection)
+        log.info('ESP32 WebSocket connected', extra={'fields': {'device_id': connection.device_id}})
+        connection.send('welcome', ping_interval=esp32_ws.PING_INTERVAL)
+        connection.ping()
+
+        while True:
+            raw = ws.receive(timeout=1)
+            if raw is None:
+                if connection.ping_due():
+                    connection.ping()
+                continue
+
+            connection.frames_in += 1
+
+            # Binary frames use the same fixed layout as the binary HTTP bodies
+            if isinstance(raw, bytes):
+                # Any decode failure is the device's fault: report it and wait for the next frame
+                try:
+                    event, fields = esp32_codec.decode_event(raw)
+                except Exception as e:
+                    connection.send('error', error=f'Invalid binary event: {e}')
+                    continue
+                try:
+                    response_data, status = run_esp32_event(event, fields)
+                except Exception as e:
+                    log.exception('ESP32 WebSocket binary event failed')
+                    response_data, status = {'error': str(e)}, 500
+                connection.send_bytes(esp32_codec.encode_ack(event, fields.get('seq', 0), status,
+                                                             response_data.get('audio_played', False)))
+                continue
+
+            # A malformed frame is answered with an error; the connection stays open
+            try:
+                frame_type, fields = esp32_ws.decode_frame(raw)
+            except ValueError as e:
+                connection.send('error', error=f'Invalid frame: {e}')
+                continue
+            seq = fields.pop('seq', None)
+
+            if frame_type == 'pong':
+                connection.record_pong(fields.get('ts', 0))
+            elif frame_type == 'cmd_ack':
+                log.info('ESP32 command completed', extra={'fields': {'device_id': connection.device_id, 'command_id': fields.get('id'), 'result': fields.get('result', 'ok')}})
+            elif frame_type in ESP32_EVENT_PROCESSORS:
+                fields.setdefault('device_id', connection.device_id)
+                try:
+                    response_data, status = run_esp32_event(frame_type, fields)
+                except Exception as e:
+                    log.exception('ESP32 WebSocket event failed', extra={'fields': {'frame_type': frame_type}})
+                    response_data, status = {'error': str(e)}, 500
+                # Only the fields the firmware acts on travel back down
+                connection.send('ack', seq=seq, code=status,
+                                audio_played=response_data.get('audio_played', False),
+                                error=response_data.get('error'))
             else:
-                return jsonify({'error': 'Failed to generate audio'}), 500
-        
-        # Play the audio file
-        success = play_audio_file(audio_file_path)
-        
-        # Store placement event in history
-        placement_event = {
-            'timestamp': timestamp,
-            'type': 'placement_event',
+                connection.send('error', seq=seq, error=f"Unknown frame type '{frame_type}'")
+
+            if connection.ping_due():
+                connection.ping()
+
+    except ConnectionClosed:
+        pass
+    except Exception:
+        log.exception('ESP32 WebSocket error')
+    finally:
+        if connection is not None:
+            esp32_ws.registry.unregister(connection)
+            log.info('ESP32 WebSocket disconnected', extra={'fields': {'device_id': connection.device_id}})
+
+# Push a command (motor start/stop, threshold change, LED) to a connected device
+@bp.route('/esp32/command', methods=['POST'])
+def esp32_command():
+    try:
+        if not request.json:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        device_id = request.json.get('device_id', 'ESP32_MPU6050')
+        command = request.json.get('command', '')
+        params = request.json.get('params', {})
+        if not isinstance(params, dict):
+            return jsonify({'error': 'params must be a JSON object'}), 400
+
+        error = esp32_ws.validate_command(command, params)
+        if error:
+            return jsonify({'error': error}), 400
+
+        command_id = esp32_ws.registry.send_command(device_id, command, params)
+        if command_id is None:
+            return jsonify({
+                'error': f'Device {device_id} is not connected over WebSocket',
+                'connected_devices': esp32_ws.registry.connected_ids()
+            }), 404
+
+        return jsonify({
+            'status': 'sent',
             'device_id': device_id,
-            'sensor': sensor,
-            'motor_started': motor_started,
-            'stable_duration': stable_duration,
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'message': f'Played audio file: {audio_filename}'
-        }
-        
-        conversation_history.append(placement_event)
-        
-        response_data = {
-            'status': 'success',
-            'message': f'Device placement detected from {device_id}',
-            'audio_played': success,
-            'audio_file': audio_filename,
-            'timestamp': timestamp,
-            'sensor_used': sensor,
-            'motor_started': motor_started,
-            'stable_duration': stable_duration
-        }
-        
-        return jsonify(response_data)
-        
+            'command': command,
+            'command_id': command_id
+        })
     except Exception as e:
-        print(f"ESP32 placement error: {e}")
+        log.exception('ESP32 command push failed')
         return jsonify({'error': str(e)}), 500
 
-# Initialize pygame mixer for audio playback
-try:
-    pygame.mixer.init()
-    AUDIO_ENABLED = True
-    print("✓ Audio playback initialized successfully!")
-except Exception as e:
-    AUDIO_ENABLED = False
-    print(f"✗ Audio playback initialization failed: {e}")
-
-# Audio files directory
-AUDIO_DIR = os.path.join(os.path.dirname(__file__), 'audio_files')
-if not os.path.exists(AUDIO_DIR):
-    os.makedirs(AUDIO_DIR)
-    print(f"Created audio directory: {AUDIO_DIR}")
+# List WebSocket-connected devices with per-connection latency
+@bp.route('/esp32/devices', methods=['GET'])
+def esp32_devices():
+    devices = esp32_ws.registry.snapshot()
+    return jsonify({'devices': devices, 'total_devices': len(devices)})
+
+# Audio playback: pygame is imported and the mixer initialized on first use,
+# or in the background by create_app(); headless mode never imports it
+AUDIO_ENABLED = False
+audio_ready = threading.Event()
+audio_init_lock = threading.Lock()
+
+def init_audio():
+    """Initialize the pygame mixer once and return whether playback is available"""
+    global AUDIO_ENABLED
+    with audio_init_lock:
+        if audio_ready.is_set():
+            return AUDIO_ENABLED
+        if HEADLESS:
+            log.info('Headless mode: audio playback disabled')
+        else:
+            started = time.perf_counter()
+            try:
+                import pygame
+                pygame.mixer.init()
+                AUDIO_ENABLED = True
+                log.info('Audio playback initialized', extra={'fields': {'init_ms': round((time.perf_counter() - started) * 1000, 1)}})
+            except Exception as e:
+                log.warning('Audio playback initialization failed', extra={'fields': {'error': str(e)}})
+        audio_ready.set()
+        return AUDIO_ENABLED
+
+# pygame.mixer.music is a single global player; concurrent load/play calls crash SDL
+playback_lock = threading.Lock()
 
 def play_audio_file(file_path):
     """Play an audio file using pygame"""
     try:
-        if not AUDIO_ENABLED:
-            print("Audio playback not available")
+        if not init_audio():
+            log.debug('Audio playback not available')
             return False
             
-        if not os.path.exists(file_path):
-            print(f"Audio file not found: {file_path}")
+        # Clips in the audio directory are looked up in the clip archive and the directory
+        # index, not on disk; archived clips play straight from the mapped archive
+        directory, name = os.path.split(file_path)
+        clip = archived_clip(name) if directory == AUDIO_DIR else None
+        if clip is None and not (audio_files.get(name) is not None if directory == AUDIO_DIR else os.path.exists(file_path)):
+            log.warning('Audio file not found', extra={'fields': {'file': file_path}})
             return False
             
-        print(f"Playing audio file: {file_path}")
+        log.debug('Playing audio file', extra={'fields': {'file': file_path}})
         
         # Play audio in a separate thread to avoid blocking
         def play_in_thread():
+            import pygame
             try:
-                pygame.mixer.music.load(file_path)
-                pygame.mixer.music.play()
-                
-                # Wait for playback to complete
-                while pygame.mixer.music.get_busy():
-                    pygame.time.wait(100)
-                print("Audio playback completed")
-            except Exception as e:
-                print(f"Error during audio playback: {e}")
+                # Clips queue up and play one after another
+                with playback_lock:
+                    if clip is not None:
+                        pygame.mixer.music.load(clip_archive.ClipReader(clip_store.data(clip, 'play')),
+                                                os.path.splitext(name)[1].lstrip('.'))
+                    else:
+                        pygame.mixer.music.load(file_path)
+                    pygame.mixer.music.play()
+                    
+                    # Wait for playback to complete
+                    while pygame.mixer.music.get_busy():
+                        pygame.time.wait(100)
+                log.debug('Audio playback completed')
+            except Exception:
+                log.exception('Audio playback failed')
+            finally:
+                metrics.AUDIO_PLAYBACK_ACTIVE.dec()
                 
+        metrics.AUDIO_PLAYBACK_ACTIVE.inc()
         threading.Thread(target=play_in_thread, daemon=True).start()
         return True
         
-    except Exception as e:
-        print(f"Error playing audio file: {e}")
+    except Exception:
+        log.exception('Could not start audio playback')
         return False
 
 def generate_notification_audio(message, filename):
@@ -709,43 +1857,62 @@ def generate_notification_audio(message, filename):
         # Use edge-tts to generate audio
         async def generate_audio():
             voice = "ml-IN-MidhunNeural"  # Male Malayalam voice
-            communicate = edge_tts.Communicate(message, voice)
-            await communicate.save(file_path)
+            await upstream.edge_tts_save(message, voice, file_path)
         
-        asyncio.run(generate_audio())
-        print(f"Generated notification audio: {file_path}")
+        try:
+            with metrics.stage('tts', 'notification'):
+                asyncio.run(generate_audio())
+        except Exception as e:
+            metrics.record_upstream('edge_tts', 'error', type(e).__name__)
+            raise
+        metrics.record_upstream('edge_tts', 'ok')
+        audio_files.refresh(filename)
+        log.info('Generated notification audio', extra={'fields': {'file': file_path}})
         return file_path
         
     except Exception as e:
-        print(f"Error generating notification audio: {e}")
+        log.warning('Notification audio generation failed', extra={'fields': {'error': str(e)}})
         return None
 
 # Add endpoint to list available audio files
-@app.route('/audio/list', methods=['GET'])
+@bp.route('/audio/list', methods=['GET'])
 def list_audio_files():
     try:
-        audio_files = []
-        if os.path.exists(AUDIO_DIR):
-            for file in os.listdir(AUDIO_DIR):
-                if file.endswith(('.mp3', '.wav')):
-                    file_path = os.path.join(AUDIO_DIR, file)
-                    file_info = {
-                        'filename': file,
-                        'size': os.path.getsize(file_path),
-                        'created': datetime.fromtimestamp(os.path.getctime(file_path)).isoformat()
-                    }
-                    audio_files.append(file_info)
+        listed = []
+        for entry in audio_files.files():
+            file_info = {
+                'filename': entry.name,
+                'size': entry.size,
+                'created': datetime.fromtimestamp(entry.ctime).isoformat(),
+                'duration': entry.duration,
+                'hash': entry.hash,
+                'url': audio_file_url(entry.name, entry.hash),
+                'archived': archived_clip(entry.name) is not None
+            }
+            listed.append(file_info)
+        # Clips that are only in the archive
+        for clip in clip_store.clips():
+            if audio_files.get(clip.name) is None:
+                listed.append({
+                    'filename': clip.name,
+                    'size': clip.length,
+                    'created': datetime.fromtimestamp(clip_store.created).isoformat(),
+                    'duration': clip.duration,
+                    'hash': clip.hash,
+                    'url': audio_file_url(clip.name, clip.hash),
+                    'archived': True
+                })
         
         return jsonify({
-            'audio_files': audio_files,
+            'audio_files': listed,
             'audio_directory': AUDIO_DIR,
-            'total_files': len(audio_files)
+            'total_files': len(listed)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Add endpoint to play specific audio file
-@app.route('/audio/play/<filename>', methods=['POST'])
+@bp.route('/audio/play/<filename>', methods=['POST'])
 def play_specific_audio(filename):
     try:
         file_path = os.path.join(AUDIO_DIR, filename)
@@ -760,21 +1927,174 @@ def play_specific_audio(filename):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Versioned audio URLs never change content, so clients may keep them this long
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def audio_file_url(filename, version):
+    return f"/audio/files/{urllib.parse.quote(filename)}?v={version}"
+
+# Download an audio file as MP3 or Opus (Accept header, or ?format=opus&bitrate=24);
+# each transcoded variant is made once and kept next to the file. Strong ETags answer
+# If-None-Match with 304 and Range with 206; with ?v=<content hash> (the URLs in
+# /audio/list) the response is cacheable for a year, since new content gets a new URL.
+@bp.route('/audio/files/<filename>', methods=['GET'])
+def get_audio_file(filename):
+    try:
+        entry = audio_files.get(filename)
+        clip = archived_clip(filename)
+        if entry is None and clip is None:
+            return jsonify({'error': 'Audio file not found'}), 404
+        try:
+            audio_format, bitrate = transcoder.negotiate(request.accept_mimetypes, request.args.get('format'),
+                                                         request.args.get('bitrate'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if clip is not None and (entry is None or not transcoder.converts(entry.path, audio_format, bitrate)):
+            # Packed clips go out as a slice of the mapped archive, in their own format
+            version = clip.hash
+            audio_format = transcode.SOURCE_FORMATS.get(os.path.splitext(filename)[1].lower())
+            view = clip_store.data(clip)
+            response = Response([view], mimetype=mimetypes.guess_type(filename)[0], direct_passthrough=True)
+            response.content_length = len(view)
+            response.set_etag(version)
+            response.make_conditional(request, accept_ranges=True, complete_length=len(view))
+        else:
+            version = entry.hash
+            path, audio_format = transcoder.variant(entry.path, audio_format, bitrate)
+            etag = version if path == entry.path else f'{version}-{audio_format}{bitrate or ""}'
+            # The WSGI server's file wrapper (sendfile under gunicorn) sends the file
+            response = send_file(path, etag=etag, conditional=True)
+        if request.args.get('v') == version:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        response.headers['Vary'] = 'Accept'
+        metrics.record_cache('audio_revalidation', response.status_code == 304)
+        if response.status_code != 304:
+            transcoder.count('files', audio_format, response.content_length or 0)
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Audio directory index: clip count, bytes, seconds, how changes are detected and rebuilds
+@bp.route('/audio/index', methods=['GET'])
+def audio_index_report():
+    return jsonify(audio_files.snapshot())
+
+# Clip archive: where it is, how many clips and bytes it maps, and clips played/sent from it
+@bp.route('/audio/archive', methods=['GET'])
+def audio_archive_report():
+    return jsonify(clip_store.snapshot())
+
+# Audio formats on offer and bytes served per route and format
+@bp.route('/audio/formats', methods=['GET'])
+def audio_formats_report():
+    return jsonify(transcoder.snapshot())
+
+# Request-level latency and in-flight tracking for /metrics
+@bp.before_app_request
+def start_request_metrics():
+    # Label by view name, without the blueprint prefix
+    g.metrics_endpoint = (request.endpoint or 'unknown').rpartition('.')[2]
+    g.metrics_start = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@bp.after_app_request
+def record_request_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@bp.teardown_app_request
+def finish_request_metrics(error=None):
+    if 'metrics_start' not in g:
+        return
+    metrics.REQUESTS_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+    status = g.get('metrics_status', 500)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint=g.metrics_endpoint, status=status)
+
+# Upstream health: circuit breaker states, Gemini quota use and the learned TTS hedge delay
+@bp.route('/upstreams', methods=['GET'])
+def get_upstreams():
+    return jsonify({
+        'circuits': breaker.snapshot(),
+        'gemini_quota': gemini_quota.snapshot(),
+        'in_flight': {'gemini': gemini_flight.in_flight(), 'translate': translate_flight.in_flight()},
+        'tts_hedge': {
+            'delay_s': round(tts_hedge_delay(), 3),
+            'percentile': TTS_HEDGE_PERCENTILE,
+            'samples': len(edge_first_audio)
+        }
+    })
+
+# Sentence audio cache: size and the fraction of /tts audio seconds it served
+@bp.route('/tts/cache', methods=['GET'])
+def tts_cache_report():
+    return jsonify(sentence_audio.snapshot())
+
+# Prometheus metrics: per-stage latency, upstream errors, cache hits, queue depth
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render_all(), content_type=metrics.CONTENT_TYPE)
+
 # Get conversation history
-@app.route('/history', methods=['GET'])
+@bp.route('/history', methods=['GET'])
 def get_history():
     return jsonify({'history': conversation_history})
 
 # Clear conversation history
-@app.route('/clear_history', methods=['POST'])
+@bp.route('/clear_history', methods=['POST'])
 def clear_history():
     global conversation_history
     conversation_history = []
+    memory.clear()
     return jsonify({'message': 'History cleared'})
 
+def warm_up_subsystems():
+    """Load the audio and TTS stacks and index the audio directory off the request path so the
+    first request doesn't pay for them"""
+    started = time.perf_counter()
+    init_audio()
+    upstream.warm_up()
+    audio_files.files()
+    log.info('Subsystems warmed up', extra={'fields': {'warm_up_ms': round((time.perf_counter() - started) * 1000, 1), 'audio': AUDIO_ENABLED, 'headless': HEADLESS}})
+
+def create_app(headless=None, warm_up=True):
+    """Build the Flask app: load .env and settings, then warm up audio/TTS in the background"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    logs.setup_logging()
+    load_config(headless)
+
+    if not os.path.exists(AUDIO_DIR):
+        os.makedirs(AUDIO_DIR)
+        log.info('Created audio directory', extra={'fields': {'audio_dir': AUDIO_DIR}})
+    if CLIP_ARCHIVE:
+        try:
+            clips = clip_store.open(CLIP_ARCHIVE)
+            log.info('Mapped clip archive', extra={'fields': {'archive': CLIP_ARCHIVE, 'clips': clips}})
+        except (OSError, ValueError) as e:
+            log.warning('Clip archive not loaded, using loose audio files', extra={'fields': {'archive': CLIP_ARCHIVE, 'error': str(e)}})
+
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    sock.init_app(app)
+
+    if warm_up:
+        threading.Thread(target=warm_up_subsystems, name='thenga-warm-up', daemon=True).start()
+    return app
+
 if __name__ == '__main__':
+    from werkzeug.serving import is_running_from_reloader
     print("Starting ESP32 Chatbot Server with Speech Recognition and Translation Workflow...")
-    print("Server will be available at: http://localhost:5000")
+    host = os.getenv('THENGA_HOST', '0.0.0.0')
+    port = int(os.getenv('THENGA_PORT', '5000'))
+    debug = os.getenv('THENGA_DEBUG', '1').lower() in ('1', 'true', 'yes')
+    # With the debug reloader only the child process serves requests, so only it warms up
+    app = create_app(warm_up=not debug or is_running_from_reloader())
+    print(f"Server will be available at: http://localhost:{port}")
     print(f"Using Gemini API URL: {GEMINI_API_URL}")
     
     # Test enhanced language detection
@@ -817,7 +2137,7 @@ if __name__ == '__main__':
     print("🔊 ESP32 button press audio notifications: ✓")
     print("🎵 Automatic audio file generation: ✓")
     print("📂 Audio files stored in:", AUDIO_DIR)
-    print("🎮 Pygame audio playback system: ✓" if AUDIO_ENABLED else "✗")
+    print("🎮 Pygame audio playback system: ✗ (headless mode)" if HEADLESS else "🎮 Pygame audio playback system: initializing in background")
     print("\n🔘 Button Events Supported:")
     print("   • Button press/release/click detection")
     print("   • Automatic Malayalam audio notifications")
@@ -828,7 +2148,11 @@ if __name__ == '__main__':
     print("   • POST to /esp32/pickup for pickup events (plays 1.mp3)")
     print("   • POST to /esp32/gyro for gyro threshold events")
     print("   • POST to /esp32/placement for device placement events (plays 4.mp3)")
+    print("   • WebSocket /esp32/ws for a persistent event/command channel")
+    print("   • POST /esp32/command to push motor/threshold/LED commands")
+    print("   • GET /esp32/devices for connected devices and latency")
     print("   • GET /audio/list to see audio files")
+    print("   • GET /metrics for Prometheus latency/error/cache metrics")
     print("   • POST /audio/play/<filename> to play specific audio")
     print("   • Configurable motion threshold")
     print("   • Configurable gyro threshold (default: 40 deg/s)")
@@ -839,4 +2163,4 @@ if __name__ == '__main__':
     print("   • Place 1.mp3 and 4.mp3 in the audio_files folder for custom sounds")
     
     # Start the Flask server
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,386 @@
+# In-process metrics exported in Prometheus text format at /metrics.
+# Every metric keeps a private shard per thread, so recording a sample is a
+# dict update with no lock; shards are only merged when /metrics is scraped.
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from fast local stages up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fold shards of finished threads once this many are registered
+MAX_LIVE_SHARDS = 64
+
+_registry = []
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    """Base class: named metric with label names and per-thread value shards"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []           # (thread, values) for threads that recorded samples
+        self._retired = {}          # merged values of threads that have exited
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _values(self):
+        """This thread's shard; the lock is only taken the first time a thread records"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+                if len(self._shards) > MAX_LIVE_SHARDS:
+                    self._fold_dead_shards()
+            self._local.values = values
+            return values
+
+    def _fold_dead_shards(self):
+        live = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                for key, value in values.items():
+                    self._merge(self._retired, key, value)
+        self._shards = live
+
+    def _merge(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def collect(self):
+        """Merge every shard into {label values: value}"""
+        with self._lock:
+            self._fold_dead_shards()
+            merged = {}
+            for key, value in self._retired.items():
+                self._merge(merged, key, value)
+            shards = [values.copy() for _, values in self._shards]
+        for values in shards:
+            for key, value in values.items():
+                self._merge(merged, key, value)
+        return merged
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self._values()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge built from inc/dec deltas, e.g. requests in flight"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        values = self._values()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose value is computed by a function at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def collect(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            return {key if isinstance(key, tuple) else (key,): v for key, v in value.items()}
+        return {(): value}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = self._values()
+        key = self._key(labels)
+        state = values.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then +Inf count, sum and total count
+            state = values[key] = [0] * (len(self.buckets) + 3)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        else:
+            state[len(self.buckets)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def _merge(self, target, key, value):
+        existing = target.get(key)
+        if existing is None:
+            target[key] = list(value)
+        else:
+            for index, item in enumerate(value):
+                existing[index] += item
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(float(state[-2]))}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+def render_all():
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Pipeline metrics
+
+STAGE_SECONDS = Histogram(
+    'thenga_stage_duration_seconds',
+    'Latency of each pipeline stage (chat: detect/translate_in/context/gemini/translate_out/summarize, tts: engines, esp32: events)',
+    ['pipeline', 'stage']
+)
+
+REQUEST_SECONDS = Histogram(
+    'thenga_request_duration_seconds',
+    'End-to-end latency of HTTP requests by endpoint and status',
+    ['endpoint', 'status']
+)
+
+REQUESTS_IN_FLIGHT = Gauge(
+    'thenga_requests_in_flight',
+    'HTTP requests currently being handled',
+    ['endpoint']
+)
+
+UPSTREAM_REQUESTS = Counter(
+    'thenga_upstream_requests_total',
+    'Calls made to upstream services by outcome',
+    ['upstream', 'outcome']
+)
+
+UPSTREAM_ERRORS = Counter(
+    'thenga_upstream_errors_total',
+    'Failed upstream calls by reason (HTTP status or exception type)',
+    ['upstream', 'reason']
+)
+
+CACHE_LOOKUPS = Counter(
+    'thenga_cache_lookups_total',
+    'Cache lookups by cache and result (hit/miss)',
+    ['cache', 'result']
+)
+
+CHAT_SECONDS = Histogram(
+    'thenga_chat_duration_seconds',
+    'End-to-end latency of successful /chat turns by pipeline (translate/direct)',
+    ['pipeline']
+)
+
+DEGRADATIONS = Counter(
+    'thenga_degradations_total',
+    'Requests answered degraded to meet their deadline (untranslated_input/reply, cached_answer, skipped_tts)',
+    ['endpoint', 'degradation']
+)
+
+CIRCUIT_OPEN = Gauge(
+    'thenga_circuit_open',
+    'Upstreams whose circuit breaker is open or half-open (1) rather than closed',
+    ['upstream']
+)
+
+CIRCUIT_REJECTIONS = Counter(
+    'thenga_circuit_rejections_total',
+    'Upstream calls failed fast because the circuit breaker was open',
+    ['upstream']
+)
+
+TTS_HEDGES = Counter(
+    'thenga_tts_hedges_total',
+    'TTS requests where gTTS was started alongside a slow edge-tts, by the engine that answered',
+    ['winner']
+)
+
+COALESCED_CALLS = Counter(
+    'thenga_upstream_calls_coalesced_total',
+    'Upstream calls saved because an identical call was already in flight',
+    ['upstream']
+)
+
+GEMINI_ADMISSIONS = Counter(
+    'thenga_gemini_admissions_total',
+    'Gemini calls by priority and how the quota scheduler admitted them (immediate/queued/rejected)',
+    ['priority', 'outcome']
+)
+
+GEMINI_QUEUE_SECONDS = Histogram(
+    'thenga_gemini_queue_wait_seconds',
+    'Time admitted Gemini calls waited for quota',
+    ['priority']
+)
+
+GEMINI_QUEUE_DEPTH = Gauge(
+    'thenga_gemini_queue_depth',
+    'Gemini calls waiting for quota',
+    ['priority']
+)
+
+GEMINI_TOKENS = Histogram(
+    'thenga_gemini_tokens',
+    'Tokens per /chat Gemini call (prompt: reported by Gemini, else estimated)',
+    ['kind'],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192)
+)
+
+SPECULATIONS = Counter(
+    'thenga_chat_speculations_total',
+    'Speculative /chat work from interim transcripts by outcome (started/superseded/hit/miss/unusable)',
+    ['outcome']
+)
+
+ANSWER_MATCH_SCORE = Histogram(
+    'thenga_answer_match_score',
+    'Similarity of the closest cached message on /chat answer cache lookups (reuse or fallback)',
+    ['use'],
+    buckets=(0.3, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0)
+)
+
+SPEECH_CHARS_SAVED = Counter(
+    'thenga_speech_chars_saved_total',
+    'Characters of /chat replies not sent to a hop (translate/tts) after markup removal and the spoken-length cap (net of units written out; never negative per turn)',
+    ['hop']
+)
+
+TTS_AUDIO_SECONDS = Counter(
+    'thenga_tts_audio_seconds_total',
+    'Seconds of /tts audio served, by source (cache = sentence audio cache, synthesized = edge-tts/gTTS)',
+    ['source']
+)
+
+AUDIO_BYTES_SERVED = Counter(
+    'thenga_audio_bytes_served_total',
+    'Bytes of audio sent to HTTP clients, by route and negotiated format (mp3, opus)',
+    ['route', 'format']
+)
+
+AUDIO_PLAYBACK_ACTIVE = Gauge(
+    'thenga_audio_playback_queue_depth',
+    'Audio clips queued or playing on the server speaker'
+)
+
+
+def _cache_hit_ratios():
+    totals = {}
+    for (cache, result), count in CACHE_LOOKUPS.collect().items():
+        hits, lookups = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (count if result == 'hit' else 0), lookups + count)
+    return {(cache,): hits / lookups for cache, (hits, lookups) in totals.items() if lookups}
+
+
+CACHE_HIT_RATIO = CallbackGauge(
+    'thenga_cache_hit_ratio',
+    'Fraction of cache lookups that were hits since startup',
+    _cache_hit_ratios,
+    ['cache']
+)
+
+
+def _tts_cached_ratio():
+    seconds = {source: value for (source,), value in TTS_AUDIO_SECONDS.collect().items()}
+    total = sum(seconds.values())
+    return seconds.get('cache', 0) / total if total else 0.0
+
+
+TTS_CACHED_RATIO = CallbackGauge(
+    'thenga_tts_audio_cached_ratio',
+    'Fraction of /tts audio seconds served from the sentence audio cache since startup',
+    _tts_cached_ratio
+)
+
+
+@contextmanager
+def stage(pipeline, name):
+    """Time one pipeline stage into thenga_stage_duration_seconds"""
+    with STAGE_SECONDS.time(pipeline=pipeline, stage=name):
+        yield
+
+
+def record_upstream(upstream, outcome, reason=None):
+    """Count an upstream call; outcome is 'ok' or 'error' (with a reason)"""
+    UPSTREAM_REQUESTS.inc(upstream=upstream, outcome=outcome)
+    if outcome != 'ok':
+        UPSTREAM_ERRORS.inc(upstream=upstream, reason=reason or 'unknown')
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
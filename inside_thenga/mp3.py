@@ -0,0 +1,79 @@
+# MPEG audio frame parsing, just enough to join MP3 clips and time them.
+# Clips from edge-tts and gTTS are concatenated frame by frame: ID3 tags and
+# Xing/Info header frames are dropped, since a decoder would read the first
+# clip's tag or frame count as describing the whole stream.
+
+# Bitrates in kbps by (MPEG-1?, layer)
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _header(data, pos):
+    """(frame length, samples, sample rate) of the frame header at pos, or None if there is none"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def _skip_id3(data):
+    """Offset of the first byte after a leading ID3v2 tag"""
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def frames(data):
+    """Yield (start, end, samples, sample_rate) for each audio frame, skipping tags and junk"""
+    pos = _skip_id3(data)
+    end = len(data) - 128 if data[-128:-125] == b'TAG' else len(data)
+    first = True
+    while pos < end:
+        header = _header(data, pos)
+        if header is None or pos + header[0] > end:
+            # Not a frame: resynchronize on the next frame sync
+            pos = data.find(b'\xff', pos + 1, end)
+            if pos < 0:
+                return
+            continue
+        length, samples, sample_rate = header
+        # A Xing/Info frame carries the clip's frame count, not audio
+        if not (first and (b'Xing' in data[pos + 4:pos + 40] or b'Info' in data[pos + 4:pos + 40])):
+            yield pos, pos + length, samples, sample_rate
+        first = False
+        pos += length
+
+
+def audio_frames(data):
+    """The MP3's audio frames only, ready to be joined with other clips"""
+    return b''.join(data[start:end] for start, end, _, _ in frames(data))
+
+
+def concat(clips):
+    return b''.join(audio_frames(clip) for clip in clips)
+
+
+def duration(data):
+    """Playing time in seconds"""
+    return sum(samples / sample_rate for _, _, samples, sample_rate in frames(data))
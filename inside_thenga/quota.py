@@ -0,0 +1,152 @@
+# Admission control for Gemini calls against the API's per-minute quotas.
+# Every call reserves one request and an estimate of its tokens in a sliding
+# 60 s window; calls that do not fit wait in a bounded priority queue
+# (interactive chat ahead of background work such as summaries), and calls
+# that could not be admitted within their wait limit fail immediately with a
+# Retry-After instead of spending an upstream call that would come back 429.
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+import metrics
+
+WINDOW_SECONDS = 60.0
+
+# Gemini 1.5 Flash free tier
+DEFAULT_RPM = 15
+DEFAULT_TPM = 1000000
+DEFAULT_MAX_QUEUE = 32
+
+PRIORITIES = {'interactive': 0, 'background': 1}
+
+# Background calls only use this much of each quota, keeping headroom for chat
+BACKGROUND_SHARE = 0.5
+
+
+class QuotaExceeded(Exception):
+    """A call was not admitted; retry_after is the number of seconds until it would be"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1.0, retry_after)
+
+
+class Reservation:
+    """One admitted call; settle() replaces its token estimate with the real count"""
+
+    def __init__(self, scheduler, entry):
+        self._scheduler = scheduler
+        self._entry = entry
+
+    def settle(self, tokens):
+        self._scheduler._settle(self._entry, tokens)
+
+
+class QuotaScheduler:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_queue=DEFAULT_MAX_QUEUE):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_queue = max_queue
+        self.blocked_until = 0.0
+        self._calls = deque()       # [admitted at, tokens] within the window
+        self._tokens = 0
+        self._queue = []            # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _prune(self, now):
+        while self._calls and self._calls[0][0] <= now - WINDOW_SECONDS:
+            self._tokens -= self._calls.popleft()[1]
+
+    def _wait_time(self, now, tokens, share=1.0):
+        """Seconds until a call of `tokens` fits `share` of both quotas (0 if it fits now)"""
+        self._prune(now)
+        rpm = max(1, int(self.rpm * share))
+        tpm = self.tpm * share
+        wait = max(0.0, self.blocked_until - now)
+        if len(self._calls) >= rpm:
+            wait = max(wait, self._calls[len(self._calls) - rpm][0] + WINDOW_SECONDS - now)
+        excess = self._tokens + min(tokens, tpm) - tpm
+        if excess > 0:
+            for admitted, used in self._calls:
+                excess -= used
+                if excess <= 0:
+                    wait = max(wait, admitted + WINDOW_SECONDS - now)
+                    break
+        return wait
+
+    def acquire(self, tokens, priority='interactive', max_wait=5.0):
+        """Admit a call of about `tokens` tokens, waiting up to max_wait seconds in the queue
+
+        Raises QuotaExceeded straight away when the quota cannot free up in time
+        or the queue is full.
+        """
+        rank = PRIORITIES[priority]
+        share = BACKGROUND_SHARE if priority == 'background' else 1.0
+        with self._condition:
+            now = time.monotonic()
+            wait = self._wait_time(now, tokens, share)
+            if wait > max_wait:
+                metrics.GEMINI_ADMISSIONS.inc(priority=priority, outcome='rejected')
+                raise QuotaExceeded(f'Gemini quota exhausted for the next {wait:.1f}s', wait)
+            if len(self._queue) >= self.max_queue:
+                metrics.GEMINI_ADMISSIONS.inc(priority=priority, outcome='rejected')
+                raise QuotaExceeded('Too many Gemini calls waiting for quota', max(wait, 1.0))
+
+            ticket = (rank, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            metrics.GEMINI_QUEUE_DEPTH.inc(priority=priority)
+            started = now
+            queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(now, tokens, share)
+                    if self._queue[0] == ticket and wait == 0:
+                        heapq.heappop(self._queue)
+                        entry = [now, tokens]
+                        self._calls.append(entry)
+                        self._tokens += tokens
+                        metrics.GEMINI_ADMISSIONS.inc(priority=priority, outcome='queued' if queued else 'immediate')
+                        metrics.GEMINI_QUEUE_SECONDS.observe(now - started, priority=priority)
+                        return Reservation(self, entry)
+                    remaining = started + max_wait - now
+                    if remaining <= 0:
+                        metrics.GEMINI_ADMISSIONS.inc(priority=priority, outcome='rejected')
+                        raise QuotaExceeded('Timed out waiting for Gemini quota', wait or 1.0)
+                    # Calls ahead in the queue wake us when they leave it
+                    self._condition.wait(min(remaining, wait) if wait > 0 else remaining)
+                    queued = True
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                metrics.GEMINI_QUEUE_DEPTH.dec(priority=priority)
+                self._condition.notify_all()
+
+    def _settle(self, entry, tokens):
+        with self._condition:
+            if any(call is entry for call in self._calls):
+                self._tokens += tokens - entry[1]
+            entry[1] = tokens
+            self._condition.notify_all()
+
+    def block(self, seconds):
+        """Hold every call back for `seconds` (Gemini answered 429)"""
+        with self._condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self):
+        with self._condition:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                'rpm_limit': self.rpm,
+                'tpm_limit': self.tpm,
+                'requests_in_window': len(self._calls),
+                'tokens_in_window': self._tokens,
+                'queued': len(self._queue),
+                'blocked_for_s': round(max(0.0, self.blocked_until - now), 1)
+            }
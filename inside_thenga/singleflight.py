@@ -0,0 +1,57 @@
+# Single-flight coalescing of identical upstream calls. The first caller for a
+# key performs the call; callers that arrive with the same key while it is in
+# flight wait for it and share its result (or its exception) instead of making
+# their own call.
+import threading
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """In-flight calls to one upstream, by key"""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Return (result, shared): fn()'s result, shared=True if another caller's call produced it
+
+        A caller that waits longer than `timeout` for the call in flight gets a TimeoutError.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.COALESCED_CALLS.inc(upstream=self.upstream)
+            if not call.done.wait(timeout):
+                raise TimeoutError(f'Timed out waiting for the in-flight {self.upstream} call')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
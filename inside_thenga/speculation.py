@@ -0,0 +1,143 @@
+# Speculative /chat work from interim speech recognition results. The words
+# that two consecutive interim transcripts of a session agree on form a stable
+# prefix; whenever it grows, the front of the /chat pipeline (translation and
+# the Gemini call) is started on it in the background. When the final /chat
+# arrives with the same words it takes over the finished (or still running)
+# work; otherwise the speculation is dropped. Superseded speculations are
+# cancelled before their Gemini call if they have not reached it yet.
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from answer_cache import normalize
+
+# Fewer stable words than this are not worth a Gemini call
+MIN_WORDS = 2
+# A speculation the final /chat has not claimed within this long is dropped
+MAX_AGE_SECONDS = 30.0
+MAX_SESSIONS = 256
+
+
+class Speculation:
+    """Background pipeline work for one session on one stable prefix"""
+
+    def __init__(self, text, pipeline, output):
+        self.text = text
+        self.key = normalize(text)
+        self.pipeline = pipeline
+        self.output = output
+        self.started = time.monotonic()
+        self.finished = None
+        self.claimed = None
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def result(self, timeout):
+        """The work's result, or None if it failed, was cancelled or is not done within `timeout`"""
+        try:
+            return self.future.result(timeout=max(0.0, timeout))
+        except Exception:
+            return None
+
+    def cancel(self):
+        self.cancelled.set()
+        self.future.cancel()
+
+
+class Speculator:
+    def __init__(self, workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speculate')
+        self._transcripts = OrderedDict()   # session -> normalized words of the last interim transcript
+        self._speculations = {}             # session -> Speculation
+        self._lock = threading.Lock()
+        self.outcomes = Counter()
+        self.head_start_ms = deque(maxlen=500)
+
+    def _record(self, outcome):
+        self.outcomes[outcome] += 1
+        metrics.SPECULATIONS.inc(outcome=outcome)
+
+    def observe(self, session_id, transcript, pipeline, output, work):
+        """Take an interim transcript; start work(speculation) on its stable prefix if that grew
+
+        Returns a report with the stable prefix and the text being speculated on.
+        """
+        words = transcript.split()
+        keys = [normalize(word) for word in words]
+        with self._lock:
+            previous = self._transcripts.pop(session_id, [])
+            self._transcripts[session_id] = keys
+            while len(self._transcripts) > MAX_SESSIONS:
+                stale, _ = self._transcripts.popitem(last=False)
+                if stale in self._speculations:
+                    self._speculations.pop(stale).cancel()
+            stable = 0
+            while stable < min(len(keys), len(previous)) and keys[stable] == previous[stable]:
+                stable += 1
+            prefix = ' '.join(words[:stable])
+            current = self._speculations.get(session_id)
+            report = {'stable_prefix': prefix, 'started': False,
+                      'speculating': current.text if current is not None else None}
+            if stable < MIN_WORDS:
+                return report
+            if current is not None and current.key == normalize(prefix) \
+                    and (current.pipeline, current.output) == (pipeline, output):
+                return report
+            if current is not None:
+                current.cancel()
+                self._record('superseded')
+            speculation = Speculation(prefix, pipeline, output)
+            speculation.future = self._executor.submit(self._run, work, speculation)
+            self._speculations[session_id] = speculation
+            self._record('started')
+        report.update(started=True, speculating=prefix)
+        return report
+
+    @staticmethod
+    def _run(work, speculation):
+        try:
+            return work(speculation)
+        finally:
+            speculation.finished = time.monotonic()
+
+    def claim(self, session_id, message):
+        """The session's speculation if it was on exactly this message (None otherwise)
+
+        The caller must settle() a claimed speculation once it knows whether it used it.
+        """
+        with self._lock:
+            self._transcripts.pop(session_id, None)
+            speculation = self._speculations.pop(session_id, None)
+        if speculation is None:
+            return None
+        if speculation.key != normalize(message) or time.monotonic() - speculation.started > MAX_AGE_SECONDS:
+            speculation.cancel()
+            self._record('miss')
+            return None
+        speculation.claimed = time.monotonic()
+        return speculation
+
+    def settle(self, speculation, used):
+        """Record whether the final /chat used a claimed speculation's result"""
+        if not used:
+            speculation.cancel()
+            self._record('unusable')
+            return
+        self._record('hit')
+        # How much earlier the work started than it would have without speculation
+        self.head_start_ms.append((min(speculation.claimed, speculation.finished or speculation.claimed)
+                                   - speculation.started) * 1000)
+
+    def snapshot(self):
+        settled = self.outcomes['hit'] + self.outcomes['miss'] + self.outcomes['unusable']
+        head_starts = list(self.head_start_ms)
+        with self._lock:
+            running = sum(1 for speculation in self._speculations.values() if not speculation.future.done())
+        return {
+            'outcomes': dict(self.outcomes),
+            'hit_ratio': round(self.outcomes['hit'] / settled, 3) if settled else None,
+            'mean_head_start_ms': round(sum(head_starts) / len(head_starts), 2) if head_starts else None,
+            'in_flight': running
+        }
@@ -0,0 +1,99 @@
+# Text preparation for speech synthesis. Gemini writes markdown (bold, lists,
+# code fences) and emoji; translating and speaking those symbols wastes
+# characters and synthesis time, so replies are cleaned into plain sentences,
+# units are written out the way they are said, and the spoken part is capped.
+import re
+
+# Sentence ends: . ! ? (and the Devanagari danda) followed by whitespace, or a line break
+_SENTENCE_END = re.compile(r'(?<=[.!?।])\s+|\s*\n+\s*')
+
+# A full stop after these (titles, "e.g.", initials) does not end the sentence
+_ABBREVIATION = re.compile(r'(?:\b(?:Mr|Mrs|Ms|Dr|Prof|Sr|Jr|St|vs|approx|e\.g|i\.e)|(?<![\w.])[A-Z])\.$')
+
+# Fragments shorter than this ("Ha!", "Okay.") are joined to the next sentence;
+# a synthesis request of their own would cost more than it saves
+MIN_SENTENCE_CHARS = 24
+
+
+def split_sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """Split text into sentences for synthesis, joining short fragments to their neighbour"""
+    sentences = []
+    pending = ''
+    for part in _SENTENCE_END.split(text.strip()):
+        if not part:
+            continue
+        pending = f'{pending} {part}' if pending else part
+        if len(pending) >= min_chars and not _ABBREVIATION.search(pending):
+            sentences.append(pending)
+            pending = ''
+    if pending:
+        if sentences:
+            sentences[-1] = f'{sentences[-1]} {pending}'
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+# Spoken forms of units after a number, per language
+UNITS = {
+    'en': {
+        '°C': 'degrees Celsius', '℃': 'degrees Celsius', '°F': 'degrees Fahrenheit', '%': 'percent',
+        'km/h': 'kilometres per hour', 'kmph': 'kilometres per hour', 'mAh': 'milliamp hours',
+        'mA': 'milliamps', 'kW': 'kilowatts', 'W': 'watts', 'V': 'volts', 'kHz': 'kilohertz',
+        'MHz': 'megahertz', 'GHz': 'gigahertz', 'Hz': 'hertz', 'ms': 'milliseconds',
+        'km': 'kilometres', 'cm': 'centimetres', 'mm': 'millimetres', 'kg': 'kilograms',
+    },
+    'ml': {
+        '°C': 'ഡിഗ്രി സെൽഷ്യസ്', '℃': 'ഡിഗ്രി സെൽഷ്യസ്', '°F': 'ഡിഗ്രി ഫാരൻഹീറ്റ്', '%': 'ശതമാനം',
+        'km/h': 'കിലോമീറ്റർ പ്രതി മണിക്കൂർ', 'kmph': 'കിലോമീറ്റർ പ്രതി മണിക്കൂർ', 'mAh': 'മില്ലിആമ്പിയർ അവർ',
+        'mA': 'മില്ലിആമ്പിയർ', 'kW': 'കിലോവാട്ട്', 'W': 'വാട്ട്', 'V': 'വോൾട്ട്', 'kHz': 'കിലോഹെർട്സ്',
+        'MHz': 'മെഗാഹെർട്സ്', 'GHz': 'ഗിഗാഹെർട്സ്', 'Hz': 'ഹെർട്സ്', 'ms': 'മില്ലിസെക്കൻഡ്',
+        'km': 'കിലോമീറ്റർ', 'cm': 'സെന്റിമീറ്റർ', 'mm': 'മില്ലിമീറ്റർ', 'kg': 'കിലോഗ്രാം',
+    },
+}
+# Longest units first so 'mAh' is not read as 'mA' + 'h'
+_UNIT = re.compile(r'(\d+(?:[.,]\d+)?)\s*(' + '|'.join(re.escape(unit) for unit in sorted(UNITS['en'], key=len, reverse=True))
+                   + r')(?![A-Za-z])')
+
+_CODE_BLOCK = re.compile(r'```.*?(?:```|$)', re.S)
+_INLINE_CODE = re.compile(r'`([^`]*)`')
+_LINK = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_URL = re.compile(r'https?://\S+')
+_EMPHASIS = re.compile(r'(\*{1,3}|(?<!\w)_{1,3})(\S(?:.*?\S)?)\1(?!\w)')
+_LINE_MARKUP = re.compile(r'^\s*(?:#{1,6}\s+|>\s?|[-*+•]\s+|\d+[.)]\s+)', re.M)
+# Emoji with their variation selectors and joiners (a lone ZWJ is left alone: Malayalam chillus use it)
+_EMOJI = re.compile('[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF](?:[\uFE0F\u200D]+[\U0001F000-\U0001FAFF\u2600-\u27BF]?)*\uFE0F?')
+_SYMBOLS = re.compile(r'[*#`~|]')
+_SPACE_BEFORE_MARK = re.compile(r'\s+([.,!?:;।])')
+
+
+def clean(text, language='en'):
+    """Plain spoken text: markdown, code, links and emoji removed, units written out,
+    each line ending as a sentence and whitespace collapsed"""
+    text = _CODE_BLOCK.sub(' ', text)
+    text = _INLINE_CODE.sub(r'\1', text)
+    text = _LINK.sub(r'\1', text)
+    text = _URL.sub('', text)
+    text = _LINE_MARKUP.sub('', text)
+    text = _EMPHASIS.sub(r'\2', text)
+    text = _EMOJI.sub('', text)
+    text = _SYMBOLS.sub('', text)
+    units = UNITS.get(language, UNITS['en'])
+    text = _UNIT.sub(lambda match: f'{match.group(1)} {units[match.group(2)]}', text)
+    lines = [_SPACE_BEFORE_MARK.sub(r'\1', ' '.join(line.split())) for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    # List items and headings become sentences of their own
+    if len(lines) > 1:
+        lines = [line if line[-1] in '.!?:;,।' else f'{line}.' for line in lines]
+    return ' '.join(lines)
+
+
+def cap(text, max_chars):
+    """At most max_chars of text, cut at the end of a sentence where there is one (0 = no cap)"""
+    if not max_chars or len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    end = max(head.rfind(mark) for mark in '.!?।')
+    if end > 0:
+        return head[:end + 1]
+    return head.rsplit(' ', 1)[0] if ' ' in head else head
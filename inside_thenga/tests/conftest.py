@@ -0,0 +1,32 @@
+# The server modules import each other by flat name from inside_thenga/, so
+# the tests put that directory on the path. MP3 clip fixtures shared by the
+# audio tests are below. Run from inside_thenga:
+#     python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames of 1152 samples
+MP3_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_BYTES = 417
+
+
+@pytest.fixture
+def mp3_clip():
+    """mp3_clip(frames, fill=0): an MP3 clip of that many frames, with `fill` as every payload byte"""
+    def clip(frames, fill=0):
+        return (MP3_HEADER + bytes([fill]) * (MP3_FRAME_BYTES - len(MP3_HEADER))) * frames
+    return clip
+
+
+@pytest.fixture
+def write_clip(mp3_clip):
+    """write_clip(directory, name, frames, fill=0): write an MP3 clip file and return its path"""
+    def write(directory, name, frames, fill=0):
+        path = directory / name
+        path.write_bytes(mp3_clip(frames, fill))
+        return path
+    return write
@@ -0,0 +1,85 @@
+import pytest
+
+import answer_cache
+
+KEY = ('text', 'translate', 'session-a')
+
+
+@pytest.fixture
+def cache():
+    return answer_cache.AnswerCache()
+
+
+def test_exact_repeat_matches(cache):
+    cache.put(KEY, 'What is the weather like today?', {'reply': 'sunny'})
+    answer, score, matched = cache.match(KEY, 'what is the weather like today')
+    assert answer == {'reply': 'sunny'}
+    assert score == 1.0
+    assert matched == 'what is the weather like today'
+
+
+def test_near_duplicate_above_threshold_matches(cache):
+    cache.put(KEY, 'tell me a joke about coconuts', {'reply': 'joke'})
+    answer, score, _ = cache.match(KEY, 'tell me a joke about coconut')
+    assert answer == {'reply': 'joke'}
+    assert answer_cache.DEFAULT_THRESHOLD <= score < 1.0
+
+
+def test_different_message_below_threshold_misses(cache):
+    cache.put(KEY, 'tell me a joke about coconuts', {'reply': 'joke'})
+    answer, score, matched = cache.match(KEY, 'tell me about the coconut harvest')
+    assert answer is None
+    assert 0 < score < answer_cache.DEFAULT_THRESHOLD
+    assert matched == 'tell me a joke about coconuts'
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ('turn the LED on', 'turn the LED off'),
+    ('turn the LED off', 'turn the LED on'),
+    ('rotate the coconut 80 degrees', 'rotate the coconut 40 degrees'),
+    ('set the volume to eighty percent', 'set the volume to forty percent'),
+    ("please don't start the motor", 'please start the motor'),
+    ('open the lid now please', 'close the lid now please'),
+])
+def test_near_miss_commands_never_match(cache, stored, asked):
+    cache.put(KEY, stored, {'reply': stored})
+    answer, _, matched = cache.match(KEY, asked, threshold=0.0)
+    assert answer is None
+    assert matched is None
+
+
+def test_signature_keeps_numbers_negations_and_directions():
+    signature = lambda text: answer_cache.signature(answer_cache.normalize(text))
+    assert signature("Don't turn the LED on!") == ('not', 'on')
+    assert signature('rotate 80 degrees, then 40') == ('80', '40')
+    assert signature('what is a coconut') == ()
+    assert signature('do not stop') == signature("don't stop")
+
+
+def test_variants_are_separate(cache):
+    cache.put(KEY, 'what is the weather like today', {'reply': 'sunny'})
+    for other in (('text', 'translate', 'session-b'), ('text', 'direct', 'session-a'),
+                  ('structured', 'translate', 'session-a')):
+        assert cache.match(other, 'what is the weather like today')[0] is None
+
+
+def test_max_age(cache, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache.time, 'monotonic', lambda: now[0])
+    cache.put(KEY, 'what is the weather like today', {'reply': 'sunny'})
+    now[0] += 30
+    assert cache.match(KEY, 'what is the weather like today', max_age=60)[0] is not None
+    now[0] += 31
+    answer, score, _ = cache.match(KEY, 'what is the weather like today', max_age=60)
+    assert answer is None and score == 1.0
+
+
+def test_evicts_least_recently_used():
+    cache = answer_cache.AnswerCache(max_entries=2)
+    cache.put(KEY, 'first message here', {'reply': 1})
+    cache.put(KEY, 'second message here', {'reply': 2})
+    assert cache.get(KEY, 'first message here') == {'reply': 1}
+    cache.put(KEY, 'third message here', {'reply': 3})
+    assert len(cache) == 2
+    assert cache.get(KEY, 'second message here') is None
+    assert cache.match(KEY, 'second message here')[2] != 'second message here'
@@ -0,0 +1,57 @@
+import audio_cache
+import mp3
+
+
+def test_put_returns_frames_and_duration(mp3_clip):
+    cache = audio_cache.SentenceAudioCache()
+    frames, seconds = cache.put('voice', 'Hello there.', b'ID3' + bytes(7) + mp3_clip(10))
+    assert frames == mp3_clip(10)
+    assert seconds == mp3.duration(mp3_clip(10))
+    assert cache.get('voice', 'Hello  there.') == (frames, seconds)
+
+
+def test_keys_by_voice_and_exact_sentence(mp3_clip):
+    cache = audio_cache.SentenceAudioCache()
+    cache.put('voice-a', 'Hello there.', mp3_clip(2))
+    assert cache.get('voice-b', 'Hello there.') is None
+    assert cache.get('voice-a', 'hello there') is None
+
+
+def test_evicts_least_recently_used_by_size(mp3_clip):
+    cache = audio_cache.SentenceAudioCache(max_bytes=len(mp3_clip(10)))
+    cache.put('voice', 'first', mp3_clip(4))
+    cache.put('voice', 'second', mp3_clip(4))
+    assert cache.get('voice', 'first') is not None
+    # 12 frames do not fit: 'second' is the least recently used and goes
+    cache.put('voice', 'third', mp3_clip(4))
+    assert cache.get('voice', 'second') is None
+    assert cache.get('voice', 'first') is not None
+    assert cache.get('voice', 'third') is not None
+    assert cache.snapshot()['bytes'] == len(mp3_clip(8))
+
+
+def test_large_sentence_evicts_several(mp3_clip):
+    cache = audio_cache.SentenceAudioCache(max_bytes=len(mp3_clip(10)))
+    for name in ('a', 'b', 'c'):
+        cache.put('voice', name, mp3_clip(3))
+    cache.put('voice', 'big', mp3_clip(8))
+    snapshot = cache.snapshot()
+    assert snapshot['entries'] == 1
+    assert snapshot['bytes'] == len(mp3_clip(8))
+
+
+def test_sentence_larger_than_cache_is_not_kept(mp3_clip):
+    cache = audio_cache.SentenceAudioCache(max_bytes=len(mp3_clip(2)))
+    cache.put('voice', 'small', mp3_clip(1))
+    frames, _ = cache.put('voice', 'huge', mp3_clip(3))
+    assert frames == mp3_clip(3)
+    assert cache.get('voice', 'huge') is None
+    assert cache.get('voice', 'small') is not None
+
+
+def test_replacing_a_sentence_keeps_the_byte_count(mp3_clip):
+    cache = audio_cache.SentenceAudioCache()
+    cache.put('voice', 'again', mp3_clip(5))
+    cache.put('voice', 'again', mp3_clip(2))
+    snapshot = cache.snapshot()
+    assert (snapshot['entries'], snapshot['bytes']) == (1, len(mp3_clip(2)))
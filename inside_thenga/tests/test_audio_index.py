@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import audio_index
+
+
+def eventually(check, timeout=2.0):
+    """Poll check() until it is true; inotify events arrive on another thread"""
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture(params=['inotify', 'mtime'])
+def index(request, tmp_path, monkeypatch):
+    if request.param == 'mtime':
+        monkeypatch.setattr(audio_index, '_inotify_watch', lambda directory: None)
+        monkeypatch.setattr(audio_index, 'CHECK_INTERVAL', 0.0)
+    index = audio_index.AudioIndex(str(tmp_path))
+    index.files()
+    if request.param == 'inotify' and index.snapshot()['watch'] != 'inotify':
+        pytest.skip('inotify is not available here')
+    return index
+
+
+def test_describes_clips(tmp_path, write_clip, mp3_clip):
+    write_clip(tmp_path, '1.mp3', 10)
+    (tmp_path / 'notes.txt').write_text('not audio')
+    entry = audio_index.AudioIndex(str(tmp_path)).get('1.mp3')
+    assert entry.size == len(mp3_clip(10))
+    assert entry.duration == pytest.approx(10 * 1152 / 44100, abs=0.001)
+    assert len(entry.hash) == 16
+    assert audio_index.AudioIndex(str(tmp_path)).get('notes.txt') is None
+
+
+def test_rebuilds_when_a_clip_is_added_or_removed(index, tmp_path, write_clip):
+    assert index.files() == []
+    path = write_clip(tmp_path, 'new.mp3', 3)
+    assert eventually(lambda: index.get('new.mp3') is not None)
+    path.unlink()
+    assert eventually(lambda: index.get('new.mp3') is None)
+
+
+def test_rebuilds_when_a_clip_is_replaced(index, tmp_path, write_clip):
+    write_clip(tmp_path, 'clip.mp3', 3)
+    assert eventually(lambda: index.get('clip.mp3') is not None)
+    before = index.get('clip.mp3')
+    # Written aside and renamed over the old clip, as the server does
+    write_clip(tmp_path, 'clip.tmp', 6).rename(tmp_path / 'clip.mp3')
+    assert eventually(lambda: index.get('clip.mp3').size == before.size * 2)
+    assert index.get('clip.mp3').hash != before.hash
+
+
+def test_rebuild_only_rereads_changed_files(index, tmp_path, monkeypatch, write_clip):
+    write_clip(tmp_path, 'a.mp3', 2)
+    write_clip(tmp_path, 'b.mp3', 2)
+    assert eventually(lambda: len(index.files()) == 2)
+    described = []
+    original = audio_index.describe
+    monkeypatch.setattr(audio_index, 'describe', lambda path, name: described.append(name) or original(path, name))
+    write_clip(tmp_path, 'c.mp3', 2)
+    assert eventually(lambda: len(index.files()) == 3)
+    assert described == ['c.mp3']
+
+
+def test_unchanged_directory_is_not_rebuilt(tmp_path, write_clip):
+    write_clip(tmp_path, 'a.mp3', 2)
+    index = audio_index.AudioIndex(str(tmp_path))
+    index.files()
+    rebuilds = index.rebuilds
+    for _ in range(5):
+        index.get('a.mp3')
+    assert index.rebuilds == rebuilds
+
+
+def test_refresh_reindexes_one_file(tmp_path, write_clip, mp3_clip):
+    index = audio_index.AudioIndex(str(tmp_path))
+    index.files()
+    write_clip(tmp_path, 'mine.mp3', 4)
+    assert index.refresh('mine.mp3').size == len(mp3_clip(4))
+    (tmp_path / 'mine.mp3').unlink()
+    assert index.refresh('mine.mp3') is None
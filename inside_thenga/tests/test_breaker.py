@@ -0,0 +1,99 @@
+import pytest
+
+import breaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def trip(circuit):
+    for _ in range(circuit.failure_threshold):
+        assert circuit.allow()
+        circuit.record_failure()
+
+
+def test_stays_closed_below_threshold(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    for _ in range(2):
+        circuit.record_failure()
+    assert circuit.state == breaker.CLOSED
+    assert circuit.allow()
+
+
+def test_success_resets_the_failure_count(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    circuit.record_failure()
+    circuit.record_failure()
+    circuit.record_success()
+    circuit.record_failure()
+    circuit.record_failure()
+    assert circuit.state == breaker.CLOSED
+
+
+def test_opens_after_consecutive_failures(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    trip(circuit)
+    assert circuit.state == breaker.OPEN
+    assert not circuit.allow()
+    with pytest.raises(breaker.CircuitOpen):
+        circuit.check()
+    assert circuit.info()['state'] == breaker.OPEN
+
+
+def test_half_open_lets_one_probe_through(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    trip(circuit)
+    clock[0] += 9.9
+    assert not circuit.allow()
+    clock[0] += 0.1
+    assert circuit.allow()
+    assert circuit.state == breaker.HALF_OPEN
+    assert not circuit.allow()
+
+
+def test_successful_probe_closes(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    trip(circuit)
+    clock[0] += 10
+    assert circuit.allow()
+    circuit.record_success()
+    assert circuit.state == breaker.CLOSED
+    assert circuit.failures == 0
+    assert circuit.allow() and circuit.allow()
+
+
+def test_failed_probe_reopens(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    trip(circuit)
+    clock[0] += 10
+    assert circuit.allow()
+    circuit.record_failure()
+    assert circuit.state == breaker.OPEN
+    assert not circuit.allow()
+    # The reset interval starts again from the failed probe
+    clock[0] += 10
+    assert circuit.allow()
+
+
+def test_released_probe_lets_another_through(clock):
+    circuit = breaker.CircuitBreaker('test', failure_threshold=3, reset_seconds=10)
+    trip(circuit)
+    clock[0] += 10
+    assert circuit.allow()
+    circuit.release()
+    assert circuit.state == breaker.HALF_OPEN
+    assert circuit.allow()
+    assert not circuit.allow()
+
+
+def test_configure_applies_to_every_upstream():
+    try:
+        breaker.configure(failure_threshold=2, reset_seconds=5)
+        assert all(circuit.failure_threshold == 2 and circuit.reset_seconds == 5
+                   for circuit in breaker.breakers.values())
+    finally:
+        breaker.configure()
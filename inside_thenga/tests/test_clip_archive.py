@@ -0,0 +1,131 @@
+import io
+import json
+
+import pytest
+
+import audio_index
+import clip_archive
+
+
+@pytest.fixture
+def archive_path(tmp_path, write_clip):
+    """An archive of two clips built from loose files"""
+    clips = tmp_path / 'clips'
+    clips.mkdir()
+    write_clip(clips, '1.mp3', 3)
+    write_clip(clips, '2.mp3', 1, fill=1)
+    entries = audio_index.AudioIndex(str(clips)).files()
+    path = str(tmp_path / 'clips.pack')
+    clip_archive.build(path, [(entries[0], 'Coconut picked up'), (entries[1], None)])
+    return path
+
+
+def rewrite_index(archive_path, change):
+    index_path = clip_archive.index_path(archive_path)
+    with open(index_path, encoding='utf-8') as f:
+        index = json.load(f)
+    change(index)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+
+def test_round_trip(archive_path, tmp_path):
+    archive = clip_archive.ClipArchive()
+    assert archive.open(archive_path) == 2
+    assert [clip.name for clip in archive.clips()] == ['1.mp3', '2.mp3']
+    for name in ('1.mp3', '2.mp3'):
+        clip = archive.get(name)
+        assert bytes(archive.data(clip)) == (tmp_path / 'clips' / name).read_bytes()
+    first = archive.get('1.mp3')
+    assert first.message == 'Coconut picked up'
+    assert first.hash == audio_index.describe(str(tmp_path / 'clips' / '1.mp3'), '1.mp3').hash
+    assert archive.get('2.mp3').offset == first.length
+    assert archive.get('3.mp3') is None
+    assert archive.snapshot()['served'] == {'play': 0, 'http': 2}
+
+
+def test_reader_reads_and_seeks(archive_path):
+    archive = clip_archive.ClipArchive()
+    archive.open(archive_path)
+    clip = archive.get('2.mp3')
+    reader = io.BufferedReader(clip_archive.ClipReader(archive.data(clip, use='play')))
+    assert reader.read(4) == b'\xff\xfb\x90\x00'
+    assert reader.read() == b'\x01' * 413
+    reader.seek(-2, io.SEEK_END)
+    assert reader.read() == b'\x01\x01'
+    reader.seek(0)
+    assert len(reader.read()) == clip.length
+
+
+def test_missing_archive_raises_oserror(tmp_path):
+    with pytest.raises(OSError):
+        clip_archive.ClipArchive().open(str(tmp_path / 'nothing.pack'))
+
+
+def test_missing_data_file_raises_oserror(archive_path, tmp_path):
+    (tmp_path / 'clips.pack').unlink()
+    with pytest.raises(OSError):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_truncated_archive_raises_valueerror(archive_path):
+    with open(archive_path, 'r+b') as f:
+        f.truncate(100)
+    with pytest.raises(ValueError, match='index expects'):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_unknown_format_raises_valueerror(archive_path):
+    rewrite_index(archive_path, lambda index: index.update(format=clip_archive.FORMAT + 1))
+    with pytest.raises(ValueError, match='format'):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_clip_outside_archive_raises_valueerror(archive_path):
+    rewrite_index(archive_path, lambda index: index['clips']['2.mp3'].update(length=index['clips']['2.mp3']['length'] + 1))
+    with pytest.raises(ValueError, match='outside'):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+@pytest.mark.parametrize('change', [
+    lambda index: index.pop('size'),
+    lambda index: index.update(size='big'),
+    lambda index: index.update(clips=[]),
+    lambda index: index['clips'].update({'3.mp3': None}),
+    lambda index: index['clips']['1.mp3'].pop('offset'),
+    lambda index: index['clips']['1.mp3'].update(extra=1),
+    lambda index: index['clips']['1.mp3'].update(offset='0'),
+    lambda index: index['clips']['1.mp3'].update(length=-1),
+    lambda index: index['clips']['1.mp3'].update(length=True),
+    lambda index: index['clips']['1.mp3'].update(hash=None),
+    lambda index: index['clips']['1.mp3'].update(duration='long'),
+    lambda index: index['clips']['1.mp3'].update(message=['hi']),
+])
+def test_malformed_index_raises_valueerror(archive_path, change):
+    rewrite_index(archive_path, change)
+    with pytest.raises(ValueError):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_index_that_is_not_an_object_raises_valueerror(archive_path):
+    with open(clip_archive.index_path(archive_path), 'w', encoding='utf-8') as f:
+        json.dump([{'format': clip_archive.FORMAT}], f)
+    with pytest.raises(ValueError, match='not a JSON object'):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_unreadable_index_raises_valueerror(archive_path):
+    with open(clip_archive.index_path(archive_path), 'w', encoding='utf-8') as f:
+        f.write('{"format": 1, "size"')
+    with pytest.raises(ValueError):
+        clip_archive.ClipArchive().open(archive_path)
+
+
+def test_failed_open_keeps_the_previous_archive(archive_path):
+    archive = clip_archive.ClipArchive()
+    archive.open(archive_path)
+    with open(archive_path, 'r+b') as f:
+        f.truncate(100)
+    with pytest.raises(ValueError):
+        archive.open(archive_path)
+    assert [clip.name for clip in archive.clips()] == ['1.mp3', '2.mp3']
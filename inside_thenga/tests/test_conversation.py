@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import conversation
+
+# 40 characters: 10 estimated tokens
+PERSONA = 'p' * 40
+MESSAGE = 'm' * 40
+
+
+def turn(index, tokens=20):
+    return f'{index:02d}' + 'x' * (tokens * conversation.CHARS_PER_TOKEN - 2)
+
+
+def wait_for_summary(session, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        with session.lock:
+            if not session.summarizing:
+                return
+        assert time.monotonic() < deadline, 'summary never caught up'
+        time.sleep(0.01)
+
+
+def test_estimate_tokens():
+    assert conversation.estimate_tokens('') == 0
+    assert conversation.estimate_tokens('abcde') == 2
+
+
+def test_build_keeps_the_newest_turns_that_fit():
+    memory = conversation.ConversationMemory(PERSONA, budget_tokens=100)
+    session = memory.session('s')
+    session.turns = [('user' if i % 2 == 0 else 'model', turn(i)) for i in range(6)]
+    contents, report = memory.build('s', MESSAGE)
+    # 100 - 10 (persona) - 10 (message) leaves room for four 20-token turns
+    assert report['turns_sent'] == 4
+    assert report['turns_dropped'] == 2
+    assert report['history_tokens'] == 80
+    assert report['estimated_prompt_tokens'] == 100
+    assert [content['role'] for content in contents] == ['user', 'model', 'user', 'model', 'user']
+    assert [part['text'] for part in contents[0]['parts']] == [PERSONA, turn(2)]
+    assert contents[-1]['parts'][-1]['text'] == MESSAGE
+
+
+def test_build_without_history_sends_persona_and_message():
+    memory = conversation.ConversationMemory(PERSONA)
+    contents, report = memory.build('new', MESSAGE)
+    assert contents == [{'role': 'user', 'parts': [{'text': PERSONA}, {'text': MESSAGE}]}]
+    assert report['turns_total'] == 0
+
+
+def test_persona_override_and_summary_in_preamble():
+    memory = conversation.ConversationMemory(PERSONA)
+    memory.session('s').summary = 'They asked about the LED.'
+    contents, report = memory.build('s', MESSAGE, persona='other persona')
+    assert contents[0]['parts'][0]['text'].startswith('other persona\n\nSummary of the conversation so far:\n')
+    assert 'They asked about the LED.' in contents[0]['parts'][0]['text']
+    assert report['summary_tokens'] > 0
+
+
+def test_evicted_turns_are_summarized_by_the_model():
+    prompts = []
+    memory = conversation.ConversationMemory('', summarize=lambda prompt: prompts.append(prompt) or 'SUMMARY',
+                                             budget_tokens=400, summary_tokens=100)
+    for i in range(4):
+        memory.append('s', turn(2 * i, 30), turn(2 * i + 1, 30))
+    session = memory.session('s')
+    wait_for_summary(session)
+    assert session.summary == 'SUMMARY'
+    assert session.summarized_upto > 0
+    assert session.summarized_upto + len(session.turns) == 8
+    assert turn(0, 30) in prompts[0]
+    _, report = memory.build('s', MESSAGE)
+    assert report['turns_summarized'] == session.summarized_upto
+    assert report['turns_total'] == 8
+
+
+@pytest.mark.parametrize('summarize', [None, lambda prompt: 1 / 0, lambda prompt: ''])
+def test_extractive_summary_when_the_model_cannot_summarize(summarize):
+    memory = conversation.ConversationMemory('', summarize=summarize, budget_tokens=400, summary_tokens=100)
+    for i in range(4):
+        memory.append('s', f'Question {i}. With detail.', turn(i, 60))
+    session = memory.session('s')
+    wait_for_summary(session)
+    assert session.summary.startswith('User: Question 0')
+    assert 'With detail' not in session.summary
+    assert conversation.estimate_tokens(session.summary) <= 100
+
+
+def test_extractive_summary_keeps_the_newest_text():
+    turns = [('user', 'a' * 100), ('model', 'b' * 100)]
+    summary = conversation.extractive_summary('old', turns, max_tokens=10)
+    assert len(summary) == 40
+    assert summary.endswith('b' * 32)
+
+
+def test_least_recently_used_session_is_dropped():
+    memory = conversation.ConversationMemory(PERSONA, max_sessions=2)
+    memory.session('a').summary = 'kept'
+    memory.session('b')
+    memory.session('a')
+    memory.session('c')
+    assert memory.session('a').summary == 'kept'
+    assert set(memory._sessions) == {'a', 'c'}
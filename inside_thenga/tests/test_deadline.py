@@ -0,0 +1,37 @@
+import pytest
+
+import deadline
+
+
+@pytest.mark.parametrize('value, expected', [(None, 8000), ('', 8000), (0, 8000), (2500, 2500), ('1200.5', 1200.5),
+                                             (deadline.MAX_REQUEST_MS, deadline.MAX_REQUEST_MS)])
+def test_requested_ms(value, expected):
+    assert deadline.requested_ms(value, 8000) == expected
+
+
+@pytest.mark.parametrize('value', [-1, 'nan', 'inf', '-inf', float('nan'), deadline.MAX_REQUEST_MS + 1, 'soon', [1], {'ms': 1}])
+def test_requested_ms_rejects(value):
+    with pytest.raises(ValueError):
+        deadline.requested_ms(value, 8000)
+
+
+def test_stage_timeout_reserves_later_shares(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(deadline.time, 'monotonic', lambda: now[0])
+    budget = deadline.Deadline(10.0, {'first': 0.2, 'second': 0.5, 'third': 0.3})
+    assert budget.timeout('first') == pytest.approx(2.0)
+    now[0] += 1.0
+    # The first stage's unused second flows on
+    assert budget.timeout('second') == pytest.approx(6.0)
+    assert budget.fits('third')
+    now[0] += 8.9
+    assert not budget.fits('third')
+    now[0] += 1.0
+    assert budget.remaining() == 0.0
+
+
+def test_degrade_records_each_degradation_once():
+    budget = deadline.Deadline(1.0, {'stage': 1.0})
+    budget.degrade('skipped_tts')
+    budget.degrade('skipped_tts')
+    assert budget.degraded == ['skipped_tts']
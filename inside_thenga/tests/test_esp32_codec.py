@@ -0,0 +1,118 @@
+import os
+import re
+
+import pytest
+
+import esp32_codec
+
+WIRE_HEADER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'esp32_client', 'thenga_wire.h')
+C_TYPES = {'uint8_t': 'B', 'uint16_t': 'H', 'uint32_t': 'I', 'float': 'f'}
+
+EVENTS = {
+    'pickup': {},
+    'placement': {'motor_started': True, 'stable_duration': 5000},
+    'gyro': {'gyro_x': 1.5, 'gyro_y': -2.25, 'gyro_z': 40.0, 'threshold': 30.0},
+    'button': {'button_id': 'button2', 'state': 'clicked'},
+    'status': {'command': 'ping'},
+}
+
+
+@pytest.fixture(scope='module')
+def wire():
+    with open(WIRE_HEADER, encoding='utf-8') as f:
+        return f.read()
+
+
+def define(wire, name):
+    return int(re.search(rf'#define {name} (\d+)', wire).group(1))
+
+
+def struct_format(wire, name):
+    """The struct module format of a packed struct in thenga_wire.h"""
+    body = re.search(rf'struct __attribute__\(\(packed\)\) {name} \{{(.*?)\}};', wire, re.S).group(1)
+    fmt = '<'
+    for line in body.splitlines():
+        field = re.match(r'\s*(\w+)\s+(\w+)(?:\[(\w+)\])?;', line)
+        if not field:
+            continue
+        ctype, _, size = field.groups()
+        if ctype == 'ThengaEventHeader':
+            fmt += esp32_codec.HEADER.format.lstrip('<')
+        elif ctype == 'char':
+            fmt += f'{define(wire, size)}s'
+        else:
+            fmt += C_TYPES[ctype]
+    return fmt
+
+
+def test_constants_match_the_firmware(wire):
+    assert define(wire, 'THENGA_WIRE_VERSION') == esp32_codec.SCHEMA_VERSION
+    assert define(wire, 'THENGA_DEVICE_ID_SIZE') == esp32_codec.DEVICE_ID_SIZE
+    assert re.search(r'#define THENGA_WIRE_CONTENT_TYPE "(.*?)"', wire).group(1) == esp32_codec.CONTENT_TYPE
+    for event, code in esp32_codec.EVENT_CODES.items():
+        assert re.search(rf'THENGA_EVT_{event.upper()} = (\d+)', wire).group(1) == str(code)
+
+
+@pytest.mark.parametrize('event, name', [('pickup', 'ThengaPickupEvent'), ('placement', 'ThengaPlacementEvent'),
+                                         ('gyro', 'ThengaGyroEvent'), ('button', 'ThengaButtonEvent'),
+                                         ('status', 'ThengaStatusEvent')])
+def test_event_layouts_match_the_firmware(wire, event, name):
+    assert struct_format(wire, name) == esp32_codec.HEADER.format + esp32_codec.BODIES[event].format.lstrip('<')
+
+
+def test_header_and_ack_layouts_match_the_firmware(wire):
+    assert struct_format(wire, 'ThengaEventHeader') == esp32_codec.HEADER.format
+    assert struct_format(wire, 'ThengaAck') == esp32_codec.ACK.format
+    assert (esp32_codec.HEADER.size, esp32_codec.ACK.size) == (26, 7)
+
+
+@pytest.mark.parametrize('event', list(EVENTS))
+def test_round_trip(event):
+    fields = dict(EVENTS[event], device_id='coconut-7', timestamp=123456, sensor='MPU6050')
+    raw = esp32_codec.encode_event(event, fields, seq=70000)
+    assert len(raw) == esp32_codec.HEADER.size + esp32_codec.BODIES[event].size
+    decoded_event, data = esp32_codec.decode_event(raw)
+    assert decoded_event == event
+    assert data['event_type'] == esp32_codec.JSON_EVENT_TYPES[event]
+    assert data['seq'] == 70000 & 0xFFFF
+    assert {key: data[key] for key in fields} == fields
+
+
+def test_device_id_is_cut_to_the_field():
+    raw = esp32_codec.encode_event('pickup', {'device_id': 'x' * 40})
+    assert esp32_codec.decode_event(raw)[1]['device_id'] == 'x' * esp32_codec.DEVICE_ID_SIZE
+
+
+def test_ack_round_trip():
+    raw = esp32_codec.encode_ack('gyro', 9, 200, True)
+    assert len(raw) == esp32_codec.ACK.size
+    assert esp32_codec.decode_ack(raw) == {'version': esp32_codec.SCHEMA_VERSION, 'event': 'gyro', 'seq': 9,
+                                           'status': 200, 'audio_played': True}
+
+
+@pytest.mark.parametrize('event', list(EVENTS))
+def test_truncated_events_are_rejected(event):
+    raw = esp32_codec.encode_event(event, EVENTS[event])
+    for length in (0, esp32_codec.HEADER.size - 1, len(raw) - 1):
+        if length == len(raw) - 1 and event == 'pickup':
+            continue
+        with pytest.raises(esp32_codec.WireFormatError):
+            esp32_codec.decode_event(raw[:length])
+    with pytest.raises(esp32_codec.WireFormatError):
+        esp32_codec.decode_event(raw + b'\x00')
+
+
+def test_wrong_version_is_rejected():
+    raw = bytearray(esp32_codec.encode_event('button', EVENTS['button']))
+    raw[0] = esp32_codec.SCHEMA_VERSION + 1
+    with pytest.raises(esp32_codec.WireFormatError, match='version'):
+        esp32_codec.decode_event(bytes(raw))
+
+
+def test_unknown_event_is_rejected():
+    raw = bytearray(esp32_codec.encode_event('pickup', {}))
+    raw[1] = 99
+    with pytest.raises(esp32_codec.WireFormatError, match='event code'):
+        esp32_codec.decode_event(bytes(raw))
+    with pytest.raises(esp32_codec.WireFormatError):
+        esp32_codec.encode_event('shake', {})
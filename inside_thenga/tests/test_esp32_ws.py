@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import esp32_ws
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+
+def test_decode_frame():
+    assert esp32_ws.decode_frame(b'{"t":"gyro","x":1}') == ('gyro', {'x': 1})
+
+
+@pytest.mark.parametrize('raw', ['[1]', '{"x":1}', '{"t":[1]}', '{"t":null}', '{"t":5}', 'not json'])
+def test_decode_frame_rejects_malformed_frames(raw):
+    with pytest.raises(ValueError):
+        esp32_ws.decode_frame(raw)
+
+
+@pytest.mark.parametrize('command, params, error', [
+    ('led', {'state': True}, None),
+    ('motor_start', {}, None),
+    ('dance', {}, 'Unknown command'),
+    (['led'], {}, 'Unknown command'),
+    ('led', {}, 'requires: state'),
+    ('led', {'state': True, 'id': 1}, 'id'),
+    ('led', {'state': True, 'cmd': 'x'}, 'cmd'),
+    ('led', {'state': True, 't': 'ping'}, 't'),
+])
+def test_validate_command(command, params, error):
+    result = esp32_ws.validate_command(command, params)
+    if error is None:
+        assert result is None
+    else:
+        assert error in result
+
+
+def test_send_command_sends_only_the_commands_params():
+    socket = FakeSocket()
+    connection = esp32_ws.DeviceConnection('device', socket)
+    assert connection.send_command('set_threshold', {'value': 2.5, 'extra': 1, 't': 'ping'}) == 1
+    assert json.loads(socket.sent[0]) == {'t': 'cmd', 'id': 1, 'cmd': 'set_threshold', 'value': 2.5}
+    assert connection.send_command('motor_stop', {}) == 2
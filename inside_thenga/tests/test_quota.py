@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+
+import quota
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quota.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def advance(scheduler, clock, seconds):
+    """Move the injected clock and wake callers waiting in the queue"""
+    clock[0] += seconds
+    with scheduler._condition:
+        scheduler._condition.notify_all()
+
+
+def queue(scheduler, name, outcomes, **kwargs):
+    """Start an acquire() on a thread and wait until it is in the queue"""
+    depth = len(scheduler._queue)
+
+    def acquire():
+        try:
+            scheduler.acquire(10, **kwargs)
+            outcomes.append(name)
+        except quota.QuotaExceeded as e:
+            outcomes.append((name, str(e)))
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    while len(scheduler._queue) == depth:
+        time.sleep(0.001)
+    return thread
+
+
+def test_admits_within_the_request_quota(clock):
+    scheduler = quota.QuotaScheduler(rpm=2, tpm=1000)
+    scheduler.acquire(10)
+    clock[0] += 5
+    scheduler.acquire(10)
+    with pytest.raises(quota.QuotaExceeded) as error:
+        scheduler.acquire(10, max_wait=0)
+    # The oldest call leaves the window 55 s from now
+    assert error.value.retry_after == pytest.approx(55)
+    clock[0] += 55
+    scheduler.acquire(10, max_wait=0)
+    assert scheduler.snapshot()['requests_in_window'] == 2
+
+
+def test_admits_within_the_token_quota(clock):
+    scheduler = quota.QuotaScheduler(rpm=100, tpm=1000)
+    scheduler.acquire(600)
+    with pytest.raises(quota.QuotaExceeded):
+        scheduler.acquire(600, max_wait=0)
+    # A call larger than the whole quota still gets in on its own
+    clock[0] += 60
+    scheduler.acquire(5000, max_wait=0)
+
+
+def test_settle_replaces_the_estimate(clock):
+    scheduler = quota.QuotaScheduler(rpm=100, tpm=1000)
+    reservation = scheduler.acquire(600)
+    reservation.settle(100)
+    assert scheduler.snapshot()['tokens_in_window'] == 100
+    scheduler.acquire(600, max_wait=0)
+    assert scheduler.snapshot()['tokens_in_window'] == 700
+
+
+def test_settle_after_the_window_leaves_the_count_alone(clock):
+    scheduler = quota.QuotaScheduler(rpm=100, tpm=1000)
+    reservation = scheduler.acquire(600)
+    clock[0] += 61
+    assert scheduler.snapshot()['tokens_in_window'] == 0
+    reservation.settle(900)
+    assert scheduler.snapshot()['tokens_in_window'] == 0
+
+
+def test_background_work_gets_half_the_quota(clock):
+    scheduler = quota.QuotaScheduler(rpm=4, tpm=1000)
+    scheduler.acquire(10, priority='background')
+    scheduler.acquire(10, priority='background')
+    with pytest.raises(quota.QuotaExceeded):
+        scheduler.acquire(10, priority='background', max_wait=0)
+    scheduler.acquire(10, priority='interactive', max_wait=0)
+    with pytest.raises(quota.QuotaExceeded):
+        scheduler.acquire(600, priority='background', max_wait=0)
+
+
+def test_block_holds_every_call(clock):
+    scheduler = quota.QuotaScheduler(rpm=100, tpm=1000)
+    scheduler.block(10)
+    with pytest.raises(quota.QuotaExceeded) as error:
+        scheduler.acquire(10, max_wait=5)
+    assert error.value.retry_after == pytest.approx(10)
+    # A shorter hold does not cut a longer one short
+    scheduler.block(2)
+    clock[0] += 10
+    scheduler.acquire(10, max_wait=0)
+    assert scheduler.snapshot()['blocked_for_s'] == 0
+
+
+def test_queued_calls_are_admitted_by_priority(clock):
+    scheduler = quota.QuotaScheduler(rpm=1, tpm=1000)
+    scheduler.acquire(10)
+    outcomes = []
+    threads = [queue(scheduler, 'background', outcomes, priority='background', max_wait=200),
+               queue(scheduler, 'interactive', outcomes, priority='interactive', max_wait=200)]
+    advance(scheduler, clock, 60)
+    while not outcomes:
+        time.sleep(0.001)
+    advance(scheduler, clock, 60)
+    for thread in threads:
+        thread.join(2)
+    assert outcomes == ['interactive', 'background']
+    assert scheduler.snapshot()['queued'] == 0
+
+
+def test_queued_call_times_out(clock):
+    scheduler = quota.QuotaScheduler(rpm=1, tpm=1000)
+    scheduler.acquire(10)
+    clock[0] += 50
+    outcomes = []
+    first = queue(scheduler, 'first', outcomes, max_wait=20)
+    second = queue(scheduler, 'second', outcomes, max_wait=15)
+    advance(scheduler, clock, 10)
+    first.join(2)
+    # 'second' was next in line, but the call ahead took the only request in the window
+    advance(scheduler, clock, 6)
+    second.join(2)
+    assert outcomes == ['first', ('second', 'Timed out waiting for Gemini quota')]
+
+
+def test_full_queue_rejects(clock):
+    scheduler = quota.QuotaScheduler(rpm=1, tpm=1000, max_queue=1)
+    scheduler.acquire(10)
+    outcomes = []
+    waiter = queue(scheduler, 'waiter', outcomes, max_wait=100)
+    with pytest.raises(quota.QuotaExceeded, match='Too many'):
+        scheduler.acquire(10, max_wait=100)
+    advance(scheduler, clock, 60)
+    waiter.join(2)
+    assert outcomes == ['waiter']
+
+
+def test_retry_after_is_at_least_a_second():
+    assert quota.QuotaExceeded('busy', 0.2).retry_after == 1.0
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import metrics
+import singleflight
+
+CALLERS = 8
+
+
+def run_concurrently(group, key, fn):
+    """Start CALLERS do() calls for one key while fn is held, then let fn finish"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def leader_call():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    with ThreadPoolExecutor(CALLERS) as pool:
+        first = pool.submit(group.do, key, leader_call, 5)
+        assert started.wait(5)
+        rest = [pool.submit(group.do, key, leader_call, 5) for _ in range(CALLERS - 1)]
+        # Release the leader only once every follower has joined its call
+        while metrics.COALESCED_CALLS.collect().get((group.upstream,), 0) < CALLERS - 1:
+            time.sleep(0.001)
+        release.set()
+        return [first] + rest
+
+
+def test_concurrent_callers_share_one_call():
+    group = singleflight.Group('test_shared')
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return 'answer'
+
+    futures = run_concurrently(group, 'key', fetch)
+    results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result == 'answer' for result, _ in results)
+    assert [shared for _, shared in results].count(False) == 1
+    assert group.in_flight() == 0
+
+
+def test_error_reaches_every_caller():
+    group = singleflight.Group('test_error')
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError('upstream broke')
+
+    futures = run_concurrently(group, 'key', fail)
+    for future in futures:
+        with pytest.raises(ValueError, match='upstream broke'):
+            future.result()
+    assert len(calls) == 1
+    assert group.in_flight() == 0
+
+
+def test_different_keys_do_not_coalesce():
+    group = singleflight.Group('test')
+    assert group.do('a', lambda: 1) == (1, False)
+    assert group.do('b', lambda: 2) == (2, False)
+
+
+def test_follower_times_out_waiting():
+    group = singleflight.Group('test')
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    with ThreadPoolExecutor(1) as pool:
+        leader = pool.submit(group.do, 'key', slow)
+        assert started.wait(5)
+        with pytest.raises(TimeoutError):
+            group.do('key', slow, timeout=0.05)
+        release.set()
+        assert leader.result() == ('late', False)
+
+
+def test_key_is_free_after_the_call():
+    group = singleflight.Group('test')
+    group.do('key', lambda: 'first')
+    assert group.do('key', lambda: 'second') == ('second', False)
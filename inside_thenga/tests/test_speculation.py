@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+import speculation
+
+
+@pytest.fixture
+def speculator():
+    speculator = speculation.Speculator(workers=2)
+    yield speculator
+    speculator._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def work(turn):
+    return f'answer to {turn.text}'
+
+
+def test_stable_prefix_starts_work(speculator):
+    first = speculator.observe('s', 'turn on', 'translate', 'text', work)
+    assert first == {'stable_prefix': '', 'started': False, 'speculating': None}
+    second = speculator.observe('s', 'Turn on, the', 'translate', 'text', work)
+    assert second['stable_prefix'] == 'Turn on,'
+    assert second['started'] and second['speculating'] == 'Turn on,'
+
+
+def test_short_prefix_is_not_worth_a_call(speculator):
+    speculator.observe('s', 'hello', 'translate', 'text', work)
+    report = speculator.observe('s', 'hello there', 'translate', 'text', work)
+    assert report['stable_prefix'] == 'hello'
+    assert not report['started']
+
+
+def test_same_prefix_is_not_restarted(speculator):
+    calls = []
+    speculator.observe('s', 'turn on the', 'translate', 'text', calls.append)
+    speculator.observe('s', 'turn on the', 'translate', 'text', calls.append)
+    assert not speculator.observe('s', 'turn on the', 'translate', 'text', calls.append)['started']
+    # Another pipeline needs its own work
+    assert speculator.observe('s', 'turn on the', 'direct', 'text', calls.append)['started']
+    assert speculator.outcomes['superseded'] == 1
+
+
+def test_growing_prefix_supersedes(speculator):
+    release = threading.Event()
+    speculator.observe('s', 'turn on the', 'translate', 'text', lambda s: release.wait(5))
+    speculator.observe('s', 'turn on the', 'translate', 'text', lambda s: release.wait(5))
+    first = speculator._speculations['s']
+    speculator.observe('s', 'turn on the LED', 'translate', 'text', work)
+    speculator.observe('s', 'turn on the LED', 'translate', 'text', work)
+    release.set()
+    assert first.cancelled.is_set()
+    assert speculator._speculations['s'].text == 'turn on the LED'
+    assert speculator.outcomes == {'started': 2, 'superseded': 1}
+
+
+def test_claim_on_the_same_words(speculator):
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    claimed = speculator.claim('s', 'Turn on the!')
+    assert claimed is not None
+    assert claimed.result(timeout=2) == 'answer to turn on the'
+    speculator.settle(claimed, used=True)
+    assert speculator.outcomes['hit'] == 1
+    assert speculator.snapshot()['hit_ratio'] == 1.0
+    # A claimed speculation is gone
+    assert speculator.claim('s', 'turn on the') is None
+
+
+def test_claim_on_other_words_discards(speculator):
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    pending = speculator._speculations['s']
+    assert speculator.claim('s', 'turn on the LED') is None
+    assert pending.cancelled.is_set()
+    assert speculator.outcomes['miss'] == 1
+    assert speculator.claim('other', 'turn on the') is None
+
+
+def test_stale_speculation_is_discarded(speculator, monkeypatch):
+    now = [500.0]
+    monkeypatch.setattr(speculation.time, 'monotonic', lambda: now[0])
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    now[0] += speculation.MAX_AGE_SECONDS + 1
+    assert speculator.claim('s', 'turn on the') is None
+    assert speculator.outcomes['miss'] == 1
+
+
+def test_unused_claim_is_counted(speculator):
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    speculator.observe('s', 'turn on the', 'translate', 'text', work)
+    claimed = speculator.claim('s', 'turn on the')
+    speculator.settle(claimed, used=False)
+    assert claimed.cancelled.is_set()
+    assert speculator.outcomes['unusable'] == 1
+
+
+def test_failed_work_has_no_result(speculator):
+    speculator.observe('s', 'turn on the', 'translate', 'text', lambda s: 1 / 0)
+    speculator.observe('s', 'turn on the', 'translate', 'text', lambda s: 1 / 0)
+    assert speculator.claim('s', 'turn on the').result(timeout=2) is None
@@ -0,0 +1,84 @@
+import pytest
+
+import speech_text
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('**Hello** there, *friend*!', 'Hello there, friend!'),
+    ('snake_case_name stays, _this_ and __that__ lose marks', 'snake_case_name stays, this and that lose marks'),
+    ('Run `pip install` now', 'Run pip install now'),
+    ('Before\n```python\nprint("hi")\n```\nAfter', 'Before. After.'),
+    ('Unclosed ```code block to the end', 'Unclosed'),
+    ('See [the docs](https://example.com/docs) or ![logo](logo.png)', 'See the docs or logo'),
+    ('Visit https://example.com today', 'Visit today'),
+    ('Coconuts 🥥 are great 👍🏽!', 'Coconuts are great!'),
+    ('Heart ❤️ and family 👨‍👩‍👧 emoji', 'Heart and family emoji'),
+    ('Mixed | table ~ symbols #', 'Mixed table symbols'),
+    ('Spaces   before  marks , too !', 'Spaces before marks, too!'),
+    ('Plain sentence with no markup.', 'Plain sentence with no markup.'),
+])
+def test_clean_removes_markup(text, expected):
+    assert speech_text.clean(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('# Weather\n- Sunny\n- 30°C\n1. Drink water\n> Stay cool', 'Weather. Sunny. 30 degrees Celsius. Drink water. Stay cool.'),
+    ('Options:\n* one,\n* two!', 'Options: one, two!'),
+    ('Single line list item\n\n\n', 'Single line list item'),
+])
+def test_clean_turns_lines_into_sentences(text, expected):
+    assert speech_text.clean(text) == expected
+
+
+@pytest.mark.parametrize('text, language, expected', [
+    ('It is 30°C', 'en', 'It is 30 degrees Celsius'),
+    ('It is 30 ℃ and 86°F', 'en', 'It is 30 degrees Celsius and 86 degrees Fahrenheit'),
+    ('Humidity 45%', 'en', 'Humidity 45 percent'),
+    ('Battery 2000mAh at 500 mA', 'en', 'Battery 2000 milliamp hours at 500 milliamps'),
+    ('Speed 12.5 km/h, 3,5 km', 'en', 'Speed 12.5 kilometres per hour, 3,5 kilometres'),
+    ('Latency 40ms at 2.4GHz', 'en', 'Latency 40 milliseconds at 2.4 gigahertz'),
+    ('A 5 Volt rail and 10 Watts', 'en', 'A 5 Volt rail and 10 Watts'),
+    ('The V8 and W engines', 'en', 'The V8 and W engines'),
+    ('താപനില 30°C ആണ്', 'ml', 'താപനില 30 ഡിഗ്രി സെൽഷ്യസ് ആണ്'),
+    ('ബാറ്ററി 80%', 'ml', 'ബാറ്ററി 80 ശതമാനം'),
+    ('It is 30°C', 'fr', 'It is 30 degrees Celsius'),
+])
+def test_clean_writes_units_out(text, language, expected):
+    assert speech_text.clean(text, language) == expected
+
+
+def test_clean_keeps_malayalam_chillu_joiners():
+    text = 'അവന്‍ വന്നു'
+    assert speech_text.clean(text, 'ml') == text
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('The temperature today is 31.5 degrees in Kochi. Tomorrow it will rain a lot more.',
+     ['The temperature today is 31.5 degrees in Kochi.', 'Tomorrow it will rain a lot more.']),
+    ('The motor runs at 1.5 V, i.e. very slowly, so it is safe. Nothing else to add here.',
+     ['The motor runs at 1.5 V, i.e. very slowly, so it is safe.', 'Nothing else to add here.']),
+    ('Talk to our family doctor, Dr. Menon, about it. Then come back to me later.',
+     ['Talk to our family doctor, Dr. Menon, about it.', 'Then come back to me later.']),
+    ('The letter was signed by John K. Varghese himself. Read it aloud now please.',
+     ['The letter was signed by John K. Varghese himself.', 'Read it aloud now please.']),
+    ('Ha! Okay. That is a really good question to ask!', ['Ha! Okay. That is a really good question to ask!']),
+    ('This first sentence is long enough. Yes.', ['This first sentence is long enough. Yes.']),
+    ('Is it raining outside right now? Really, truly, honestly!', ['Is it raining outside right now?', 'Really, truly, honestly!']),
+    ('First line is long enough here\nSecond line is long enough too', ['First line is long enough here', 'Second line is long enough too']),
+    ('ഇത് ഒരു വാക്യം ആണ് കേട്ടോ। ഇത് മറ്റൊരു വാക്യം ആണ് കേട്ടോ।', ['ഇത് ഒരു വാക്യം ആണ് കേട്ടോ।', 'ഇത് മറ്റൊരു വാക്യം ആണ് കേട്ടോ।']),
+    ('Short.', ['Short.']),
+    ('   ', []),
+])
+def test_split_sentences(text, expected):
+    assert speech_text.split_sentences(text) == expected
+
+
+@pytest.mark.parametrize('text, max_chars, expected', [
+    ('One sentence. Two sentence.', 0, 'One sentence. Two sentence.'),
+    ('One sentence. Two sentence.', 100, 'One sentence. Two sentence.'),
+    ('One sentence. Two sentence.', 20, 'One sentence.'),
+    ('no sentence end in this text', 12, 'no sentence'),
+    ('unbroken', 4, 'unbr'),
+])
+def test_cap(text, max_chars, expected):
+    assert speech_text.cap(text, max_chars) == expected
@@ -0,0 +1,130 @@
+# Per-request traces: a trace ID plus the timing of each pipeline stage and
+# the upstream HTTP calls made inside it. Stages also feed the /metrics
+# stage histograms, so a trace and the aggregate metrics never disagree.
+import contextvars
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import metrics
+
+TRACE_HEADER = 'X-Trace-Id'
+
+# Accept caller-supplied trace IDs only if they are short and header-safe
+_VALID_TRACE_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+_current_trace = contextvars.ContextVar('thenga_trace', default=None)
+
+
+class RequestTrace:
+    """Timeline of one request: ID, monotonic start and per-stage durations"""
+
+    def __init__(self, pipeline, trace_id=None):
+        if not trace_id or not _VALID_TRACE_ID.match(trace_id):
+            trace_id = uuid.uuid4().hex[:16]
+        self.trace_id = trace_id
+        self.pipeline = pipeline
+        self.started_at = datetime.now().isoformat()
+        self.start_monotonic = time.monotonic()
+        self.stages = []
+        self._active_stage = None
+        self.total_ms = None
+
+    def _elapsed_ms(self, now=None):
+        now = time.monotonic() if now is None else now
+        return (now - self.start_monotonic) * 1000
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage into this trace and into thenga_stage_duration_seconds"""
+        entry = {'stage': name, 'start_ms': round(self._elapsed_ms(), 2), 'upstream': []}
+        previous = self._active_stage
+        self._active_stage = entry
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            duration = time.perf_counter() - start
+            entry['duration_ms'] = round(duration * 1000, 2)
+            metrics.STAGE_SECONDS.observe(duration, pipeline=self.pipeline, stage=name)
+            self._active_stage = previous
+            self.stages.append(entry)
+
+    def record_upstream(self, upstream, status, bytes_sent, bytes_received, error=None, coalesced=False):
+        """Attach an upstream HTTP call to the stage that is currently running"""
+        call = {
+            'upstream': upstream,
+            'status': status,
+            'bytes_sent': bytes_sent,
+            'bytes_received': bytes_received
+        }
+        if error is not None:
+            call['error'] = error
+        if coalesced:
+            call['coalesced'] = True
+        if self._active_stage is not None:
+            self._active_stage['upstream'].append(call)
+        else:
+            self.stages.append({'stage': upstream, 'start_ms': round(self._elapsed_ms(), 2), 'upstream': [call]})
+
+    def finish(self):
+        self.total_ms = round(self._elapsed_ms(), 2)
+        return self
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'pipeline': self.pipeline,
+            'started_at': self.started_at,
+            'start_monotonic': round(self.start_monotonic, 6),
+            'total_ms': self.total_ms if self.total_ms is not None else round(self._elapsed_ms(), 2),
+            'stages': self.stages
+        }
+
+
+@contextmanager
+def start_trace(pipeline, trace_id=None):
+    """Make a new trace current for the duration of a request"""
+    trace = RequestTrace(pipeline, trace_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_upstream(upstream, response):
+    """Record a requests.Response against the current trace, if any"""
+    trace = _current_trace.get()
+    if trace is None or response is None:
+        return
+    # Count the request payload: JSON body for POSTs, the query string for GETs
+    bytes_sent = 0
+    if response.request is not None:
+        body = response.request.body or b''
+        bytes_sent = len(body.encode('utf-8') if isinstance(body, str) else body)
+        bytes_sent += len(urlsplit(response.request.url).query)
+    trace.record_upstream(upstream, response.status_code, bytes_sent, len(response.content or b''))
+
+
+def record_upstream_error(upstream, error):
+    """Record an upstream call that failed before any HTTP response arrived"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record_upstream(upstream, None, 0, 0, error=type(error).__name__)
+
+
+def record_coalesced(upstream, ok):
+    """Record a call answered by an identical call already in flight (no bytes of its own)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record_upstream(upstream, 200 if ok else None, 0, 0,
+                              error=None if ok else 'shared_failure', coalesced=True)
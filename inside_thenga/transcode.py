@@ -0,0 +1,193 @@
+# Audio format negotiation and transcoding. edge-tts and gTTS produce MP3;
+# clients on slow links can ask for Opus in an Ogg container, or MP3 at a
+# lower bitrate, with the Accept header (audio/ogg) or ?format=opus&bitrate=24.
+# A file is transcoded by ffmpeg once per variant and the result is kept in a
+# .variants directory next to it; streamed /tts audio is piped through ffmpeg
+# as it is produced. Without ffmpeg everything is served as MP3.
+import os
+import shutil
+import subprocess
+import threading
+
+import metrics
+import singleflight
+import logs
+
+log = logs.get_logger('transcode')
+
+FORMATS = {
+    'mp3': {'mimetype': 'audio/mpeg', 'extension': '.mp3', 'codec': 'libmp3lame', 'muxer': 'mp3'},
+    'opus': {'mimetype': 'audio/ogg', 'extension': '.ogg', 'codec': 'libopus', 'muxer': 'ogg'},
+}
+# Accept header types by preference on a tie; */* gets MP3, which every client plays
+ACCEPT_TYPES = {'audio/mpeg': 'mp3', 'audio/mp3': 'mp3', 'audio/ogg': 'opus', 'audio/opus': 'opus',
+                'application/ogg': 'opus'}
+SOURCE_FORMATS = {'.mp3': 'mp3', '.ogg': 'opus', '.opus': 'opus', '.wav': 'wav'}
+
+# kbps; speech stays clear in Opus at half of edge-tts's 48 kbps MP3
+DEFAULT_OPUS_BITRATE = 24
+DEFAULT_MP3_BITRATE = 48
+MIN_BITRATE = 6
+MAX_BITRATE = 128
+
+VARIANT_DIR = '.variants'
+
+
+class Transcoder:
+    def __init__(self, ffmpeg='ffmpeg', opus_bitrate=DEFAULT_OPUS_BITRATE):
+        self.ffmpeg = ffmpeg
+        self.opus_bitrate = opus_bitrate
+        self._available = None
+        self._flight = singleflight.Group('transcode')
+        self._lock = threading.Lock()
+        self.bytes_served = {}  # route -> format -> bytes
+
+    def configure(self, ffmpeg, opus_bitrate):
+        self.ffmpeg = ffmpeg
+        self.opus_bitrate = opus_bitrate
+        self._available = None
+
+    def available(self):
+        """Whether ffmpeg can be run (checked once)"""
+        if self._available is None:
+            self._available = shutil.which(self.ffmpeg) is not None
+            if not self._available:
+                log.warning('ffmpeg not found; audio is served as MP3 only', extra={'fields': {'ffmpeg': self.ffmpeg}})
+        return self._available
+
+    def negotiate(self, accept, requested_format=None, requested_bitrate=None):
+        """(format, bitrate kbps or None) from an explicit format/bitrate or the Accept header
+
+        bitrate None means the source's own encoding. Raises ValueError for an unknown
+        format or a bitrate outside MIN_BITRATE-MAX_BITRATE.
+        """
+        if requested_format:
+            fmt = requested_format.lower()
+            if fmt == 'ogg':
+                fmt = 'opus'
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown audio format, use one of: {', '.join(FORMATS)}")
+        else:
+            best = accept.best_match(list(ACCEPT_TYPES)) if accept else None
+            fmt = ACCEPT_TYPES.get(best, 'mp3')
+        bitrate = None
+        if requested_bitrate:
+            try:
+                bitrate = int(str(requested_bitrate).lower().rstrip('k'))
+            except ValueError:
+                raise ValueError('bitrate must be a number of kbps') from None
+            if not MIN_BITRATE <= bitrate <= MAX_BITRATE:
+                raise ValueError(f'bitrate must be between {MIN_BITRATE} and {MAX_BITRATE} kbps')
+        if fmt == 'opus' and bitrate is None:
+            bitrate = self.opus_bitrate
+        if (fmt != 'mp3' or bitrate) and not self.available():
+            return 'mp3', None
+        return fmt, bitrate
+
+    def _command(self, source, fmt, bitrate, target):
+        spec = FORMATS[fmt]
+        command = [self.ffmpeg, '-v', 'error', '-y', '-i', source, '-vn', '-c:a', spec['codec'], '-b:a', f'{bitrate}k']
+        if fmt == 'opus':
+            # Speech tuning, and short Ogg pages so a piped stream starts playing quickly
+            command += ['-application', 'voip', '-page_duration', '200000']
+        return command + ['-f', spec['muxer'], target]
+
+    def converts(self, source, fmt, bitrate):
+        """Whether variant() would transcode `source` rather than return it as it is"""
+        source_format = SOURCE_FORMATS.get(os.path.splitext(source)[1].lower())
+        return not (fmt == source_format and bitrate is None) and self.available()
+
+    def variant(self, source, fmt, bitrate):
+        """Path of `source` in this format and bitrate, transcoding it once if needed
+
+        Returns (path, format); the source itself (in its own format) when no conversion
+        is asked for, or when ffmpeg is missing or fails.
+        """
+        source_format = SOURCE_FORMATS.get(os.path.splitext(source)[1].lower())
+        if not self.converts(source, fmt, bitrate):
+            return source, source_format
+        bitrate = bitrate or DEFAULT_MP3_BITRATE
+        directory, name = os.path.split(source)
+        target = os.path.join(directory, VARIANT_DIR, f'{name}.{bitrate}k{FORMATS[fmt]["extension"]}')
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+            metrics.record_cache('audio_variant', True)
+            return target, fmt
+        metrics.record_cache('audio_variant', False)
+
+        def convert():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            partial = f'{target}.{threading.get_ident()}.tmp'
+            with metrics.stage('audio', f'transcode_{fmt}'):
+                result = subprocess.run(self._command(source, fmt, bitrate, partial), capture_output=True, timeout=60)
+            if result.returncode != 0:
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip() or f'ffmpeg exited with {result.returncode}')
+            os.replace(partial, target)
+            return target
+
+        # Concurrent requests for the same variant wait for one ffmpeg run
+        try:
+            path, _ = self._flight.do(target, convert, timeout=90)
+        except Exception as e:
+            log.warning('Transcoding failed, serving the source', extra={'fields': {'file': name, 'format': fmt, 'error': str(e)}})
+            return source, source_format
+        return path, fmt
+
+    def pipe(self, chunks, fmt, bitrate):
+        """Transcode an MP3 byte stream as it arrives; yields the converted bytes"""
+        process = subprocess.Popen(self._command('pipe:0', fmt, bitrate, 'pipe:1'), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def feed():
+            try:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+                    process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass
+            finally:
+                chunks.close()
+                try:
+                    process.stdin.close()
+                except (BrokenPipeError, ValueError):
+                    pass
+
+        threading.Thread(target=feed, name='thenga-transcode-feed', daemon=True).start()
+        try:
+            while True:
+                data = os.read(process.stdout.fileno(), 65536)
+                if not data:
+                    break
+                yield data
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+    def metered(self, chunks, route, fmt):
+        """Pass a response body through, counting its bytes as they are sent"""
+        try:
+            for chunk in chunks:
+                self.count(route, fmt, len(chunk))
+                yield chunk
+        finally:
+            chunks.close()
+
+    def count(self, route, fmt, size):
+        """Record bytes of audio served by a route in a format"""
+        with self._lock:
+            formats = self.bytes_served.setdefault(route, {})
+            formats[fmt] = formats.get(fmt, 0) + size
+        metrics.AUDIO_BYTES_SERVED.inc(size, route=route, format=fmt)
+
+    def snapshot(self):
+        with self._lock:
+            served = {route: dict(formats) for route, formats in self.bytes_served.items()}
+        return {
+            'ffmpeg': self.available(),
+            'formats': {fmt: spec['mimetype'] for fmt, spec in FORMATS.items()},
+            'opus_bitrate_kbps': self.opus_bitrate,
+            'bytes_served': served
+        }
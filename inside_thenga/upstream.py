@@ -0,0 +1,381 @@
+# Pluggable layer for every call that leaves the server: Gemini and Google
+# Translate over HTTP, and speech synthesis through edge-tts and gTTS.
+#
+# Modes (THENGA_UPSTREAM_MODE):
+#   live     call the real services (default)
+#   record   call the real services and append every exchange to a cassette
+#   replay   serve exchanges from the cassette without touching the network
+#
+# A cassette is a directory holding interactions.jsonl (one exchange per line,
+# keyed by a hash of the request with the API key removed) and blobs/ with
+# audio and binary bodies stored once by content hash. Replay sleeps for the
+# recorded latency (THENGA_REPLAY_LATENCY=original) or not at all (=zero).
+#
+# Every call goes through the upstream's circuit breaker (breaker.py), so an
+# unhealthy service fails fast whichever layer is active.
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+import breaker
+
+MODES = ('live', 'record', 'replay')
+REPLAY_LATENCIES = ('original', 'zero')
+
+# Query parameters that must never reach a cassette or its keys
+SECRET_PARAMS = ('key',)
+
+INTERACTIONS_FILE = 'interactions.jsonl'
+BLOB_DIR = 'blobs'
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """A replayed request has no recording; behaves like an unreachable upstream"""
+
+
+class ReplayedError(RuntimeError):
+    """Re-raised in replay for a synthesis call that failed while recording"""
+
+
+def _redact_url(url):
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _scrub(text, url):
+    """Remove secret query values (which requests errors quote with the URL) from a message"""
+    for name, value in parse_qsl(urlsplit(url).query):
+        if name in SECRET_PARAMS and value:
+            text = text.replace(value, 'REDACTED')
+    return text
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()[:32]
+
+
+def _http_key(upstream, prepared):
+    # Scheme and host are left out so a cassette replays wherever the upstream URL points
+    parts = urlsplit(_redact_url(prepared.url))
+    return _hash(upstream, prepared.method, parts.path, parts.query, prepared.body or b'')
+
+
+def _synthesis_key(upstream, text, voice):
+    return _hash(upstream, voice, text)
+
+
+def _edge_tts():
+    """Import edge-tts on first use (it pulls in aiohttp), applying EDGE_TTS_WSS_URL"""
+    import edge_tts
+    if os.getenv('EDGE_TTS_WSS_URL'):
+        # edge-tts has no endpoint option, so replace the URL its synthesizer connects to
+        edge_tts.communicate.WSS_URL = os.getenv('EDGE_TTS_WSS_URL')
+    return edge_tts
+
+
+def _gtts():
+    from gtts import gTTS
+    return gTTS
+
+
+def warm_up():
+    """Import the TTS clients ahead of the first request (the replay layer never needs them)"""
+    if active().mode != 'replay':
+        _edge_tts()
+        _gtts()
+
+
+class LiveUpstream:
+    """Talks to the real services"""
+    mode = 'live'
+
+    def send(self, upstream, prepared, timeout):
+        with requests.Session() as session:
+            return session.send(prepared, timeout=timeout)
+
+    async def edge_tts_save(self, text, voice, path, on_first_bytes=None):
+        with open(path, 'wb') as f:
+            async for message in _edge_tts().Communicate(text, voice).stream():
+                if message['type'] == 'audio':
+                    if on_first_bytes is not None and f.tell() == 0:
+                        on_first_bytes()
+                    f.write(message['data'])
+
+    def gtts_save(self, text, lang, path):
+        _gtts()(text=text, lang=lang, slow=False).save(path)
+
+
+class Cassette:
+    """Append-only store of recorded exchanges with content-addressed blobs"""
+
+    def __init__(self, path):
+        self.path = path
+        self.blob_dir = os.path.join(path, BLOB_DIR)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cursor = {}
+        index = os.path.join(path, INTERACTIONS_FILE)
+        if os.path.exists(index):
+            with open(index, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry['key'], []).append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def put_blob(self, data):
+        name = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.blob_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        return name
+
+    def get_blob(self, name):
+        with open(os.path.join(self.blob_dir, name), 'rb') as f:
+            return f.read()
+
+    def append(self, entry):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, INTERACTIONS_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._entries.setdefault(entry['key'], []).append(entry)
+
+    def next(self, key):
+        """Recordings of the same request replay in order; the last one repeats"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[min(index, len(entries) - 1)]
+
+
+class RecordingUpstream(LiveUpstream):
+    """Calls the real services and writes every exchange to the cassette"""
+    mode = 'record'
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def _record(self, key, upstream, request, started, **result):
+        entry = {'key': key, 'upstream': upstream, 'request': request,
+                 'latency': round(time.perf_counter() - started, 4)}
+        entry.update(result)
+        self.cassette.append(entry)
+
+    def send(self, upstream, prepared, timeout):
+        key = _http_key(upstream, prepared)
+        request = {'method': prepared.method, 'url': _redact_url(prepared.url)}
+        started = time.perf_counter()
+        try:
+            response = super().send(upstream, prepared, timeout)
+        except requests.exceptions.RequestException as e:
+            self._record(key, upstream, request, started, error=type(e).__name__, message=_scrub(str(e), prepared.url))
+            raise
+
+        result = {'status': response.status_code,
+                  'headers': {'Content-Type': response.headers.get('Content-Type', '')}}
+        try:
+            result['body'] = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            result['blob'] = self.cassette.put_blob(response.content)
+        self._record(key, upstream, request, started, **result)
+        return response
+
+    def _record_audio(self, upstream, text, voice, path, started, error=None):
+        key = _synthesis_key(upstream, text, voice)
+        request = {'voice': voice, 'chars': len(text)}
+        if error is not None:
+            self._record(key, upstream, request, started, error=type(error).__name__, message=str(error))
+            return
+        with open(path, 'rb') as f:
+            self._record(key, upstream, request, started, blob=self.cassette.put_blob(f.read()))
+
+    async def edge_tts_save(self, text, voice, path, on_first_bytes=None):
+        started = time.perf_counter()
+        try:
+            await super().edge_tts_save(text, voice, path, on_first_bytes)
+        except Exception as e:
+            self._record_audio('edge_tts', text, voice, path, started, e)
+            raise
+        self._record_audio('edge_tts', text, voice, path, started)
+
+    def gtts_save(self, text, lang, path):
+        started = time.perf_counter()
+        try:
+            super().gtts_save(text, lang, path)
+        except Exception as e:
+            self._record_audio('gtts', text, lang, path, started, e)
+            raise
+        self._record_audio('gtts', text, lang, path, started)
+
+
+class ReplayUpstream:
+    """Serves recorded exchanges; never touches the network"""
+    mode = 'replay'
+
+    def __init__(self, cassette, latency='original'):
+        self.cassette = cassette
+        self.latency = latency
+
+    def _entry(self, key, upstream, description):
+        entry = self.cassette.next(key)
+        if entry is None:
+            raise CassetteMiss(f'No {upstream} recording for {description} in {self.cassette.path}')
+        return entry
+
+    def _delay(self, entry):
+        return entry.get('latency', 0) if self.latency == 'original' else 0
+
+    def send(self, upstream, prepared, timeout):
+        entry = self._entry(_http_key(upstream, prepared), upstream, _redact_url(prepared.url))
+        time.sleep(self._delay(entry))
+        if 'error' in entry:
+            error = getattr(requests.exceptions, entry['error'], requests.exceptions.ConnectionError)
+            raise error(entry.get('message', 'Recorded failure'))
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers.update(entry.get('headers', {}))
+        response._content = entry['body'].encode('utf-8') if 'body' in entry else self.cassette.get_blob(entry['blob'])
+        response.encoding = 'utf-8'
+        response.url = prepared.url
+        response.request = prepared
+        return response
+
+    def _write_audio(self, entry, path):
+        if 'error' in entry:
+            raise ReplayedError(f"{entry['error']}: {entry.get('message', '')}")
+        with open(path, 'wb') as f:
+            f.write(self.cassette.get_blob(entry['blob']))
+
+    async def edge_tts_save(self, text, voice, path, on_first_bytes=None):
+        entry = self._entry(_synthesis_key('edge_tts', text, voice), 'edge_tts', voice)
+        await asyncio.sleep(self._delay(entry))
+        self._write_audio(entry, path)
+        if on_first_bytes is not None:
+            on_first_bytes()
+
+    def gtts_save(self, text, lang, path):
+        entry = self._entry(_synthesis_key('gtts', text, lang), 'gtts', lang)
+        time.sleep(self._delay(entry))
+        self._write_audio(entry, path)
+
+
+def from_environment():
+    """Build the upstream layer selected by THENGA_UPSTREAM_MODE/THENGA_CASSETTE/THENGA_REPLAY_LATENCY"""
+    mode = os.getenv('THENGA_UPSTREAM_MODE', 'live').lower()
+    if mode not in MODES:
+        raise ValueError(f"THENGA_UPSTREAM_MODE must be one of {', '.join(MODES)}, got '{mode}'")
+    if mode == 'live':
+        return LiveUpstream()
+
+    cassette = Cassette(os.getenv('THENGA_CASSETTE', os.path.join(os.path.dirname(__file__), 'cassettes', 'default')))
+    if mode == 'record':
+        return RecordingUpstream(cassette)
+
+    latency = os.getenv('THENGA_REPLAY_LATENCY', 'original').lower()
+    if latency not in REPLAY_LATENCIES:
+        raise ValueError(f"THENGA_REPLAY_LATENCY must be one of {', '.join(REPLAY_LATENCIES)}, got '{latency}'")
+    return ReplayUpstream(cassette, latency)
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active():
+    global _active
+    if _active is None:
+        with _active_lock:
+            if _active is None:
+                _active = from_environment()
+    return _active
+
+
+def use(layer):
+    """Swap the upstream layer (e.g. a ReplayUpstream in a profiling script)"""
+    global _active
+    _active = layer
+
+
+def _send(upstream, prepared, timeout):
+    circuit = breaker.get(upstream)
+    circuit.check()
+    try:
+        response = active().send(upstream, prepared, timeout)
+    except Exception:
+        circuit.record_failure()
+        raise
+    # Rate limiting and server errors count against the upstream; other 4xx are the caller's fault
+    if response.status_code == 429 or response.status_code >= 500:
+        circuit.record_failure()
+    else:
+        circuit.record_success()
+    return response
+
+
+def get(upstream, url, timeout=None, **kwargs):
+    prepared = requests.Request('GET', url, **kwargs).prepare()
+    return _send(upstream, prepared, timeout)
+
+
+def post(upstream, url, timeout=None, **kwargs):
+    prepared = requests.Request('POST', url, **kwargs).prepare()
+    return _send(upstream, prepared, timeout)
+
+
+async def edge_tts_save(text, voice, path, on_first_bytes=None):
+    """Synthesize with edge-tts; on_first_bytes() is called when the first audio arrives"""
+    circuit = breaker.get('edge_tts')
+    circuit.check()
+    audio_started = []
+
+    def first_bytes():
+        audio_started.append(True)
+        if on_first_bytes is not None:
+            on_first_bytes()
+
+    try:
+        await active().edge_tts_save(text, voice, path, first_bytes)
+    except asyncio.CancelledError:
+        # Abandoned by the caller (timeout or a hedge answered first): a hang counts
+        # against edge-tts, a stream that was already delivering audio does not
+        if audio_started:
+            circuit.release()
+        else:
+            circuit.record_failure()
+        raise
+    except Exception:
+        circuit.record_failure()
+        raise
+    circuit.record_success()
+
+
+def gtts_save(text, lang, path):
+    circuit = breaker.get('gtts')
+    circuit.check()
+    try:
+        active().gtts_save(text, lang, path)
+    except Exception:
+        circuit.record_failure()
+        raise
+    circuit.record_success()